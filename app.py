@@ -1,24 +1,41 @@
+import datetime
+import time
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import sqlite3
-from processor import extract_receipt_data
-from database import (init_db, save_receipt, get_all_receipts, delete_receipt, update_receipt,
-                      create_vendor_map_table, update_vendor_map, get_category_for_vendor,
-                      save_budget, load_budget, load_currency, save_currency)
+from processor import extract_receipt_data, REVIEW_CONFIDENCE
+from database import (init_db, use_owner, save_receipt, delete_receipt, find_duplicate,
+                      find_similar_image, get_receipt, PAGE_SIZE, get_raw_text, current_month, update_receipts_bulk,
+                      update_vendor_map, save_budget, save_currency)
 from sync_manager import pull_from_cloud
+from outbox import get_flusher, pending_count
+from dedup import dhash
+import caching
+import perf
 
-# Initialize Database
+# With RECEIPT_PERF=1, stage timings of this session's reruns feed the sidebar Performance panel
+if perf.ENABLED:
+    perf.use_recorder(st.session_state.setdefault("perf", perf.Recorder()))
+
+# Each user has their own database file; pick it before anything touches SQLite
+use_owner(st.session_state.get("current_user"))
+
+# Opens this user's database; its schema is checked once per process, not on every rerun
 init_db()
-create_vendor_map_table()
+get_flusher().start()  # Sends anything still queued from an earlier session
 
 st.set_page_config(page_title="Receipt Organizer", layout="wide")
 
+
+# The rerun shares this thread's connection, but not a transaction: reads run on their own and each
+# write takes the write lock just for itself, so OCR and cloud pulls never hold it
+rerun_started = time.perf_counter()
+
 # # LOGIN GATE
 if "current_user" not in st.session_state:
     url_user = st.query_params.get("user", "")
     if url_user:
         st.session_state.current_user = url_user
+        st.session_state.needs_refresh = True
         st.rerun()
 
     st.markdown("<h1 style='text-align: center;'>Receipt Organizer</h1>", unsafe_allow_html=True)
@@ -31,37 +48,45 @@ if "current_user" not in st.session_state:
             if input_user:
                 st.query_params["user"] = input_user
                 st.session_state.current_user = input_user
-                with st.spinner(f"Loading data..."):
-                    conn = sqlite3.connect('expenses.db')
-                    conn.execute("DELETE FROM receipts")
-                    conn.commit()
-                    conn.close()
-                    pull_from_cloud(input_user)
+                st.session_state.needs_refresh = True
                 st.rerun()
     st.stop()
 
 # # MAIN LOGIC
 user_name = st.session_state.current_user
 
+# The local copy is kept between logins, so only rows added to the sheet since the last visit are fetched
+if st.session_state.pop("needs_refresh", False):
+    with st.spinner("Checking the cloud for new receipts..."):
+        pull_from_cloud(user_name)
+
 # --- SIDEBAR ---
 if st.sidebar.button("Logout", key="sb_logout"):
+    get_flusher().stop()  # Anything still queued goes out at this user's next login
     st.session_state.clear()
     st.query_params.clear()
     st.rerun()
 
+# Reads below are served from caches keyed on these write counters, so they only hit SQLite after a change
+versions = caching.data_versions()
+
+unsynced = pending_count()
+if unsynced:
+    st.sidebar.caption(f"☁️ {unsynced} change(s) waiting to sync")
+
 st.sidebar.divider()
 st.sidebar.header("Upload New Receipt")
 uploaded_file = st.sidebar.file_uploader("Upload Image", type=["jpg", "png", "jpeg"])
 
 st.sidebar.header("Budget Settings")
-saved_budget = load_budget()
+saved_budget = caching.budget(user_name, versions['settings'])
 monthly_budget = st.sidebar.number_input("Set Monthly Budget", min_value=0.0, value=saved_budget, step=50.0)
 if monthly_budget != saved_budget:
     save_budget(monthly_budget)
     st.rerun()
 
 currency_list = ["USD", "RON", "EUR", "GBP", "CAD"]
-saved_curr = load_currency()
+saved_curr = caching.currency(user_name, versions['settings'])
 selected_currency = st.sidebar.selectbox("Select Currency", options=currency_list,
                                          index=currency_list.index(saved_curr))
 if selected_currency != saved_curr:
@@ -69,9 +94,12 @@ if selected_currency != saved_curr:
     st.rerun()
 
 # --- DATA LOADING ---
-history_df = get_all_receipts()
-total_spent = history_df['total'].sum() if not history_df.empty else 0.0
-progress_percentage = min(total_spent / monthly_budget, 1.0) if monthly_budget > 0 else 0
+# Headline numbers and charts come from the trigger-maintained summary, never a full scan
+stats = caching.dashboard_stats(user_name, versions['receipts'])
+total_spent = stats['total']
+# The budget is monthly, so it is measured against this month's receipts only
+month_spent = caching.spend(user_name, versions['receipts'], *current_month())
+progress_percentage = min(month_spent / monthly_budget, 1.0) if monthly_budget > 0 else 0
 
 # --- UPLOAD LOGIC & SMART MAPPING ---
 if uploaded_file:
@@ -79,77 +107,176 @@ if uploaded_file:
         st.session_state.saved_to_cloud = False
         st.session_state.last_file = uploaded_file.name
 
-    with st.spinner("Analyzing..."):
-        result = extract_receipt_data(uploaded_file)
-        st.sidebar.subheader("Verify Data")
-        v = st.sidebar.text_input("Vendor", value=result['vendor'])
-        t = st.sidebar.number_input("Total", value=result['total'])
-        d = st.sidebar.text_input("Date", value=result['date'])
+    # Near-identical photos are caught by their perceptual hash before any OCR runs; hashed once per upload
+    if st.session_state.get("hashed_file") != uploaded_file.file_id:
+        st.session_state.image_hash = dhash(uploaded_file.getvalue())
+        st.session_state.hashed_file = uploaded_file.file_id
+    image_hash = st.session_state.image_hash
+    similar = None if st.session_state.get('saved_to_cloud') else find_similar_image(image_hash)
+    read_anyway = True
+    if similar:
+        match = get_receipt(similar[0])
+        st.sidebar.warning(f"This photo looks like a receipt you already saved: {match['vendor']} | "
+                           f"{match['date']} | {match['total']:,.2f} {selected_currency}")
+        read_anyway = st.sidebar.checkbox("It's a different receipt, read it anyway", key="read_anyway")
 
-        # SMART MAPPING LOGIC
-        cats = ["Food & Dining", "Travel", "Supplies", "Services", "Groceries", "Transport", "Miscellaneous"]
+    if read_anyway:
+        with st.spinner("Analyzing..."):
+            # Read once per upload; the widgets below rerun the script on every keystroke
+            if st.session_state.get("extracted_file") != uploaded_file.file_id:
+                st.session_state.extracted = extract_receipt_data(uploaded_file)
+                st.session_state.extracted_file = uploaded_file.file_id
+            result = st.session_state.extracted
+            st.sidebar.subheader("Verify Data")
+            confidence = result.get('confidence') or {}
 
-        # Check if we have seen this vendor before
-        remembered_cat = get_category_for_vendor(v)
-        if remembered_cat:
-            default_cat = remembered_cat
-        else:
-            default_cat = result.get('category', "Miscellaneous")
-
-        idx = cats.index(default_cat) if default_cat in cats else 6
-        c = st.sidebar.selectbox("Category", cats, index=idx)
-
-        if st.sidebar.button("✅ Save Expense"):
-            if not st.session_state.get('saved_to_cloud'):
-                save_receipt({"vendor": v, "total": t, "date": d, "category": c, "raw_text": result['raw_text']},
-                             user_name)
-                # Update memory for next time
-                update_vendor_map(v, c)
-                st.session_state.saved_to_cloud = True
-                pull_from_cloud(user_name)
-                st.rerun()
+            def flag_if_unsure(field):
+                # Fast OCR mode reports per-field confidence; point the user at the weak ones
+                score = confidence.get(field)
+                if score is not None and score < REVIEW_CONFIDENCE:
+                    st.sidebar.caption(f"⚠️ Low OCR confidence ({score:.0f}%), please double-check")
+
+            v = st.sidebar.text_input("Vendor", value=result['vendor'])
+            flag_if_unsure('vendor')
+            t = st.sidebar.number_input("Total", value=result['total'])
+            flag_if_unsure('total')
+            d = st.sidebar.text_input("Date", value=result['date'])
+            flag_if_unsure('date')
+
+            # SMART MAPPING LOGIC
+            cats = ["Food & Dining", "Travel", "Supplies", "Services", "Groceries", "Transport", "Miscellaneous"]
+
+            # Check if we have seen this vendor before
+            remembered_cat = caching.category_for_vendor(user_name, versions['vendor_map'], v)
+            if remembered_cat:
+                default_cat = remembered_cat
+            else:
+                default_cat = result.get('category', "Miscellaneous")
+
+            idx = cats.index(default_cat) if default_cat in cats else 6
+            c = st.sidebar.selectbox("Category", cats, index=idx)
+
+            # Exact duplicates: same vendor, date and total as a stored receipt
+            dup_id = None if st.session_state.get('saved_to_cloud') else find_duplicate(v, d, t)
+            allow_dup = False
+            if dup_id is not None:
+                st.sidebar.warning(f"Receipt #{dup_id} already has this vendor, date and total.")
+                allow_dup = st.sidebar.checkbox("Save it anyway", key="allow_duplicate")
+
+            if st.sidebar.button("✅ Save Expense", disabled=dup_id is not None and not allow_dup):
+                if not st.session_state.get('saved_to_cloud'):
+                    # Fields corrected here keep their value when reprocess.py re-reads the text
+                    edited = [field for field, value, read in (("vendor", v, result['vendor']), ("total", t, result['total']),
+                                                               ("date", d, result['date']), ("category", c, default_cat))
+                              if value != read]
+                    save_receipt({"vendor": v, "total": t, "date": d, "category": c, "raw_text": result['raw_text'],
+                                  "image_hash": image_hash, "edited": edited}, user_name, allow_duplicate=allow_dup)
+                    # Update memory for next time
+                    update_vendor_map(v, c)
+                    st.session_state.saved_to_cloud = True
+                    st.rerun()
 
 # --- VISUAL DASHBOARD ---
 st.title("Receipt Expense Organizer")
 
-if not history_df.empty:
+if stats['count']:
+    summary_df = caching.summary(user_name, versions['receipts'])
     m1, m2, m3 = st.columns(3)
     m1.metric("Total Expenses", f"{total_spent:,.2f} {selected_currency}")
-    biggest = history_df.loc[history_df['total'].idxmax()]
-    m2.metric("Biggest Spender", f"{biggest['vendor']}", f"{biggest['total']:,.2f} {selected_currency}")
-    top_c = history_df['category'].value_counts().idxmax()
-    m3.metric("Top Category", top_c)
+    m2.metric("Biggest Spender", f"{stats['biggest_vendor']}",
+              f"{stats['biggest_total']:,.2f} {selected_currency}")
+    m3.metric("Top Category", stats['top_category'])
 
     st.divider()
-    st.markdown(f"**Budget Usage:** {total_spent:,.2f} / {monthly_budget:,.2f} {selected_currency}")
+    st.markdown(f"**Budget Usage (this month):** {month_spent:,.2f} / {monthly_budget:,.2f} {selected_currency}")
     st.progress(progress_percentage)
 
-    st.subheader("Recent Transactions")
-    display_df = history_df.copy()
-    display_df['total'] = display_df['total'].apply(lambda x: f"{x:,.2f} {selected_currency}")
-    st.dataframe(display_df[['vendor', 'total', 'date', 'category']], use_container_width=True, hide_index=True)
-
     st.divider()
     col_pie, col_line = st.columns(2)
     with col_pie:
         st.subheader("Spending by Category")
-        fig_pie = px.pie(history_df, values='total', names='category', hole=0.4)
-        st.plotly_chart(fig_pie, use_container_width=True)
+        with perf.stage("chart.pie"):
+            st.plotly_chart(caching.category_pie(user_name, versions['receipts']), use_container_width=True)
 
     with col_line:
         st.subheader("Spending Timeline")
         try:
-            df_plot = history_df.copy()
-            df_plot['date_dt'] = pd.to_datetime(df_plot['date'], dayfirst=True, errors='coerce')
-            df_plot = df_plot.dropna(subset=['date_dt']).sort_values('date_dt')
-            if not df_plot.empty:
-                fig_line = px.line(df_plot, x='date_dt', y='total', markers=True,
-                                   color='category', hover_data=['vendor'],
-                                   labels={'date_dt': 'Date', 'total': f'Amount ({selected_currency})'})
-                st.plotly_chart(fig_line, use_container_width=True)
+            with perf.stage("chart.line"):
+                # Built once per data version and currency; a rerun only sends the cached figure again
+                fig_line = caching.timeline_chart(user_name, versions['receipts'], selected_currency)
+                if fig_line is not None:
+                    st.plotly_chart(fig_line, use_container_width=True)
         except:
             st.info("Timeline rendering...")
 
+    # --- SEARCH (full-text over vendor, category and OCR text) ---
+    st.divider()
+    search_text = st.text_input("🔎 Search receipts", placeholder="e.g. hdmi cable", key="search_text")
+    if search_text.strip():
+        hits = caching.search(user_name, versions['receipts'], search_text)
+        if hits.empty:
+            st.caption("No receipts match.")
+        for hit in hits.itertuples():
+            snippet = hit.snippet.replace("\n", " ") if hit.snippet else ""
+            st.markdown(f"**{hit.vendor}** · {hit.date} · {hit.total:,.2f} {selected_currency} · "
+                        f"_{hit.category}_  \n{snippet}")
+
+    # --- TRANSACTIONS (one page at a time) ---
+    st.divider()
+    st.subheader("Transactions")
+    f_col1, f_col2 = st.columns(2)
+    cat_filter = f_col1.selectbox("Category", ["All"] + sorted(summary_df['category'].unique()), key="list_cat")
+    vendor_filter = f_col2.text_input("Vendor starts with", key="list_vendor").strip()
+    filters = {"category": None if cat_filter == "All" else cat_filter, "vendor": vendor_filter or None}
+
+    # Cursors of the pages visited so far, so "Newer" can step back; reset when the filters change
+    if st.session_state.get("page_filters") != filters:
+        st.session_state.page_filters = filters
+        st.session_state.page_cursors = [None]
+    cursors = st.session_state.page_cursors
+    page_df, next_cursor = caching.receipts_page(user_name, versions['receipts'], cursors[-1], PAGE_SIZE,
+                                                 filters['category'], filters['vendor'])
+
+    st.dataframe(page_df[['vendor', 'total', 'date', 'category']], use_container_width=True, hide_index=True,
+                 column_config={"total": st.column_config.NumberColumn(format=f"%.2f {selected_currency}")})
+
+    nav_prev, nav_info, nav_next = st.columns([1, 3, 1])
+    if nav_prev.button("◀ Newer", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    nav_info.caption(f"Page {len(cursors)}")
+    if nav_next.button("Older ▶", disabled=next_cursor is None, use_container_width=True):
+        cursors.append(next_cursor)
+        st.rerun()
+
+    with st.expander("🔍 Inspect receipt text"):
+        labels = {f"{r.vendor} | {r.date} | {r.total:,.2f}": r.id for r in page_df.itertuples()}
+        picked = st.selectbox("Receipt", list(labels), key="inspect_receipt")
+        if picked:
+            st.text(get_raw_text(labels[picked]) or "No OCR text stored for this receipt.")
+
+    # --- LONG-RANGE ANALYTICS ---
+    st.divider()
+    if st.toggle("📦 Long-range analytics", key="use_archive",
+                 help="Spend per month and category, and the top vendors, over any date range and categories"):
+        a_col1, a_col2, a_col3 = st.columns([1, 1, 2])
+        today = datetime.date.today()
+        a_start = a_col1.date_input("From", today - datetime.timedelta(days=3 * 365), key="archive_start")
+        a_end = a_col2.date_input("To", today, key="archive_end")
+        a_cats = a_col3.multiselect("Categories", sorted(summary_df['category'].unique()), key="archive_cats")
+
+        # Whole months come from receipt_summary; the Parquet archive (archive.py) is an export only
+        monthly = caching.monthly_totals(user_name, versions['receipts'], a_start, a_end, tuple(a_cats))
+        if monthly.empty:
+            st.caption("No receipts in this range.")
+        else:
+            with perf.stage("chart.long_range"):
+                st.plotly_chart(caching.long_range_chart(user_name, versions['receipts'], a_start, a_end,
+                                                         tuple(a_cats), selected_currency), use_container_width=True)
+            vendors = caching.top_vendors(user_name, versions['receipts'], a_start, a_end, tuple(a_cats))
+            st.dataframe(vendors, use_container_width=True, hide_index=True,
+                         column_config={"total": st.column_config.NumberColumn(format=f"%.2f {selected_currency}")})
+
     # --- MANAGEMENT SECTION ---
     st.divider()
     if "show_manage" not in st.session_state: st.session_state.show_manage = False
@@ -158,28 +285,26 @@ if not history_df.empty:
         st.session_state.show_manage = not st.session_state.show_manage
 
     if st.session_state.show_manage:
-        manage_df = history_df.copy()
+        # Edits the page shown above
+        manage_df = page_df.copy()
         manage_df.insert(0, '#', range(1, len(manage_df) + 1))
 
         edited = st.data_editor(
             manage_df,
             column_config={
-                "id": None, "raw_text": None,
+                "id": None,
                 "total": st.column_config.NumberColumn(f"total ({selected_currency})",
                                                        format=f"%.2f {selected_currency}")
             },
-            hide_index=True, use_container_width=True, key="main_editor"
+            hide_index=True, use_container_width=True, key=f"main_editor_{len(cursors)}"
         )
 
         ctrl_col1, ctrl_col2 = st.columns([1, 4])
         with ctrl_col1:
             if st.button("Save Edits", use_container_width=True):
-                for _, row in edited.iterrows():
-                    if pd.notna(row['id']):
-                        update_receipt(row['id'], row['vendor'], row['total'], row['date'], row['category'])
-                        update_vendor_map(row['vendor'], row['category'])  # Update mapping on edit too
-                pull_from_cloud(user_name)
-                st.rerun()
+                # Only the rows that actually changed are written, re-learned and sent to the cloud
+                if update_receipts_bulk(manage_df, edited):
+                    st.rerun()
         with ctrl_col2:
             row_to_del = st.selectbox("Select Row # to Delete", options=manage_df['#'], label_visibility="collapsed")
 
@@ -189,7 +314,21 @@ if not history_df.empty:
                 real_id_val = selected_row['id'].values[0]
                 if pd.notna(real_id_val):
                     delete_receipt(int(real_id_val))
-                    pull_from_cloud(user_name)
                     st.rerun()
 else:
-    st.info("No receipts found.")
\ No newline at end of file
+    st.info("No receipts found.")
+
+# Logged-out reruns stop above, and st.rerun() cuts a rerun short, so only complete dashboard reruns are timed
+perf.record("app.rerun", time.perf_counter() - rerun_started)
+
+# --- PERFORMANCE PANEL ---
+if perf.ENABLED:
+    with st.sidebar.expander("⏱️ Performance"):
+        perf_rows = st.session_state.perf.summary()
+        if perf_rows:
+            st.dataframe(pd.DataFrame(perf_rows).set_index("stage").round(2), use_container_width=True)
+        st.caption(f"Per stage over this session (percentiles of the last {perf.MAX_SAMPLES} calls). "
+                   f"Every call is also logged to {perf.LOG_PATH or 'nowhere'}.")
+        if st.button("Reset timings", key="perf_reset"):
+            st.session_state.perf.reset()
+            st.rerun()
@@ -0,0 +1,208 @@
+"""Columnar copy of the receipts in Parquet, for analytics over long histories.
+
+Layout: archive/owner=<slug>/month=YYYY-MM/receipts.parquet (month=undated for receipts without a
+readable date). sync() rewrites only the months whose receipts changed since the last sync, as
+logged by triggers in archive_dirty. Files are sorted by date, so row-group statistics let a date
+filter skip most of a file, and raw_text is its own column chunk that the analytical reads never
+project. Reads go through pyarrow.dataset with memory-mapped files and push the owner, month,
+date and category filters down to the scan, aggregating one batch at a time.
+
+Needs the optional `pyarrow` package:
+    pip install pyarrow
+    python -m archive --owner alice
+"""
+import datetime
+import os
+
+import pandas as pd
+
+import database
+import perf
+
+ARCHIVE_DIR = os.environ.get("RECEIPT_ARCHIVE_DIR", "archive")
+ROW_GROUP_SIZE = 16384
+BATCH_SIZE = 65536  # Rows aggregated at a time; memory stays flat whatever the history's length
+UNDATED = "undated"
+ANALYTIC_COLUMNS = ["id", "vendor", "total", "date", "date_iso", "category"]
+
+
+def available():
+    try:
+        import pyarrow.dataset  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()), ("vendor", pa.string()), ("total", pa.float64()), ("date", pa.string()),
+        ("date_iso", pa.date32()), ("category", pa.string()),
+        ("raw_text", pa.string()),  # Last, and only read by full exports
+    ])
+
+
+def _partition(root, owner, month):
+    return os.path.join(root, f"owner={database.owner_slug(owner)}", f"month={month or UNDATED}")
+
+
+def _month_rows(conn, month):
+    if month:
+        # Range over the listing index's sort key rather than a substring, so SQLite seeks to the month
+        where, params = "IFNULL(date_iso, '') >= ? AND IFNULL(date_iso, '') < ?", (f"{month}-01", f"{month}-32")
+    else:
+        where, params = "date_iso IS NULL", ()
+    return conn.execute(f"""SELECT id, vendor, total, date, date_iso, category, raw_text FROM receipts
+                            WHERE {where} ORDER BY IFNULL(date_iso, ''), id""", params).fetchall()
+
+
+def _number(value):
+    # Rows pulled from the sheet can carry totals as text
+    try:
+        return None if value is None or value == "" else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _day(iso):
+    try:
+        return datetime.date.fromisoformat(iso) if iso else None
+    except ValueError:
+        return None
+
+
+def _write_month(path, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(path, exist_ok=True)
+    columns = list(zip(*rows))
+    columns[2] = [_number(t) for t in columns[2]]
+    columns[4] = [_day(d) for d in columns[4]]
+    table = pa.Table.from_arrays([pa.array(col, type=field.type) for col, field in zip(columns, _schema())],
+                                 schema=_schema())
+    tmp = os.path.join(path, "receipts.parquet.tmp")
+    pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression="zstd",
+                   use_dictionary=["vendor", "category"], write_statistics=["id", "total", "date_iso"])
+    os.replace(tmp, os.path.join(path, "receipts.parquet"))  # Readers never see a half-written file
+
+
+@perf.timed("archive.sync")
+def sync(owner, root=ARCHIVE_DIR):
+    """Brings `owner`'s archive up to date with their database (the thread's current one). Returns months rewritten."""
+    with database.db_session() as conn:
+        dirty = conn.execute("SELECT month, changes FROM archive_dirty").fetchall()
+    written = 0
+    for month, changes in dirty:
+        # Each month is read in a transaction of its own, so writers are never held up for long
+        with database.db_session() as conn:
+            rows = _month_rows(conn, month)
+        path = _partition(root, owner, month)
+        if rows:
+            _write_month(path, rows)
+        elif os.path.exists(os.path.join(path, "receipts.parquet")):
+            os.remove(os.path.join(path, "receipts.parquet"))
+        with database.db_session() as conn:
+            conn.execute("DELETE FROM archive_dirty WHERE month = ? AND changes = ?", (month, changes))
+        written += 1
+    return written
+
+
+def dataset(owner=None, root=ARCHIVE_DIR):
+    """The archive (one owner's part of it, or everyone's) as a memory-mapped pyarrow dataset."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    base = os.path.join(root, f"owner={database.owner_slug(owner)}") if owner else root
+    keys = [("month", pa.string())] if owner else [("owner", pa.string()), ("month", pa.string())]
+    partitioning = ds.partitioning(pa.schema(keys), flavor="hive")
+    if not os.path.isdir(base):
+        return None
+    return ds.dataset(base, format="parquet", partitioning=partitioning,
+                      filesystem=fs.LocalFileSystem(use_mmap=True), exclude_invalid_files=True)
+
+
+def _filter(start=None, end=None, categories=None):
+    """Pushdown filter: the month bounds prune partitions, the date bounds skip row groups."""
+    import pyarrow.dataset as ds
+
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if start is not None:
+        start = pd.Timestamp(start).date()
+        expr = both(expr, (ds.field("month") >= start.strftime("%Y-%m")) & (ds.field("month") != UNDATED))
+        expr = both(expr, ds.field("date_iso") >= start)
+    if end is not None:
+        end = pd.Timestamp(end).date()
+        expr = both(expr, (ds.field("month") <= end.strftime("%Y-%m")) & (ds.field("month") != UNDATED))
+        expr = both(expr, ds.field("date_iso") <= end)
+    if categories:
+        expr = both(expr, ds.field("category").isin(list(categories)))
+    return expr
+
+
+def scan(owner, start=None, end=None, categories=None, columns=ANALYTIC_COLUMNS, root=ARCHIVE_DIR):
+    """Matching receipts as a DataFrame; raw_text only if asked for in `columns`."""
+    data = dataset(owner, root)
+    if data is None:
+        return pd.DataFrame(columns=columns)
+    return data.to_table(columns=columns, filter=_filter(start, end, categories)).to_pandas()
+
+
+def _aggregate(owner, keys, start, end, categories, root):
+    import pyarrow as pa
+
+    data = dataset(owner, root)
+    if data is None:
+        return pd.DataFrame(columns=keys + ["total", "count"])
+    partials = []
+    for batch in data.to_batches(columns=keys + ["total"], filter=_filter(start, end, categories),
+                                 batch_size=BATCH_SIZE):
+        if batch.num_rows:
+            partials.append(pa.Table.from_batches([batch]).group_by(keys).aggregate(
+                [("total", "sum"), ("total", "count")]))
+    if not partials:
+        return pd.DataFrame(columns=keys + ["total", "count"])
+    # Batches of one month can share keys; fold the small partial results together
+    df = pa.concat_tables(partials).to_pandas().rename(columns={"total_sum": "total", "total_count": "count"})
+    return df.groupby(keys, as_index=False)[["total", "count"]].sum()
+
+
+@perf.timed("archive.monthly_totals")
+def monthly_totals(owner, start=None, end=None, categories=None, root=ARCHIVE_DIR):
+    """Spend and receipt count per month and category."""
+    df = _aggregate(owner, ["month", "category"], start, end, categories, root)
+    return df.sort_values(["month", "category"], ignore_index=True)
+
+
+@perf.timed("archive.top_vendors")
+def top_vendors(owner, start=None, end=None, categories=None, limit=10, root=ARCHIVE_DIR):
+    """The vendors with the highest spend in the range."""
+    df = _aggregate(owner, ["vendor"], start, end, categories, root)
+    return df.nlargest(limit, "total").reset_index(drop=True)
+
+
+def main(argv=None):
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Brings a user's Parquet archive up to date.")
+    arg_parser.add_argument("--owner", required=True)
+    arg_parser.add_argument("--root", default=ARCHIVE_DIR)
+    args = arg_parser.parse_args(argv)
+
+    if not available():
+        arg_parser.error("the archive needs pyarrow: pip install pyarrow")
+    database.use_owner(args.owner)
+    written = sync(args.owner, args.root)
+    data = dataset(args.owner, args.root)
+    rows = data.count_rows() if data is not None else 0
+    print(f"Rewrote {written} month(s); {rows} receipts archived under {os.path.abspath(args.root)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from processor import extract_receipt_data, read_image_bytes
+from dedup import dhash
+from database import init_db, create_vendor_map_table, find_similar_image, save_receipts_batch, use_owner
+from outbox import get_flusher
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def find_images(target):
+    """Expands a directory or a glob pattern into a sorted list of image paths."""
+    if os.path.isdir(target):
+        paths = [os.path.join(target, name) for name in os.listdir(target)]
+    else:
+        paths = glob.glob(target, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _process_one(path, skip_similar=True):
+    # Runs inside a worker process, so it only returns plain picklable data
+    start = time.perf_counter()
+    try:
+        image_bytes = read_image_bytes(path)
+        # Hashed before OCR: a photo of a receipt that's already stored costs a thumbnail decode, not a read
+        image_hash = dhash(image_bytes)
+        similar = find_similar_image(image_hash) if skip_similar else None
+        if similar:
+            return path, {"similar_to": similar[0], "image_hash": image_hash}, None, time.perf_counter() - start
+        result = extract_receipt_data(io.BytesIO(image_bytes))
+        result["image_hash"] = image_hash  # Lets the app spot a later upload of the same photo
+        return path, result, None, time.perf_counter() - start
+    except Exception as e:
+        return path, None, str(e), time.perf_counter() - start
+
+
+def process_images(paths, workers=None, max_in_flight=None, owner=None, skip_similar=True):
+    """Yields (path, result, error, seconds) tuples as soon as each image finishes.
+
+    At most max_in_flight images are queued in the pool at once so memory stays
+    bounded no matter how many paths are passed in. Workers read `owner`'s database
+    (learned vendors, OCR cache, stored photo hashes), whether the pool forks or spawns them.
+    With skip_similar, a photo that looks like a stored receipt isn't read; its result is
+    just {"similar_to": receipt id, "image_hash": ...}.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    paths = iter(paths)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=use_owner, initargs=(owner,)) as pool:
+        pending = set()
+        for path in paths:
+            pending.add(pool.submit(_process_one, path, skip_similar))
+            if len(pending) >= max_in_flight:
+                break
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.add(pool.submit(_process_one, next_path, skip_similar))
+
+
+def ingest(paths, owner, workers=None, max_in_flight=None, batch_size=50, push=True, verbose=True,
+           skip_similar=True):
+    """OCRs every image in parallel and commits the results to `receipts` in batches.
+
+    Photos that look like an already stored receipt are skipped before OCR unless skip_similar is off.
+    """
+    init_db()
+    create_vendor_map_table()
+    batch = []
+    saved = 0
+    failed = 0
+    extracted = 0
+    similar = 0
+    start = time.perf_counter()
+
+    for path, result, error, seconds in process_images(paths, workers, max_in_flight, owner, skip_similar):
+        if error:
+            failed += 1
+            if verbose:
+                print(f"❌ {path}: {error} ({seconds:.2f}s)")
+            continue
+        if "similar_to" in result:
+            similar += 1
+            if verbose:
+                print(f"⏭️ {path}: looks like receipt #{result['similar_to']}, not read ({seconds:.2f}s)")
+            continue
+        if verbose:
+            print(f"✅ {path}: {result['vendor']} | {result['total']} | {result['date']} ({seconds:.2f}s)")
+        extracted += 1
+        batch.append(result)
+        if len(batch) >= batch_size:
+            saved += save_receipts_batch(batch, owner, push)
+            batch = []
+
+    if batch:
+        saved += save_receipts_batch(batch, owner, push)
+    if push:
+        # Whatever doesn't make it out here stays in the outbox for the next run or the app
+        get_flusher().drain()
+
+    elapsed = time.perf_counter() - start
+    processed = extracted + similar + failed
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    if verbose:
+        print(f"\nProcessed {processed} images in {elapsed:.2f}s ({rate:.2f} images/s), "
+              f"saved {saved}, skipped {extracted - saved} duplicates and {similar} similar photos, failed {failed}")
+    return {"saved": saved, "duplicates": extracted - saved, "similar": similar, "failed": failed,
+            "seconds": elapsed, "images_per_second": rate}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Bulk OCR a folder of receipt images into a user's database")
+    arg_parser.add_argument("target", help="Directory of images or a glob pattern such as 'scans/**/*.jpg'")
+    arg_parser.add_argument("--owner", required=True, help="Username the receipts belong to")
+    arg_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    arg_parser.add_argument("--max-in-flight", type=int, default=None,
+                            help="Images queued in the pool at once (default: 2 x workers)")
+    arg_parser.add_argument("--batch-size", type=int, default=50, help="Rows per SQLite transaction")
+    arg_parser.add_argument("--local-only", action="store_true", help="Skip pushing the new rows to the cloud sheet")
+    arg_parser.add_argument("--keep-similar", action="store_true",
+                            help="Read photos that look like a stored receipt instead of skipping them")
+    args = arg_parser.parse_args(argv)
+
+    paths = find_images(args.target)
+    if not paths:
+        print(f"No images found for {args.target}")
+        return 1
+
+    print(f"Found {len(paths)} images")
+    owner = args.owner.strip().lower()
+    use_owner(owner)
+    summary = ingest(paths, owner, args.workers, args.max_in_flight, args.batch_size, push=not args.local_only,
+                     skip_similar=not args.keep_similar)
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
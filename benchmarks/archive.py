@@ -0,0 +1,145 @@
+"""Long-range analytics: the Parquet archive against SQLite, on a synthetic multi-year history.
+
+Times the first and an incremental archive sync, then answers "spend per month and category,
+plus top vendors, for a few years of two categories" four ways, each in a fresh interpreter
+so peak memory is its own: loading every row into pandas (as the dashboard once did), a plain
+SQLite GROUP BY, database.get_monthly_totals/get_top_vendors (what the dashboard uses: whole months
+from receipt_summary) and archive.monthly_totals/top_vendors over the Parquet export.
+Everything lives in a temporary directory.
+    python -m benchmarks.archive --rows 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OWNER = "bench"
+START, END = "2018-01-01", "2021-12-31"
+CATEGORIES = ("Groceries", "Dining")
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+
+def _legacy():
+    import pandas as pd
+    import database
+    df = pd.read_sql_query("SELECT * FROM receipts", database.get_connection())
+    df["date_iso"] = pd.to_datetime(df["date_iso"])
+    df = df[df["date_iso"].between(START, END) & df["category"].isin(CATEGORIES)]
+    monthly = df.groupby([df["date_iso"].dt.strftime("%Y-%m"), "category"])["total"].agg(["sum", "count"])
+    vendors = df.groupby("vendor")["total"].sum().nlargest(10)
+    return len(monthly), len(vendors)
+
+
+def _sqlite():
+    import database
+    conn = database.get_connection()
+    where = "date_iso BETWEEN ? AND ? AND category IN (?, ?)"
+    monthly = conn.execute(f"SELECT substr(date_iso, 1, 7), category, SUM(total), COUNT(*) FROM receipts "
+                           f"WHERE {where} GROUP BY 1, 2", (START, END, *CATEGORIES)).fetchall()
+    vendors = conn.execute(f"SELECT vendor, SUM(total) AS spend FROM receipts WHERE {where} "
+                           f"GROUP BY vendor ORDER BY spend DESC LIMIT 10", (START, END, *CATEGORIES)).fetchall()
+    return len(monthly), len(vendors)
+
+
+def _dashboard():
+    import datetime
+    import database
+    start, end = datetime.date.fromisoformat(START), datetime.date.fromisoformat(END)
+    monthly = database.get_monthly_totals(start, end, CATEGORIES)
+    vendors = database.get_top_vendors(start, end, CATEGORIES)
+    return len(monthly), len(vendors)
+
+
+def _archive():
+    import archive
+    monthly = archive.monthly_totals(OWNER, START, END, CATEGORIES)
+    vendors = archive.top_vendors(OWNER, START, END, CATEGORIES)
+    return len(monthly), len(vendors)
+
+
+QUERIES = {"pandas (load all rows)": _legacy, "sqlite GROUP BY": _sqlite, "receipt_summary (app)": _dashboard,
+           "parquet archive": _archive}
+
+
+def _child(name):
+    import database
+    database.use_owner(OWNER)
+    before = _rss_mb()
+    start = time.perf_counter()
+    groups, vendors = QUERIES[name]()
+    return {"seconds": time.perf_counter() - start, "rss_mb": _rss_mb() - before, "peak_mb": _rss_mb(),
+            "groups": groups, "vendors": vendors}
+
+
+def _spawn(workdir, name):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [APP_DIR, os.environ.get("PYTHONPATH")]))}
+    out = subprocess.run([sys.executable, "-m", "benchmarks.archive", "--child", name], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _syncs(edits):
+    import archive
+    import database
+    database.use_owner(OWNER)
+    start = time.perf_counter()
+    months = archive.sync(OWNER)
+    print(f"{'initial sync':<24} {time.perf_counter() - start:8.2f} s   {months} months written")
+
+    with database.db_session() as conn:
+        ids = [r[0] for r in conn.execute("SELECT id FROM receipts ORDER BY random() LIMIT ?", (edits,))]
+        conn.executemany("UPDATE receipts SET total = total + 1 WHERE id = ?", [(i,) for i in ids])
+    start = time.perf_counter()
+    months = archive.sync(OWNER)
+    print(f"{f'sync after {edits} edits':<24} {time.perf_counter() - start:8.2f} s   {months} months written")
+    start = time.perf_counter()
+    archive.sync(OWNER)
+    print(f"{'sync, nothing changed':<24} {(time.perf_counter() - start) * 1000:8.2f} ms")
+    database.close_connection()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=200000)
+    arg_parser.add_argument("--edits", type=int, default=20, help="Receipts changed before the incremental sync")
+    arg_parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(args.child)))
+        return
+
+    import archive
+    if not archive.available():
+        arg_parser.error("the archive needs pyarrow: pip install pyarrow")
+    from benchmarks import synthetic
+    import database
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            began = time.perf_counter()
+            synthetic.build_history(database.owner_db_path(OWNER), args.rows)
+            print(f"{args.rows:,} receipts built in {time.perf_counter() - began:.1f} s")
+            _syncs(args.edits)
+        finally:
+            os.chdir(cwd)
+
+        print(f"\n{START} to {END}, {' + '.join(CATEGORIES)}:")
+        for name in QUERIES:
+            r = _spawn(tmp, name)
+            print(f"{name:<24} {r['seconds'] * 1000:8.1f} ms   +{r['rss_mb']:7.1f} MB "
+                  f"(peak RSS {r['peak_mb']:.0f} MB)   {r['groups']} month/category groups")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Cost of "Save Edits" on the Manage Transactions grid: the per-row loop vs the diff-based bulk update.
+
+Runs against a throwaway database with the cloud outbox parked, never expenses.db or the sheet.
+    python -m benchmarks.bulk_edit --rows 2000 --changed 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import database
+import outbox
+
+
+def _history(rng, rows):
+    with database.db_session() as conn:
+        conn.execute("DELETE FROM receipts")
+        conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+                         [(f"Vendor {rng.randint(1, 300)}", rng.randint(100, 20000) / 100,
+                           f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/25", "Groceries", "text")
+                          for _ in range(rows)])
+        conn.execute("DELETE FROM cloud_outbox")
+
+
+def _edit(rng, df, changed):
+    edited = df.copy()
+    for pos in rng.sample(range(len(df)), changed):
+        edited.iloc[pos, edited.columns.get_loc('category')] = "Dining"
+        edited.iloc[pos, edited.columns.get_loc('total')] += 1
+    return edited
+
+
+def _legacy_save(edited):
+    # The old button handler: every row, edited or not, written and re-learned on its own
+    for _, row in edited.iterrows():
+        database.update_receipt(row['id'], row['vendor'], row['total'], row['date'], row['category'])
+        database.update_vendor_map(row['vendor'], row['category'])
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=2000)
+    arg_parser.add_argument("--changed", type=int, default=10)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        outbox.get_flusher().start = lambda: None  # Count queued cloud writes instead of sending them
+        outbox.pending_count()
+
+        for label, save in (("per-row loop", lambda df, edited: _legacy_save(edited)),
+                            ("bulk diff", database.update_receipts_bulk)):
+            _history(rng, args.rows)
+            df = database.get_all_receipts()
+            edited = _edit(rng, df, args.changed)
+            start = time.perf_counter()
+            save(df, edited)
+            elapsed = time.perf_counter() - start
+
+            after = database.get_all_receipts()
+            assert after[['vendor', 'total', 'date', 'category']].equals(
+                edited[['vendor', 'total', 'date', 'category']]), "saved rows differ from the edited grid"
+            print(f"{label:<13} {elapsed * 1000:9.1f} ms | {outbox.pending_count():>5} cloud writes queued")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
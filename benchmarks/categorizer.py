@@ -0,0 +1,72 @@
+"""Per-receipt categorization cost as the keyword set grows, linear scan vs compiled automaton.
+
+    python -m benchmarks.categorizer --receipts 300
+"""
+import argparse
+import random
+import string
+import time
+
+from categorizer import Categorizer
+
+
+def _word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+
+
+def _keywords(rng, categories, per_category):
+    return {f"Category {c}": [_word(rng) for _ in range(per_category)] for c in range(categories)}
+
+
+def _receipt(rng, vocabulary):
+    lines = [f"{rng.choice(vocabulary).title()} {_word(rng).title()}", "123 High Street"]
+    for _ in range(rng.randint(8, 25)):
+        item = rng.choice(vocabulary) if rng.random() < 0.2 else _word(rng)
+        lines.append(f"{item} {rng.randint(1, 99)}.{rng.randint(0, 99):02d}")
+    lines.append(f"Total {rng.randint(10, 500)}.00")
+    return lines[0], "\n".join(lines)
+
+
+def _linear(category_keywords, vendor, text):
+    # The old approach: test every keyword against the text, one `in` scan each
+    vendor, text = vendor.lower(), text.lower()
+    scores = {}
+    for category, tags in category_keywords.items():
+        hits = sum(3 for tag in tags if tag in vendor) + sum(1 for tag in tags if tag in text)
+        if hits:
+            scores[category] = hits
+    return max(scores, key=scores.get) if scores else "Uncategorized"
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--receipts", type=int, default=300)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(7)
+    for categories, per_category in ((10, 10), (100, 20), (300, 30), (500, 60)):
+        keywords = _keywords(rng, categories, per_category)
+        vocabulary = [kw for words in keywords.values() for kw in words]
+        receipts = [_receipt(rng, vocabulary) for _ in range(args.receipts)]
+
+        start = time.perf_counter()
+        categorizer = Categorizer(keywords)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for vendor, text in receipts:
+            _linear(keywords, vendor, text)
+        linear = (time.perf_counter() - start) / len(receipts)
+
+        start = time.perf_counter()
+        for vendor, text in receipts:
+            categorizer.categorize(vendor, text)
+        compiled = (time.perf_counter() - start) / len(receipts)
+
+        print(f"{categories:>4} categories x {per_category:>3} keywords ({len(vocabulary):>6}) | "
+              f"build {build * 1000:7.1f} ms | linear {linear * 1e6:9.1f} us/receipt | "
+              f"automaton {compiled * 1e6:7.1f} us/receipt")
+
+
+if __name__ == "__main__":
+    main()
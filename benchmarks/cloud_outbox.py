@@ -0,0 +1,141 @@
+"""Save latency and cloud API cost: a blocking call per save/edit/delete vs the batched outbox.
+
+Runs offline against the fake worksheet backend (with simulated API latency) and a
+throwaway database, never expenses.db or the real sheet.
+    python -m benchmarks.cloud_outbox --saves 200 --edits 50 --latency 0.05
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import database
+import outbox
+import sync_manager
+from sync_manager import FakeWorksheet, sheet_row
+
+
+def _receipt(i):
+    return {"vendor": f"Vendor {i % 37}", "total": 10 + i % 90, "date": "14/03/25", "category": "Groceries",
+            "raw_text": f"Vendor {i % 37}\nTotal {10 + i % 90}.00"}
+
+
+def _legacy_save(ws, data, owner):
+    # What every save used to cost: authorize + open (two round trips), read the whole sheet, append one row
+    with database.db_session() as conn:
+        conn.execute("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+                     (data['vendor'], data['total'], data['date'], data['category'], data['raw_text']))
+    ws._call()
+    ws._call()
+    new_id = len(ws.get_all_values())
+    ws.append_row(sheet_row(new_id, owner, data))
+
+
+def _legacy_delete(ws, receipt_id):
+    # The old delete_from_cloud, which edits also went through: download everything, scan, delete one row
+    ws._call()
+    ws._call()
+    for i, row in enumerate(ws.get_all_values()):
+        if row[0] == str(receipt_id):
+            ws.delete_rows(i + 1)
+            return
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--saves", type=int, default=200)
+    arg_parser.add_argument("--edits", type=int, default=50, help="Receipts edited, and as many deleted")
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every fake API call")
+    args = arg_parser.parse_args(argv)
+
+    sheet = FakeWorksheet(latency=args.latency)
+    sync_manager.CLOUD_BACKENDS["bench"] = lambda: sheet
+    sync_manager.CLOUD_BACKEND = "bench"
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # owners/bench.db lands in the temporary directory
+        database.use_owner("bench")
+        flusher = outbox.get_flusher()
+
+        legacy_sheet = FakeWorksheet(latency=args.latency)
+        timings = []
+        for i in range(args.saves):
+            start = time.perf_counter()
+            _legacy_save(legacy_sheet, _receipt(i), "bench")
+            timings.append(time.perf_counter() - start)
+        p50, p95 = _percentiles(timings)
+        print(f"blocking push  save p50 {p50 * 1000:8.2f} ms | p95 {p95 * 1000:8.2f} ms | "
+              f"{legacy_sheet.calls} API calls")
+
+        database.clear_receipts()  # The outbox run starts from the same empty table
+
+        # Keep the background thread parked so the saves and the flush are timed separately
+        flusher.start = lambda: None
+        timings = []
+        for i in range(args.saves):
+            start = time.perf_counter()
+            database.save_receipt(_receipt(i), "bench")
+            timings.append(time.perf_counter() - start)
+        p50, p95 = _percentiles(timings)
+        print(f"outbox         save p50 {p50 * 1000:8.2f} ms | p95 {p95 * 1000:8.2f} ms | "
+              f"{outbox.pending_count()} queued")
+
+        start = time.perf_counter()
+        flusher.drain(timeout=600)
+        elapsed = time.perf_counter() - start
+        print(f"outbox flush   {args.saves} rows in {elapsed:6.2f} s ({args.saves / elapsed:8.0f} rows/s) | "
+              f"{sheet.calls} API calls")
+
+        # A failed append is retried after a backoff and never writes a row twice
+        sheet.fail_next = 1
+        for i in range(args.saves, args.saves + 5):  # New receipts; repeats would be skipped as duplicates
+            database.save_receipt(_receipt(i), "bench")
+        flusher.flush_once()
+        attempts, wait = database.get_connection().execute(
+            "SELECT attempts, next_attempt - ? FROM cloud_outbox ORDER BY seq LIMIT 1", (time.time(),)).fetchone()
+        database.get_connection().execute("UPDATE cloud_outbox SET next_attempt = 0")
+        flusher.drain()
+        ids = [row[0] for row in sheet.rows[1:]]
+        assert len(ids) == len(set(ids)) == args.saves + 5, "rows lost or duplicated"
+        local = database.get_connection().execute("SELECT COUNT(*) FROM receipts WHERE cloud_id IN (%s)" % ",".join(
+            "?" * len(ids)), ids).fetchone()[0]
+        print(f"retry check    ok (attempt {attempts} backed off {wait:.1f}s, {local} local rows carry cloud ids)")
+
+        calls = legacy_sheet.calls
+        start = time.perf_counter()
+        for receipt_id in range(1, 2 * args.edits + 1):
+            _legacy_delete(legacy_sheet, receipt_id)
+        print(f"blocking edits {2 * args.edits} edits/deletes in {time.perf_counter() - start:6.2f} s | "
+              f"{legacy_sheet.calls - calls} API calls")
+
+        calls = sheet.calls
+        ids = [row[0] for row in database.get_connection().execute(
+            "SELECT id FROM receipts ORDER BY random() LIMIT ?", (2 * args.edits,))]
+        start = time.perf_counter()
+        for receipt_id in ids[:args.edits]:
+            database.update_receipt(receipt_id, f"Edited {receipt_id}", 1.5, "01/01/25", "Dining")
+        for receipt_id in ids[args.edits:]:
+            database.delete_receipt(receipt_id)
+        queued = time.perf_counter() - start
+        flusher.drain()
+        print(f"outbox edits   {2 * args.edits} edits/deletes in {time.perf_counter() - start:6.2f} s "
+              f"({queued * 1000:.1f} ms queueing) | {sheet.calls - calls} API calls")
+
+        local = {str(r[0]): [r[1], r[2], r[3], r[4]] for r in database.get_connection().execute(
+            "SELECT cloud_id, vendor, total, date, category FROM receipts")}
+        cloud = {str(r[0]): [r[2], float(r[3]), r[4], r[5]] for r in sheet.rows[1:]}
+        assert local == cloud, "sheet and local database disagree after edits"
+        print(f"mirror check   ok ({len(cloud)} rows match)")
+        database.close_connection()
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
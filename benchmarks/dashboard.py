@@ -0,0 +1,76 @@
+"""Dashboard data cost per rerun as history grows: SELECT * + pandas vs the summary tables.
+
+Runs against a throwaway database, never expenses.db.
+    python -m benchmarks.dashboard --sizes 1000,10000,100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import pandas as pd
+
+import database
+
+
+def _grow(rng, target):
+    have = database.get_connection().execute("SELECT COUNT(*) FROM receipts").fetchone()[0]
+    rows = [(f"Vendor {rng.randint(1, 500)}", rng.randint(100, 20000) / 100,
+             f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(20, 25)}",
+             rng.choice(["Groceries", "Dining", "Transport", "Supplies", "Services"]),
+             "Item 9.99\n" * rng.randint(20, 150))
+            for _ in range(target - have)]
+    with database.db_session() as conn:
+        conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def _legacy():
+    # What every rerun used to compute
+    df = database.get_all_receipts()
+    df['total'].sum()
+    df.loc[df['total'].idxmax()]
+    df['category'].value_counts().idxmax()
+    plot = df.copy()
+    plot['date_dt'] = pd.to_datetime(plot['date'], dayfirst=True, errors='coerce')
+    plot.dropna(subset=['date_dt']).sort_values('date_dt')
+
+
+def _summary():
+    database.get_dashboard_stats()
+    database.get_summary()
+    database.get_all_receipts(with_raw_text=False, limit=100)
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--sizes", default="1000,10000,100000")
+    args = arg_parser.parse_args(argv)
+
+    warnings.simplefilter("ignore", UserWarning)  # pandas complains about the old per-element date parsing
+    rng = random.Random(9)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            _grow(rng, size)
+            legacy_s, legacy_mem = _measure(_legacy)
+            summary_s, summary_mem = _measure(_summary)
+            print(f"{size:>7} receipts | SELECT * {legacy_s * 1000:8.1f} ms, peak {legacy_mem / 2 ** 20:7.1f} MiB | "
+                  f"summary {summary_s * 1000:6.1f} ms, peak {summary_mem / 2 ** 20:5.2f} MiB")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Per-call latency of the hot database reads: one connection per call vs the shared connection.
+
+Runs against a throwaway database file, never expenses.db.
+    python -m benchmarks.db_connections --calls 2000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import database
+
+
+def _legacy_load_budget(db_name):
+    # What every call used to do: connect, run DDL, query, close
+    conn = sqlite3.connect(db_name)
+    c = conn.cursor()
+    c.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value REAL)')
+    c.execute("SELECT value FROM settings WHERE key = 'budget'")
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else 500.0
+
+
+def _legacy_get_category(db_name, vendor):
+    conn = sqlite3.connect(db_name)
+    c = conn.cursor()
+    c.execute('SELECT category FROM vendor_map WHERE vendor = ?', (vendor,))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+
+def _time(fn, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--calls", type=int, default=1000)
+    args = arg_parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.save_budget(750.0)
+        database.update_vendor_map("Starbucks", "Food & Dining")
+
+        cases = [
+            ("load_budget", lambda: _legacy_load_budget(database.DB_NAME), database.load_budget),
+            ("get_category_for_vendor", lambda: _legacy_get_category(database.DB_NAME, "Starbucks"),
+             lambda: database.get_category_for_vendor("Starbucks")),
+        ]
+        for name, before, after in cases:
+            before_mean, before_p95 = _time(before, args.calls)
+            after_mean, after_p95 = _time(after, args.calls)
+            print(f"{name:<24} before {before_mean * 1e6:8.1f} us (p95 {before_p95 * 1e6:8.1f}) | "
+                  f"after {after_mean * 1e6:8.1f} us (p95 {after_p95 * 1e6:8.1f}) | "
+                  f"{before_mean / after_mean:5.1f}x")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
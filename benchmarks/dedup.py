@@ -0,0 +1,90 @@
+"""Duplicate checks against a large history: linear Hamming scan vs the multi-index hash table, plus the exact key.
+
+Runs against a throwaway database, never expenses.db.
+    python -m benchmarks.dedup --hashes 100000 --queries 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import database
+from dedup import ImageHashIndex, NEAR_DUPLICATE_DISTANCE, dhash, hamming
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+
+
+def _receiptish(rng, vocabulary):
+    # Receipt thumbnails are alike: each 8-bit row is one of a few "text line" patterns
+    h = 0
+    for _ in range(8):
+        h = (h << 8) | rng.choice(vocabulary)
+    return h
+
+
+def _flip(rng, h, bits):
+    for bit in rng.sample(range(64), bits):
+        h ^= 1 << bit
+    return h
+
+
+def _per_query(fn, queries):
+    start = time.perf_counter()
+    results = [fn(q) for q in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--hashes", type=int, default=100000)
+    arg_parser.add_argument("--queries", type=int, default=2000)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(20)
+    for name in sorted(os.listdir(SAMPLES)) if os.path.isdir(SAMPLES) else []:
+        with open(os.path.join(SAMPLES, name), "rb") as f:
+            image_bytes = f.read()
+        start = time.perf_counter()
+        dhash(image_bytes)
+        print(f"dhash {name[:30]:<30} {(time.perf_counter() - start) * 1000:6.2f} ms")
+
+    vocabulary = [rng.getrandbits(8) for _ in range(24)]
+    for label, make in (("uniform", lambda: rng.getrandbits(64)), ("receipt-like", lambda: _receiptish(rng, vocabulary))):
+        stored = [(i, make()) for i in range(args.hashes)]
+        start = time.perf_counter()
+        index = ImageHashIndex(stored)
+        built = time.perf_counter() - start
+
+        # Half re-uploads (a few bits off a stored hash), half new photos
+        queries = [_flip(rng, rng.choice(stored)[1], rng.randint(0, NEAR_DUPLICATE_DISTANCE))
+                   for _ in range(args.queries // 2)] + [make() for _ in range(args.queries // 2)]
+
+        def scan(q):
+            best = min(stored, key=lambda row: hamming(q, row[1]))
+            d = hamming(q, best[1])
+            return d if d <= NEAR_DUPLICATE_DISTANCE else None
+
+        scan_s, expected = _per_query(scan, queries[:200])
+        index_s, found = _per_query(index.nearest, queries)
+        assert [f and f[1] for f in found[:200]] == expected, "index missed a match the scan found"
+        print(f"{label:<12} {args.hashes} hashes (built in {built:.2f} s) | scan {scan_s * 1000:8.2f} ms/query | "
+              f"index {index_s * 1000:6.3f} ms/query | {sum(f is not None for f in found)} flagged")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        with database.db_session() as conn:
+            conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+                             [(f"Vendor {rng.randint(1, 500)}", rng.randint(100, 20000) / 100,
+                               f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/25", "Groceries", "text")
+                              for _ in range(args.hashes)])
+        keys = database.get_connection().execute("SELECT vendor, date, total FROM receipts ORDER BY random() LIMIT ?",
+                                                  (args.queries,)).fetchall()
+        key_s, hits = _per_query(lambda k: database.find_duplicate(k[0].upper(), k[1], k[2]), keys)
+        assert all(hits), "exact duplicate not found"
+        print(f"exact key    {args.hashes} receipts | find_duplicate {key_s * 1000:6.3f} ms/query")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Re-parse throughput on OCR text: the old multi-regex extractors vs the single-pass engine.
+
+    python -m benchmarks.extraction --receipts 10000
+"""
+import argparse
+import random
+import re
+import time
+from datetime import datetime
+
+from dateutil import parser
+
+from extractor import extract_fields
+
+VENDORS = ["TasteRadar", "APPLE STORE, GRAFTON STREET", "Tesco Extra", "Shell Station 42", "Corner Cafe"]
+DATE_FORMATS = ["%d/%m/%Y", "%d/%m/%y", "%B %d/%Y", "%d %b %Y", "%Y-%m-%d"]
+
+
+def _synthetic_text(rng):
+    lines = ["RECEIPT", rng.choice(VENDORS), "1-6 Grafton Street, Dublin 2"]
+    when = datetime(2024, rng.randint(1, 12), rng.randint(1, 28))
+    lines.append(f"Date: {when.strftime(rng.choice(DATE_FORMATS))}")
+    subtotal = 0.0
+    for _ in range(rng.randint(5, 30)):
+        price = rng.randint(100, 9999) / 100
+        subtotal += price
+        lines.append(f"Item {rng.randint(1, 999)} x{rng.randint(1, 3)}    £{price:.2f}")
+    tax = round(subtotal * 0.2, 2)
+    lines += [f"Subtotal £{subtotal:,.2f}", f"VAT 20.0% £{tax:,.2f}", f"Total £{subtotal + tax:,.2f}",
+              "Thank you for shopping"]
+    return "\n".join(lines)
+
+
+# The extractors as they were before the single-pass engine, kept here as the baseline
+def _legacy_vendor(lines):
+    blacklist = ["RECEIPT", "TAX INVOICE", "INVOICE", "WELCOME"]
+    for line in lines:
+        clean_line = line.strip()
+        if clean_line and not any(word in clean_line.upper() for word in blacklist):
+            return clean_line
+    return "Unknown Vendor"
+
+
+def _legacy_date(text):
+    date_keyword_match = re.search(r"Date[:\s]+([A-Za-z0-9/\s,.-]+)", text, re.IGNORECASE)
+    if date_keyword_match:
+        raw_date = date_keyword_match.group(1).split('\n')[0].strip()
+        try:
+            return parser.parse(raw_date, fuzzy=True).strftime("%d/%m/%y")
+        except (ValueError, OverflowError):
+            pass
+    numeric_match = re.search(r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})', text)
+    if numeric_match:
+        try:
+            return parser.parse(numeric_match.group(0)).strftime("%d/%m/%y")
+        except Exception:
+            pass
+    return datetime.now().strftime("%d/%m/%y")
+
+
+def _legacy_total(text):
+    final_match = re.search(r"Total Paid\s*[^\d]*([\d,.]+)", text, re.IGNORECASE)
+    if not final_match:
+        final_match = re.search(r"(?<!Sub)Total\s*[^\d]*([\d,.]+)", text, re.IGNORECASE)
+    if final_match:
+        try:
+            return float(final_match.group(1).replace(',', ''))
+        except ValueError:
+            return 0.0
+    amounts = re.findall(r"(\d+[.,]\d{2})", text)
+    return max([float(x.replace(',', '.')) for x in amounts]) if amounts else 0.0
+
+
+def _legacy(text):
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    return _legacy_vendor(lines), _legacy_date(text), _legacy_total(text)
+
+
+def _engine(text):
+    fields = extract_fields(text)
+    return fields["vendor"], fields["date"], fields["total"]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--receipts", type=int, default=10000)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(3)
+    texts = [_synthetic_text(rng) for _ in range(args.receipts)]
+
+    results = {}
+    for label, fn in (("legacy", _legacy), ("single-pass", _engine)):
+        start = time.perf_counter()
+        results[label] = [fn(t) for t in texts]
+        elapsed = time.perf_counter() - start
+        print(f"{label:<12} {elapsed:7.2f} s | {len(texts) / elapsed:9.0f} receipts/s")
+
+    agree = sum(a == b for a, b in zip(results["legacy"], results["single-pass"]))
+    print(f"Field agreement with legacy: {agree}/{len(texts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Cost of the perf.py timing hooks: per call, and on the text extractor with timing off, on, and logging.
+
+The log goes to a temp file, never perf.jsonl.
+    python -m benchmarks.instrumentation --receipts 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import perf
+from benchmarks.extraction import _synthetic_text
+from extractor import extract_fields
+
+
+def _per_call(n):
+    start = time.perf_counter()
+    for _ in range(n):
+        with perf.stage("bench.block"):
+            pass
+    return (time.perf_counter() - start) / n
+
+
+def _extract(texts):
+    start = time.perf_counter()
+    for text in texts:
+        extract_fields(text)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--receipts", type=int, default=20000)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(4)
+    texts = [_synthetic_text(rng) for _ in range(args.receipts)]
+    was_enabled, old_log = perf.ENABLED, perf.LOG_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for label, enabled, log_path in (("off", False, ""), ("on", True, ""),
+                                             ("on + log", True, os.path.join(tmp, "perf.jsonl"))):
+                perf.enable(enabled, log_path)
+                perf.process_recorder.reset()
+                block = _per_call(args.receipts)
+                seconds = _extract(texts)
+                print(f"{label:>9} | empty stage {block * 1e6:6.2f} µs | extract_fields "
+                      f"{args.receipts / seconds:8.0f} receipts/s ({seconds / args.receipts * 1e6:6.1f} µs each)")
+        finally:
+            perf.enable(was_enabled, "")
+            perf.LOG_PATH = old_log
+
+
+if __name__ == "__main__":
+    main()
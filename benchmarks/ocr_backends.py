@@ -0,0 +1,72 @@
+"""Compares per-image OCR latency of the available backends.
+
+Run from the repo root:
+    python -m benchmarks.ocr_backends
+    python -m benchmarks.ocr_backends --images "scans/*.jpg" --repeat 10
+"""
+import argparse
+import glob
+import io
+import statistics
+import time
+
+from PIL import Image
+
+from processor import OCR_BACKENDS, get_ocr_backend
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def bench_backend(name, images, repeat):
+    try:
+        backend = get_ocr_backend(name)
+    except ImportError as e:
+        print(f"{name:<12} skipped ({e})")
+        return None
+
+    # Warm-up so one-time model loading is reported separately from steady-state latency
+    start = time.perf_counter()
+    backend.image_to_string(images[0])
+    warmup = time.perf_counter() - start
+
+    timings = []
+    for _ in range(repeat):
+        for img in images:
+            start = time.perf_counter()
+            backend.image_to_string(img)
+            timings.append(time.perf_counter() - start)
+
+    print(f"{name:<12} warm-up {warmup * 1000:8.1f} ms | "
+          f"mean {statistics.mean(timings) * 1000:8.1f} ms | "
+          f"p50 {_percentile(timings, 50) * 1000:8.1f} ms | "
+          f"p95 {_percentile(timings, 95) * 1000:8.1f} ms | n={len(timings)}")
+    return timings
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--images", default="samples/*", help="Glob of images to OCR")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Passes over the image set per backend")
+    args = arg_parser.parse_args(argv)
+
+    images = []
+    for path in sorted(glob.glob(args.images)):
+        with open(path, "rb") as f:
+            img = Image.open(io.BytesIO(f.read()))
+            img.load()
+            images.append(img)
+    if not images:
+        print(f"No images found for {args.images}")
+        return
+
+    print(f"{len(images)} images x {args.repeat} passes")
+    for name in OCR_BACKENDS:
+        bench_backend(name, images, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Cost of showing the transaction listing: loading every row, LIMIT/OFFSET pages, and keyset pages.
+
+Runs against a throwaway database, never expenses.db.
+    python -m benchmarks.pagination --rows 200000 --pages 1,100,1000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+import database
+from database import PAGE_SIZE, get_receipts_page
+
+
+def _history(rng, rows):
+    with database.db_session() as conn:
+        conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+                         [(f"Vendor {rng.randint(1, 500)}", rng.randint(100, 20000) / 100,
+                           f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(15, 25)}",
+                           rng.choice(["Groceries", "Dining", "Transport", "Supplies", "Services"]), "text")
+                          for _ in range(rows)])
+        conn.execute("ANALYZE")
+
+
+def _offset_page(page, category=None):
+    # What paging with OFFSET would cost: every earlier row is walked and thrown away
+    where = "WHERE category = ?" if category else ""
+    params = [category] if category else []
+    return pd.read_sql_query(
+        f"""SELECT id, vendor, total, date, category FROM receipts {where}
+            ORDER BY {database._SORT_KEY} DESC, id DESC LIMIT ? OFFSET ?""",
+        database.get_connection(), params=params + [PAGE_SIZE, page * PAGE_SIZE])
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=200000)
+    arg_parser.add_argument("--pages", default="1,100,1000", help="Page numbers to time")
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(17)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        _history(rng, args.rows)
+        start = time.perf_counter()
+        database.get_all_receipts(with_raw_text=False)
+        print(f"whole table        | {(time.perf_counter() - start) * 1000:8.2f} ms (the old listing)")
+        for category in (None, "Dining"):
+            # Walk the keyset pages once, keeping the cursor that starts each one
+            cursors, cursor = [None], None
+            while True:
+                _, cursor = get_receipts_page(cursor, category=category)
+                if cursor is None:
+                    break
+                cursors.append(cursor)
+
+            for page in sorted(int(p) for p in args.pages.split(",")):
+                if page > len(cursors):
+                    continue
+                start = time.perf_counter()
+                expected = _offset_page(page - 1, category)
+                offset_s = time.perf_counter() - start
+                start = time.perf_counter()
+                df, _ = get_receipts_page(cursors[page - 1], category=category)
+                keyset_s = time.perf_counter() - start
+                assert df['id'].tolist() == expected['id'].tolist(), "keyset page differs from OFFSET page"
+                print(f"{category or 'all':<7} page {page:>5} | OFFSET {offset_s * 1000:8.2f} ms | "
+                      f"keyset {keyset_s * 1000:6.2f} ms")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
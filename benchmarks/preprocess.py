@@ -0,0 +1,78 @@
+"""Measures the preprocessing stage: per-step time, OCR latency, peak memory and extracted fields.
+
+Run from the repo root:
+    python -m benchmarks.preprocess
+    python -m benchmarks.preprocess --images "scans/*.jpg" --skip binarize,deskew
+"""
+import argparse
+import glob
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from preprocess import DEFAULT_STEPS, preprocess_image
+from processor import get_ocr_backend, extract_vendor, extract_total, extract_date
+
+
+def _fields(text):
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    return extract_vendor(lines), extract_total(text), extract_date(text)
+
+
+def _peak_rss_mib():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run(image_bytes, steps):
+    # Runs in a fresh worker process so the peak RSS growth belongs to this image alone
+    rss_before = _peak_rss_mib()
+    start = time.perf_counter()
+    if steps is None:
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
+        timings = {}
+    else:
+        img, timings = preprocess_image(image_bytes, steps)
+    prep = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text = get_ocr_backend().image_to_string(img)
+    ocr = time.perf_counter() - start
+    rss_after = _peak_rss_mib()
+    peak = rss_after - rss_before if rss_before is not None else None
+    return img.size, prep, ocr, peak, timings, _fields(text)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--images", default="samples/*", help="Glob of images to process")
+    arg_parser.add_argument("--skip", default="", help="Comma separated steps to switch off")
+    args = arg_parser.parse_args(argv)
+
+    steps = {name: True for name in DEFAULT_STEPS}
+    for name in filter(None, args.skip.split(",")):
+        steps[name] = False
+
+    for path in sorted(glob.glob(args.images)):
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        print(path)
+        for label, config in (("raw", None), ("preprocessed", steps)):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                size, prep, ocr, peak, timings, fields = pool.submit(_run, image_bytes, config).result()
+            peak_text = f"{peak:6.1f} MiB" if peak is not None else "n/a"
+            print(f"  {label:<13} {size[0]}x{size[1]} | prep {prep * 1000:7.1f} ms | ocr {ocr * 1000:7.1f} ms | "
+                  f"peak RSS +{peak_text}")
+            if timings:
+                print("                " + ", ".join(f"{k} {v * 1000:.1f} ms" for k, v in timings.items()))
+            print(f"                vendor={fields[0]!r} total={fields[1]} date={fields[2]}")
+
+
+if __name__ == "__main__":
+    main()
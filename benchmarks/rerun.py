@@ -0,0 +1,77 @@
+"""Time of a dashboard rerun (the script re-executing after a widget interaction) with and without the read caches.
+
+Drives the real app.py headlessly with Streamlit's AppTest against a throwaway working
+directory, so the receipts land in a temp owners/ file, never expenses.db.
+    python -m benchmarks.rerun --rows 100000 --reruns 20
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import warnings
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _history(rng, rows):
+    import database
+    database.use_owner("bench")
+    with database.db_session() as conn:
+        conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+                         [(f"Vendor {rng.randint(1, 500)}", rng.randint(100, 20000) / 100,
+                           f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(20, 26)}",
+                           rng.choice(["Groceries", "Dining", "Transport", "Supplies"]), "Item 9.99\n" * 40)
+                          for _ in range(rows)])
+    database.use_owner(None)
+
+
+def _reruns(at, count, clear):
+    import streamlit as st
+    timings = []
+    for i in range(count):
+        if clear:
+            st.cache_data.clear()
+            st.cache_resource.clear()
+        # A typical interaction: a widget that changes nothing in the database
+        at.text_input(key="search_text").input(f"vendor {i % 3}" if i % 2 else "")
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+        assert not at.exception, at.exception
+    return statistics.median(timings)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=100000)
+    arg_parser.add_argument("--reruns", type=int, default=20)
+    args = arg_parser.parse_args(argv)
+
+    warnings.simplefilter("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    os.environ.setdefault("RECEIPT_CLOUD_BACKEND", "fake")
+    from streamlit.testing.v1 import AppTest
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy(os.path.join(APP_DIR, "app.py"), tmp)
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            _history(random.Random(21), args.rows)
+            at = AppTest.from_file(os.path.join(tmp, "app.py"), default_timeout=120)
+            at.session_state["current_user"] = "bench"
+            at.run()
+            uncached = _reruns(at, args.reruns, clear=True)
+            cached = _reruns(at, args.reruns, clear=False)
+            print(f"{args.rows} receipts | rerun without caches {uncached * 1000:7.1f} ms | "
+                  f"with caches {cached * 1000:7.1f} ms (median of {args.reruns})")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Full-text search over stored OCR text: LIKE scans vs the receipts_fts index.
+
+Runs against a throwaway database, never expenses.db.
+    python -m benchmarks.search --rows 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import database
+
+ITEMS = ["Milk 1L", "Bread", "Eggs x12", "Coffee beans", "Printer paper", "AA batteries", "USB hub",
+         "Notebook", "Bananas", "Olive oil", "Shampoo", "Phone charger", "Pasta", "Tomatoes", "Cheddar"]
+QUERIES = ["hdmi cable", "hdmi", "charger", "olive", "vendor 42", "total"]
+
+
+def _history(rng, rows):
+    def text(i):
+        lines = rng.sample(ITEMS, rng.randint(3, 10))
+        if i % 5000 == 0:
+            lines.append("HDMI Cable 2m")  # A handful of needles in the haystack
+        return "\n".join(f"{item} {rng.randint(50, 2000) / 100:.2f}" for item in lines) + "\nTOTAL 42.00"
+
+    with database.db_session() as conn:
+        conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
+                         [(f"Vendor {rng.randint(1, 500)}", rng.randint(100, 20000) / 100,
+                           f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/25",
+                           rng.choice(["Groceries", "Dining", "Transport", "Supplies"]), text(i))
+                          for i in range(rows)])
+
+
+def _like(text, limit=20):
+    # The alternative without an index: every word must appear somewhere in the row. It stops at the
+    # first `limit` rows and cannot rank them, so it is only slow when few receipts match
+    words = text.split()
+    where = " AND ".join("(vendor || ' ' || category || ' ' || raw_text) LIKE ?" for _ in words)
+    return database.get_connection().execute(f"SELECT id FROM receipts WHERE {where} LIMIT ?",
+                                              [f"%{w}%" for w in words] + [limit]).fetchall()
+
+
+def _time(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=100000)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(18)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        start = time.perf_counter()
+        _history(rng, args.rows)
+        print(f"insert {args.rows} receipts (index kept by triggers) {time.perf_counter() - start:6.2f} s")
+        for query in QUERIES:
+            like_s, _ = _time(lambda: _like(query))
+            fts_s, hits = _time(lambda: database.search_receipts(query))
+            print(f"{query!r:<14} LIKE {like_s * 1000:8.2f} ms | FTS5 {fts_s * 1000:6.2f} ms, top {len(hits):>2} hits")
+        database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Cold start: import time of the app's modules and the first render of the login page and dashboard.
+
+Each measurement runs in a fresh interpreter, against a throwaway working directory whose
+owners/ file holds the receipts, never expenses.db.
+    python -m benchmarks.startup --rows 20000 --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_MODULES = ["pandas", "processor", "database", "sync_manager", "outbox", "dedup", "caching", "perf"]
+# Optional stacks a rerun should not pay for unless it needs them
+HEAVY = ["plotly.express", "pytesseract", "streamlit_gsheets", "gspread", "google.oauth2", "requests"]
+
+
+def _loaded():
+    return [name for name in HEAVY if name in sys.modules]
+
+
+def _child_imports():
+    import streamlit  # noqa: F401  The framework itself is not ours to trim
+    before = _loaded()
+    start = time.perf_counter()
+    for name in APP_MODULES:
+        __import__(name)
+    return {"seconds": time.perf_counter() - start, "heavy": [n for n in _loaded() if n not in before]}
+
+
+def _child_render(page):
+    import logging
+    import warnings
+    warnings.simplefilter("ignore")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    from streamlit.testing.v1 import AppTest
+
+    before = _loaded()
+    at = AppTest.from_file(os.path.abspath("app.py"), default_timeout=120)
+    if page == "dashboard":
+        at.session_state["current_user"] = "bench"
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    assert not at.exception, at.exception
+    start = time.perf_counter()
+    at.run()
+    second = time.perf_counter() - start
+    return {"seconds": first, "rerun": second, "heavy": [n for n in _loaded() if n not in before]}
+
+
+def _spawn(workdir, *args):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [APP_DIR, os.environ.get("PYTHONPATH")])),
+           "RECEIPT_CLOUD_BACKEND": "fake"}
+    out = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child", *args], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _history(workdir, rows):
+    from benchmarks import synthetic
+    import database
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        synthetic.build_history(database.owner_db_path("bench"), rows)
+    finally:
+        os.chdir(cwd)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=20000)
+    arg_parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+    arg_parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.child:
+        result = _child_imports() if args.child[0] == "imports" else _child_render(args.child[1])
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copy(os.path.join(APP_DIR, "app.py"), tmp)
+        _history(tmp, args.rows)
+        for label, child in (("import app modules", ["imports"]), ("first render: login", ["render", "login"]),
+                             ("first render: dashboard", ["render", "dashboard"])):
+            runs = [_spawn(tmp, *child) for _ in range(args.runs)]
+            line = f"{label:<26} {statistics.median(r['seconds'] for r in runs) * 1000:8.1f} ms"
+            if "rerun" in runs[0]:
+                line += f" | next rerun {statistics.median(r['rerun'] for r in runs) * 1000:7.1f} ms"
+            print(f"{line} | loads {', '.join(runs[0]['heavy']) or 'none of ' + '/'.join(HEAVY)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""Regression suite: throughput, latency percentiles, peak memory and field accuracy of the hot paths.
+
+Covers extract_receipt_data end to end (skipped without Tesseract), the pure-text extractor,
+categorize_vendor, and database.py writes and reads over a synthetic history. Everything runs
+on generated data in a temp directory, never expenses.db. Results are compared with a stored
+baseline and any metric worse than the tolerance is flagged. Flagged benchmarks are run again
+and only a regression that every run shows counts; the exit code is 1 if one does.
+
+    python -m benchmarks.suite                      # compare with benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline      # record this machine's numbers as the baseline
+    python -m benchmarks.suite --history-rows 1000000 --only db_read
+
+Timings only mean something against a baseline recorded on the same machine.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import database
+import processor
+import sync_manager
+from benchmarks import synthetic
+from extractor import extract_fields, normalize_date
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+TOLERANCE = 0.25  # Timing and memory may drift this much (as a fraction) before it counts as a regression
+TIME_FLOOR_MS = 0.1  # ...and by more than this: sub-millisecond p50s jump by tens of microseconds between runs
+MEMORY_FLOOR_MIB = 1.0  # The outbox thread flushing in the background lands in the write benchmarks' samples
+RETRIES = 2  # A benchmark with a regression is run again this many times, keeping each metric's best
+ACCURACY_TOLERANCE = 0.01  # Field accuracy may drop this much (absolute)
+MEMORY_SAMPLE = 200  # Calls run again under tracemalloc for the peak; it slows everything down too much to time
+TEXT_FIELDS = ("vendor", "date", "total", "subtotal", "tax", "currency")
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _measure(fn, items):
+    """Times fn(item) per item, then reruns a sample under tracemalloc. Returns metrics and the outputs."""
+    outputs, timings = [], []
+    for item in items:
+        start = time.perf_counter()
+        outputs.append(fn(item))
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    for item in items[:MEMORY_SAMPLE]:
+        fn(item)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    ordered = sorted(timings)
+    return {"calls": len(items), "throughput": len(items) / sum(timings), "p50_ms": _percentile(ordered, 50) * 1000,
+            "p95_ms": _percentile(ordered, 95) * 1000, "p99_ms": _percentile(ordered, 99) * 1000,
+            "peak_mib": peak / 2 ** 20}, outputs
+
+
+def _field_matches(field, got, want):
+    if field in ("total", "subtotal", "tax"):
+        return got is not None and want is not None and abs(got - want) < 0.005
+    return got == want
+
+
+def _accuracy(outputs, truths, fields):
+    return {field: sum(_field_matches(field, out.get(field), truth[field]) for out, truth in zip(outputs, truths))
+            / len(truths) for field in fields}
+
+
+def bench_text(args):
+    rng = random.Random(args.seed)
+    truths = [synthetic.make_receipt(rng) for _ in range(args.receipts)]
+    metrics, outputs = _measure(lambda truth: extract_fields(truth["raw_text"]), truths)
+    metrics["accuracy"] = _accuracy(outputs, truths, TEXT_FIELDS)
+    metrics["accuracy"]["date_agreement"] = _date_agreement()
+    return {"extract_fields": metrics}
+
+
+def _date_agreement():
+    # Day and month both <= 12, so the order is a guess: what's read off a receipt must match what
+    # normalize_date stores for the same text typed into the editor, or edits would swap them
+    tokens = [f"{d:0{pad}}{sep}{m:0{pad}}{sep}{year}" for d in range(1, 13) for m in range(1, 13)
+              for sep in "/.-" for pad in (1, 2) for year in ("2024", "24")]
+    agree = sum(extract_fields(f"Shop\nDate: {token}\nTotal 1.00")["date"] == normalize_date(token)
+                for token in tokens)
+    return agree / len(tokens)
+
+
+def _ocr_noise(rng, name):
+    # The kind of damage OCR does to a vendor line
+    chars = list(name)
+    i = rng.randrange(len(chars))
+    chars[i] = {"o": "0", "O": "0", "l": "1", "i": "1", "S": "5", "e": "c"}.get(chars[i], chars[i])
+    return "".join(chars)
+
+
+def bench_categorize(args):
+    # Vendors the rules can't place are taught, the way a user correcting them would
+    learned = {vendor: "Supplies" for vendor, category in synthetic.VENDORS if category == "Uncategorized"}
+    database.update_vendor_map_many(learned.items())
+    rng = random.Random(args.seed)
+    queries = []
+    for _ in range(args.receipts):
+        truth = synthetic.make_receipt(rng)
+        vendor = _ocr_noise(rng, truth["vendor"]) if rng.random() < 0.3 else truth["vendor"]
+        queries.append((vendor, truth["raw_text"], learned.get(truth["vendor"], truth["category"])))
+    metrics, outputs = _measure(lambda q: processor.categorize_vendor(q[0], q[1]), queries)
+    metrics["accuracy"] = {"category": sum(got == q[2] for got, q in zip(outputs, queries)) / len(queries)}
+    return {"categorize_vendor": metrics}
+
+
+def _tesseract_missing():
+    try:
+        processor._pytesseract().get_tesseract_version()
+    except Exception as e:
+        return str(e).splitlines()[0]
+    return None
+
+
+def bench_ocr(args):
+    missing = _tesseract_missing()
+    if missing:
+        print(f"extract_receipt_data skipped: {missing}")
+        return {}
+    samples = list(synthetic.generate_images(args.images, args.seed, noise=args.noise, rotation=args.rotation,
+                                             width=args.width, fmt="JPEG"))
+    processor.extract_receipt_data(samples[0][0])  # Loads the engine; not part of the steady state
+    metrics, outputs = _measure(lambda sample: processor.extract_receipt_data(sample[0]), samples[1:])
+    metrics["accuracy"] = _accuracy(outputs, [truth for _, truth in samples[1:]], TEXT_FIELDS + ("category",))
+    return {"extract_receipt_data": metrics}
+
+
+def bench_db_write(args):
+    rng = random.Random(args.seed)
+    receipts = [synthetic.make_receipt(rng) for _ in range(args.receipts)]
+    # Warm-up: the first save creates the schema and loads the vendor index, ~100 ms on its own
+    database.save_receipt(synthetic.make_receipt(rng), "bench", allow_duplicate=True)
+    single, _ = _measure(lambda r: database.save_receipt(r, "bench", allow_duplicate=True),
+                         receipts[:args.receipts // 10])
+    batches = [receipts[i:i + 500] for i in range(0, len(receipts), 500)]
+    batch, _ = _measure(lambda rows: database.save_receipts_batch(rows, "bench", allow_duplicates=True), batches)
+    batch["throughput"] *= 500  # Receipts rather than batches per second
+    return {"db_write.save_receipt": single, "db_write.save_receipts_batch": batch}
+
+
+def bench_db_read(args):
+    history = os.path.join(args.tmp, "history.db")
+    synthetic.build_history(history, args.history_rows, args.seed)
+    database.use_database(history)
+    rng = random.Random(args.seed)
+    conn = database.get_connection()
+    vendors = [row[0] for row in conn.execute("SELECT vendor FROM receipts ORDER BY random() LIMIT 100")]
+    some = conn.execute("SELECT vendor, date, total, image_hash FROM receipts ORDER BY random() LIMIT 100").fetchall()
+
+    cursors = [None]  # Walk 20 pages deep so later calls land mid-history
+    for _ in range(20):
+        cursors.append(database.get_receipts_page(cursors[-1])[1])
+    months = [database.current_month(today=synthetic.date(2015 + rng.randrange(10), rng.randint(1, 12), 1))
+              for _ in range(args.repeat)]
+    words = [rng.choice(synthetic.ITEMS).split()[0] for _ in range(args.repeat)]
+
+    cases = {
+        "get_receipts_page": (lambda c: database.get_receipts_page(c), [rng.choice(cursors) for _ in range(args.repeat)]),
+        "get_receipts_page.vendor": (lambda v: database.get_receipts_page(vendor=v[:5]), vendors[:args.repeat]),
+        "search_receipts": (database.search_receipts, words),
+        "get_dashboard_stats": (lambda _: database.get_dashboard_stats(), range(args.repeat)),
+        "get_summary": (lambda _: database.get_summary(), range(args.repeat)),
+        "get_spend": (lambda month: database.get_spend(*month), months),
+        "find_duplicate": (lambda row: database.find_duplicate(*row[:3]), some[:args.repeat]),
+        "find_similar_image": (lambda row: database.find_similar_image(row[3]), some[:args.repeat]),
+    }
+    results = {}
+    for name, (fn, items) in cases.items():
+        items = list(items)
+        fn(items[0])  # Warm-up: first-use caches such as the image hash index
+        results[f"db_read.{name}"], _ = _measure(fn, items)
+    database.close_connection()
+    return results
+
+
+BENCHMARKS = {
+    "text": bench_text,
+    "categorize": bench_categorize,
+    "ocr": bench_ocr,
+    "db_write": bench_db_write,
+    "db_read": bench_db_read,
+}
+
+
+def _flatten(results):
+    flat = {}
+    for bench, metrics in results.items():
+        for metric, value in metrics.items():
+            if isinstance(value, dict):
+                flat.update({f"{bench}.{metric}.{k}": v for k, v in value.items()})
+            elif metric in ("throughput", "p50_ms", "peak_mib"):  # p95/p99 are too noisy to gate on
+                flat[f"{bench}.{metric}"] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=TOLERANCE, accuracy_tolerance=ACCURACY_TOLERANCE):
+    """(metric, baseline value, current value, regressed) for every metric both runs have."""
+    now, before = _flatten(results), _flatten(baseline)
+    rows = []
+    for metric in sorted(now.keys() & before.keys()):
+        old, new = before[metric], now[metric]
+        if ".accuracy." in metric:
+            regressed = new < old - accuracy_tolerance
+        elif metric.endswith("throughput"):
+            regressed = new < old * (1 - tolerance)
+        else:
+            floor = MEMORY_FLOOR_MIB if metric.endswith("peak_mib") else TIME_FLOOR_MS
+            regressed = new > old * (1 + tolerance) and new - old > floor
+        rows.append((metric, old, new, regressed))
+    return rows
+
+
+def _best(results, again):
+    """Each metric's better value of two runs of the same benchmarks."""
+    best = {}
+    for bench, m in results.items():
+        other = again.get(bench, m)
+        best[bench] = {key: (max if key == "throughput" else min)(value, other[key])
+                       for key, value in m.items() if key not in ("calls", "accuracy")}
+        best[bench]["calls"] = m["calls"]
+        if "accuracy" in m:
+            best[bench]["accuracy"] = {f: max(v, other["accuracy"][f]) for f, v in m["accuracy"].items()}
+    return best
+
+
+def _run(names, args):
+    """Runs the named benchmarks; returns their results and which benchmark produced each entry."""
+    previous = database.current_db()
+    results, source = {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        args.tmp = tmp
+        database.use_database(os.path.join(tmp, "bench.db"))
+        try:
+            for name in names:
+                produced = BENCHMARKS[name](args)
+                results.update(produced)
+                source.update(dict.fromkeys(produced, name))
+                database.use_database(os.path.join(tmp, "bench.db"))
+        finally:
+            import outbox
+            for flusher in outbox._flushers.values():
+                flusher.stop()
+            database.close_connection()
+            database.use_database(previous)
+    return results, source
+
+
+def _report(results):
+    for bench, m in results.items():
+        print(f"{bench:<40} {m['throughput']:>10.1f}/s | p50 {m['p50_ms']:8.3f} ms | p95 {m['p95_ms']:8.3f} ms | "
+              f"p99 {m['p99_ms']:8.3f} ms | peak {m['peak_mib']:7.2f} MiB")
+        for field, value in m.get("accuracy", {}).items():
+            print(f"{'':<40}   {field:<10} {value:6.1%}")
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--only", help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}")
+    arg_parser.add_argument("--receipts", type=int, default=5000, help="Synthetic receipts for text, categorize and writes")
+    arg_parser.add_argument("--images", type=int, default=30, help="Rendered receipts for the OCR benchmark")
+    arg_parser.add_argument("--width", type=int, default=800)
+    arg_parser.add_argument("--noise", type=float, default=0.01)
+    arg_parser.add_argument("--rotation", type=float, default=2.0)
+    arg_parser.add_argument("--history-rows", type=int, default=100000)
+    arg_parser.add_argument("--repeat", type=int, default=100, help="Calls per database read benchmark")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--baseline", default=BASELINE)
+    arg_parser.add_argument("--save-baseline", action="store_true")
+    arg_parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    arg_parser.add_argument("--retries", type=int, default=RETRIES,
+                            help="Times a benchmark with a regression is re-run before it counts")
+    arg_parser.add_argument("--output", help="Also write this run's results to a JSON file")
+    args = arg_parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    sync_manager.CLOUD_BACKEND = "fake"  # Saves queue cloud pushes; keep them off the network
+    results, source = _run(names, args)
+    _report(results)
+
+    options = {k: v for k, v in vars(args).items() if k in ("receipts", "images", "width", "noise", "rotation",
+                                                             "history_rows", "repeat", "seed")}
+    run = {"options": options, "machine": f"{platform.node()} {platform.machine()} Python {platform.python_version()}",
+           "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=1)
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                # Keep baseline entries for benchmarks that were skipped or not selected this time
+                run["results"] = {**json.load(f)["results"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=1)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["options"] != options:
+        print(f"\n⚠️ Baseline was recorded with different options: {baseline['options']}")
+    rows = compare(results, baseline["results"], args.tolerance)
+    regressions = [row for row in rows if row[3]]
+    for _ in range(args.retries):
+        # One slow run is noise; a regression has to show up every time to count
+        suspects = sorted({source[bench] for bench in results for row in regressions if row[0].startswith(f"{bench}.")})
+        if not suspects:
+            break
+        print(f"\nRunning {', '.join(suspects)} again to confirm {len(regressions)} regression(s)...")
+        again, _ = _run(suspects, args)
+        results = _best(results, again)
+        rows = compare(results, baseline["results"], args.tolerance)
+        regressions = [row for row in rows if row[3]]
+    print(f"\nAgainst baseline ({baseline['machine']}): {len(rows)} metrics, {len(regressions)} regressed")
+    for metric, old, new, _ in regressions:
+        change = (new - old) / old if old else float("inf")
+        print(f"  REGRESSION {metric:<55} {old:12.4f} -> {new:12.4f} ({change:+.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Cloud pull after a save: full CSV download + table replace vs the incremental delta sync.
+
+Serves a synthetic shared sheet from a local HTTP stand-in (an export endpoint and a minimal
+query endpoint) and syncs into a throwaway database, never expenses.db.
+    python -m benchmarks.sync_delta --rows 50000 --owners 20
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import database
+from sync_manager import SHEET_COLUMNS, pull_from_cloud
+
+_QUERY = re.compile(r'select \* where A > (\d+) and lower\(B\) = "(.*)"')
+
+
+class _Sheet:
+    def __init__(self, rng, rows, owners):
+        self.rng = rng
+        self.owners = [f"user{i}" for i in range(owners)]
+        self.rows = []
+        self.bytes_served = 0
+        self.append(rows)
+
+    def append(self, count, owner=None):
+        for _ in range(count):
+            new_id = len(self.rows) + 1
+            self.rows.append([new_id, owner or self.rng.choice(self.owners), f"Vendor {self.rng.randint(1, 500)}",
+                              self.rng.randint(100, 20000) / 100, f"{self.rng.randint(1, 28):02d}/03/25",
+                              "Groceries", "Item 1.00 " * self.rng.randint(5, 40)])
+
+    def csv(self, after_id=None, owner=None):
+        rows = self.rows
+        if after_id is not None:
+            rows = [r for r in rows if r[0] > after_id and r[1] == owner]
+        return pd.DataFrame(rows, columns=SHEET_COLUMNS).to_csv(index=False).encode()
+
+
+def _serve(sheet):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/export":
+                body = sheet.csv()
+            else:
+                m = _QUERY.fullmatch(parse_qs(url.query).get("tq", [""])[0])
+                if not m:
+                    self.send_error(400)
+                    return
+                body = sheet.csv(int(m.group(1)), m.group(2))
+            sheet.bytes_served += len(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _legacy_pull(owner, export_url, db_name):
+    # The old behaviour: whole sheet, filter in pandas, replace the table
+    cloud_df = pd.read_csv(export_url)
+    cloud_df.columns = cloud_df.columns.str.strip().str.lower()
+    user_data = cloud_df[cloud_df['owner'].astype(str).str.strip().str.lower() == owner]
+    conn = sqlite3.connect(db_name)
+    user_data[['id', 'vendor', 'total', 'date', 'category', 'raw_text']].to_sql(
+        'receipts', conn, if_exists='replace', index=False)
+    conn.close()
+
+
+def _check(sheet, owner):
+    expected = {r[0]: r[2] for r in sheet.rows if r[1] == owner}
+    local = dict(database.get_connection().execute("SELECT cloud_id, vendor FROM receipts").fetchall())
+    assert local == expected, f"local mirror differs: {len(local)} rows vs {len(expected)} expected"
+    schema = database.get_connection().execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'receipts'").fetchone()[0]
+    assert "AUTOINCREMENT" in schema, "receipts schema was replaced"
+
+
+def _timed(sheet, fn):
+    sheet.bytes_served = 0
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start, sheet.bytes_served
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=50000)
+    arg_parser.add_argument("--owners", type=int, default=20)
+    arg_parser.add_argument("--new", type=int, default=3, help="Rows added to the sheet before each pull")
+    args = arg_parser.parse_args(argv)
+
+    sheet = _Sheet(random.Random(11), args.rows, args.owners)
+    server = _serve(sheet)
+    base = f"http://127.0.0.1:{server.server_port}"
+    export_url, query_url = f"{base}/export", f"{base}/gviz?tqx=out:csv&headers=1&sheet=receipts"
+    owner = sheet.owners[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        legacy_db = os.path.join(tmp, "legacy.db")
+
+        database.clear_receipts()
+        seconds, size = _timed(sheet, lambda: pull_from_cloud(owner, export_url, query_url))
+        _check(sheet, owner)
+        print(f"login (full pull)   {seconds * 1000:8.1f} ms | {size / 1024:9.1f} KiB downloaded")
+
+        cases = [
+            ("legacy replace", lambda: _legacy_pull(owner, export_url, legacy_db)),
+            ("delta, query", lambda: pull_from_cloud(owner, export_url, query_url)),
+            ("delta, export", lambda: pull_from_cloud(owner, export_url, None)),
+        ]
+        for label, fn in cases:
+            sheet.append(args.new, owner)
+            sheet.append(args.new)
+            seconds, size = _timed(sheet, fn)
+            if label != "legacy replace":
+                _check(sheet, owner)
+            print(f"{label:<19} {seconds * 1000:8.1f} ms | {size / 1024:9.1f} KiB downloaded")
+
+        # Pulling again with nothing new must leave the mirror untouched
+        pull_from_cloud(owner, export_url, query_url)
+        _check(sheet, owner)
+        print(f"mirror check        ok ({database.get_sync_mark(owner)} is the sync mark)")
+        database.close_connection()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
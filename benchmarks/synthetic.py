@@ -0,0 +1,199 @@
+"""Synthetic receipts with ground truth, rendered to images, and synthetic SQLite histories.
+
+Everything is driven by a seed, so two runs with the same options produce the same data:
+    python -m benchmarks.synthetic images out/ --count 20 --noise 0.02 --rotation 3
+    python -m benchmarks.synthetic history /tmp/history.db --rows 1000000
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import database
+from dedup import to_signed
+
+# (vendor, category the app should file it under). The categories follow the built-in keyword rules
+VENDORS = [
+    ("Green Valley Supermarket", "Groceries"), ("FreshMart", "Groceries"), ("Corner Grocery", "Groceries"),
+    ("Tesco Food Store", "Groceries"), ("Bella Pizza", "Dining"), ("Blue Door Cafe", "Dining"),
+    ("Harbour Grill", "Dining"), ("The Fox Pub", "Dining"), ("Daily Coffee", "Dining"),
+    ("Shell Fuel Station", "Transport"), ("City Taxi", "Transport"), ("Metro Transit", "Transport"),
+    ("Acme Hardware", "Uncategorized"), ("Paper & Ink Co", "Uncategorized"), ("Northwind Traders", "Uncategorized"),
+]
+ITEMS = ["Milk", "Bread", "Eggs", "Coffee beans", "Pasta", "Tomatoes", "Cheese", "Apples", "HDMI cable",
+         "Batteries", "Notebook", "Printer paper", "Sandwich", "Latte", "Fuel", "Parking", "Soap", "Rice"]
+CURRENCIES = [("£", "GBP"), ("€", "EUR"), ("$", "USD")]
+# Numeric dates are written day-first, as most of the app's users do; see normalize_date for how they read
+DATE_FORMATS = ["%d/%m/%Y", "%d/%m/%y", "%d %b %Y", "%B %d, %Y", "%Y-%m-%d"]
+TAX_RATE = 0.2
+
+
+def make_receipt(rng, vendors=VENDORS, lines=(3, 15), start=date(2022, 1, 1), days=3 * 365,
+                 price_range=(0.5, 80.0), date_formats=DATE_FORMATS):
+    """One receipt: its text and the fields a perfect reader would extract from it."""
+    vendor, category = rng.choice(vendors)
+    when = start + timedelta(days=rng.randrange(days))
+    symbol, code = rng.choice(CURRENCIES)
+    text = [vendor, f"{rng.randint(1, 200)} High Street", f"Date: {when.strftime(rng.choice(date_formats))}", ""]
+    subtotal = 0.0
+    for _ in range(rng.randint(*lines)):
+        price = round(rng.uniform(*price_range), 2)
+        subtotal += price
+        text.append(f"{rng.choice(ITEMS)} x{rng.randint(1, 3)}  {symbol}{price:,.2f}")
+    subtotal = round(subtotal, 2)
+    tax = round(subtotal * TAX_RATE, 2)
+    total = round(subtotal + tax, 2)
+    text += ["", f"Subtotal {symbol}{subtotal:,.2f}", f"VAT 20% {symbol}{tax:,.2f}", f"Total {symbol}{total:,.2f}",
+             "Thank you for shopping"]
+    return {"vendor": vendor, "date": when.strftime("%d/%m/%y"), "total": total, "subtotal": subtotal, "tax": tax,
+            "currency": code, "category": category, "raw_text": "\n".join(text)}
+
+
+FONTS = ["DejaVuSansMono.ttf", "DejaVuSans.ttf", "LiberationMono-Regular.ttf", "arial.ttf"]
+
+
+def _font(size, path=None):
+    """A TrueType font, and whether it can be trusted with £ and € (Pillow's bundled one can't)."""
+    for name in [path] if path else FONTS:
+        try:
+            return ImageFont.truetype(name, size), True
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size), False
+    except TypeError:  # Pillow < 10.1 has only the fixed bitmap font
+        return ImageFont.load_default(), False
+
+
+def render_receipt(receipt, rng, width=600, noise=0.0, rotation=0.0, blur=0.0, fmt="PNG", quality=85, font=None):
+    """Draws the receipt text on a white slip and returns encoded image bytes.
+
+    `noise` is the fraction of pixels flipped to random grey, `rotation` the largest tilt in
+    degrees either way, and `width` the resolution; text scales with it. Without a font that
+    has the currency symbols, amounts are printed with the currency code instead.
+    """
+    font, has_symbols = _font(max(8, width // 30), font)
+    line_height = int(getattr(font, "size", 10) * 1.5)
+    text = receipt["raw_text"]
+    if not has_symbols:
+        for symbol, code in CURRENCIES:
+            text = text.replace(symbol, f"{code} ")
+    lines = text.split("\n")
+    margin = width // 12
+    img = Image.new("L", (width, margin * 2 + line_height * len(lines)), 255)
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), line, fill=0, font=font)
+
+    if noise:
+        pixels = img.load()
+        for _ in range(int(img.width * img.height * noise)):
+            pixels[rng.randrange(img.width), rng.randrange(img.height)] = rng.randrange(256)
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    if rotation:
+        img = img.rotate(rng.uniform(-rotation, rotation), resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    out = io.BytesIO()
+    if fmt.upper() in ("JPG", "JPEG"):
+        img.save(out, "JPEG", quality=quality)
+    else:
+        img.save(out, fmt)
+    return out.getvalue()
+
+
+def generate_images(count, seed=0, receipt_options=None, **render_options):
+    """Yields (image bytes, ground truth) pairs."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        receipt = make_receipt(rng, **(receipt_options or {}))
+        yield render_receipt(receipt, rng, **render_options), receipt
+
+
+def _history_rows(rng, count, start, days, text_lines):
+    for _ in range(count):
+        vendor, category = rng.choice(VENDORS)
+        when = start + timedelta(days=rng.randrange(days))
+        raw_text = "\n".join(f"{rng.choice(ITEMS)} {rng.uniform(0.5, 80):.2f}" for _ in range(text_lines))
+        yield (f"{vendor} {rng.randint(1, 300)}", round(rng.uniform(1, 300), 2), when.strftime("%d/%m/%y"),
+               category, f"{vendor}\n{raw_text}", to_signed(rng.getrandbits(64)))
+
+
+def build_history(db_path, rows, seed=0, start=date(2015, 1, 1), days=10 * 365, text_lines=6, batch=20000,
+                  verbose=False):
+    """Fills `db_path` (created with the app's schema) with `rows` receipts, in batches so memory stays flat.
+
+    The summary, search and version triggers all run, as they would for real saves. Never
+    point this at expenses.db or a file under owners/.
+    """
+    rng = random.Random(seed)
+    previous = database.current_db()
+    database.use_database(db_path)
+    try:
+        done = 0
+        began = time.perf_counter()
+        while done < rows:
+            chunk = min(batch, rows - done)
+            with database.db_session() as conn:
+                conn.executemany("INSERT INTO receipts (vendor, total, date, category, raw_text, image_hash) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", _history_rows(rng, chunk, start, days, text_lines))
+            done += chunk
+            if verbose:
+                print(f"\r{done:,}/{rows:,} rows ({done / (time.perf_counter() - began):,.0f} rows/s)", end="")
+        if verbose:
+            print()
+        database.get_connection().execute("ANALYZE")
+    finally:
+        database.close_connection()
+        database.use_database(previous)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+    images = sub.add_parser("images", help="Render receipts plus a truth.json of their fields")
+    images.add_argument("out_dir")
+    images.add_argument("--count", type=int, default=20)
+    images.add_argument("--seed", type=int, default=0)
+    images.add_argument("--width", type=int, default=600)
+    images.add_argument("--lines", default="3,15", help="Min,max item lines per receipt")
+    images.add_argument("--noise", type=float, default=0.0)
+    images.add_argument("--rotation", type=float, default=0.0)
+    images.add_argument("--blur", type=float, default=0.0)
+    images.add_argument("--format", default="PNG")
+    images.add_argument("--font", help="TrueType font file; defaults to the first of FONTS installed")
+    history = sub.add_parser("history", help="Write a synthetic receipts database")
+    history.add_argument("db_path")
+    history.add_argument("--rows", type=int, default=100000)
+    history.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "history":
+        if os.path.abspath(args.db_path) == os.path.abspath(database.DB_NAME):
+            arg_parser.error("refusing to write into the app's own database")
+        build_history(args.db_path, args.rows, args.seed, verbose=True)
+        return
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    extension = "jpg" if args.format.upper() in ("JPG", "JPEG") else args.format.lower()
+    truth = {}
+    lines = tuple(int(n) for n in args.lines.split(","))
+    for i, (image, receipt) in enumerate(generate_images(args.count, args.seed, {"lines": lines}, width=args.width,
+                                                         noise=args.noise, rotation=args.rotation, blur=args.blur,
+                                                         fmt=args.format, font=args.font)):
+        name = f"receipt_{i:04d}.{extension}"
+        with open(os.path.join(args.out_dir, name), "wb") as f:
+            f.write(image)
+        truth[name] = receipt
+    with open(os.path.join(args.out_dir, "truth.json"), "w", encoding="utf-8") as f:
+        json.dump(truth, f, indent=1)
+    print(f"Wrote {args.count} receipts to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
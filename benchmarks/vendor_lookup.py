@@ -0,0 +1,68 @@
+"""Vendor -> category lookup latency with tens of thousands of learned vendors.
+
+    python -m benchmarks.vendor_lookup --vendors 50000
+"""
+import argparse
+import random
+import statistics
+import string
+import time
+
+from vendor_map import VendorIndex
+
+WORDS = ["coffee", "market", "grill", "express", "store", "pharmacy", "station", "kitchen", "books",
+         "garden", "bakery", "hardware", "electric", "fresh", "city", "corner", "central", "royal"]
+
+
+def _vendor(rng):
+    name = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+    return f"{name.title()} {rng.choice(WORDS).title()}"
+
+
+def _ocr_noise(rng, name):
+    swaps = {"o": "0", "l": "1", "s": "5", "b": "8"}
+    return "".join(swaps.get(ch.lower(), ch) if rng.random() < 0.3 else ch for ch in name.upper())
+
+
+def _typo(rng, name):
+    i = rng.randrange(1, len(name) - 1)
+    return _ocr_noise(rng, name[:i] + name[i + 1:])
+
+
+def _time(fn, queries):
+    timings = []
+    hits = 0
+    for q in queries:
+        start = time.perf_counter()
+        hits += fn(q) is not None
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.mean(timings), timings[int(len(timings) * 0.99) - 1], hits
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--vendors", type=int, default=50000)
+    arg_parser.add_argument("--queries", type=int, default=2000)
+    args = arg_parser.parse_args(argv)
+
+    rng = random.Random(42)
+    vendors = [_vendor(rng) for _ in range(args.vendors)]
+    start = time.perf_counter()
+    index = VendorIndex((v, "Misc") for v in vendors)
+    print(f"Indexed {len(index)} vendors in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    sample = rng.sample(vendors, args.queries)
+    cases = [
+        ("exact (case-insensitive)", [v.upper() for v in sample]),
+        ("fuzzy (OCR noise)", [_ocr_noise(rng, v) for v in sample]),
+        ("fuzzy (noise + dropped char)", [_typo(rng, v) for v in sample]),
+        ("miss", [_vendor(rng) + " Ltd" for _ in sample]),
+    ]
+    for label, queries in cases:
+        mean, p99, hits = _time(index.get, queries)
+        print(f"{label:<30} mean {mean * 1e6:7.1f} us | p99 {p99 * 1e6:7.1f} us | hits {hits}/{len(queries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import streamlit as st
+
+import database
+
+# Cached reads for the app. Each takes the owner and the write counter of the table it reads
+# (database.get_data_versions()), so a hit is only ever served until that table changes and one
+# user's results are never served to another. Nothing here expires on a timer.
+MAX_ENTRIES = 256
+
+
+def data_versions():
+    return database.get_data_versions()
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def dashboard_stats(owner, receipts_version):
+    return database.get_dashboard_stats()
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def summary(owner, receipts_version):
+    return database.get_summary()
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def spend(owner, receipts_version, start, end):
+    return database.get_spend(start, end)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def receipts_page(owner, receipts_version, cursor, limit, category, vendor):
+    return database.get_receipts_page(cursor, limit, category, vendor)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def search(owner, receipts_version, text):
+    return database.search_receipts(text)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def budget(owner, settings_version):
+    return database.load_budget()
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def currency(owner, settings_version):
+    return database.load_currency()
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def category_for_vendor(owner, vendor_map_version, vendor):
+    return database.get_category_for_vendor(vendor)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def monthly_totals(owner, receipts_version, start, end, categories):
+    return database.get_monthly_totals(start, end, categories)
+
+
+@st.cache_data(max_entries=MAX_ENTRIES, show_spinner=False)
+def top_vendors(owner, receipts_version, start, end, categories):
+    return database.get_top_vendors(start, end, categories)
+
+
+# Chart figures take longer to build than any of the reads above, so they are kept too. These are
+# shared objects rather than copies (a Figure pickles slowly); st.plotly_chart only reads them.
+@st.cache_resource(max_entries=MAX_ENTRIES, show_spinner=False)
+def category_pie(owner, receipts_version):
+    import plotly.express as px
+    return px.pie(summary(owner, receipts_version), values='total', names='category', hole=0.4)
+
+
+@st.cache_resource(max_entries=MAX_ENTRIES, show_spinner=False)
+def timeline_chart(owner, receipts_version, currency):
+    import plotly.express as px
+    summary_df = summary(owner, receipts_version)
+    df_plot = summary_df[summary_df['month'] != '']
+    if df_plot.empty:
+        return None
+    return px.line(df_plot, x='month', y='total', markers=True, color='category', hover_data=['count'],
+                   labels={'month': 'Month', 'total': f'Amount ({currency})'})
+
+
+@st.cache_resource(max_entries=MAX_ENTRIES, show_spinner=False)
+def long_range_chart(owner, receipts_version, start, end, categories, currency):
+    import plotly.express as px
+    return px.bar(monthly_totals(owner, receipts_version, start, end, categories), x='month', y='total',
+                  color='category', hover_data=['count'],
+                  labels={'month': 'Month', 'total': f'Amount ({currency})'})
@@ -0,0 +1,128 @@
+import threading
+from collections import defaultdict, deque
+
+# Built-in keyword rules. Add categories or keywords here; they are compiled once per process.
+CATEGORY_KEYWORDS = {
+    'Groceries': ['supermarket', 'mart', 'food', 'grocery', 'store'],
+    'Dining': ['cafe', 'restaurant', 'kitchen', 'grill', 'pub', 'coffee', 'pizza'],
+    'Transport': ['fuel', 'gas', 'station', 'taxi', 'transit']
+}
+
+VENDOR_WEIGHT = 3.0  # A keyword in the vendor line says far more than one buried in the items
+TEXT_WEIGHT = 1.0
+LEARNED_WEIGHT = 5.0  # A vendor the user already categorized, seen anywhere on the receipt
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: finds every keyword occurrence in one left-to-right pass.
+
+    Cost per scan depends on the text length and the number of hits, not on how many
+    keywords were compiled in.
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for word, payload in keywords:
+            word = word.lower()
+            if word:
+                self._insert(word, payload)
+        self._link()
+
+    def _insert(self, word, payload):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state].append((len(word), payload))
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text):
+        """Yields (start, end, payload) for every keyword occurrence in the lower-cased text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload in out[state]:
+                yield i - length + 1, i + 1, payload
+
+
+def _is_word(text, start, end):
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+class Categorizer:
+    """Scores categories by weighted keyword hits over the vendor line and the full OCR text.
+
+    Built-in keywords and user-learned vendor names share one automaton, so a receipt is
+    scanned exactly once however many rules there are.
+    """
+
+    def __init__(self, category_keywords=None, learned=()):
+        category_keywords = CATEGORY_KEYWORDS if category_keywords is None else category_keywords
+        rules = [(kw, (category, False)) for category, words in category_keywords.items() for kw in words]
+        rules.extend((vendor, (category, True)) for vendor, category in learned if vendor and category)
+        self._automaton = KeywordAutomaton(rules)
+
+    def score(self, vendor_name, full_text=""):
+        vendor = str(vendor_name or "").lower()
+        text = f"{vendor}\n{str(full_text or '').lower()}"
+        split = len(vendor)
+        scores = defaultdict(float)
+
+        for start, end, (category, learned) in self._automaton.iter_matches(text):
+            if learned:
+                if _is_word(text, start, end):
+                    scores[category] += LEARNED_WEIGHT
+            elif end <= split:
+                # Vendor names keep plain substring matching ("Walmart" -> "mart")
+                scores[category] += VENDOR_WEIGHT
+            elif _is_word(text, start, end):
+                scores[category] += TEXT_WEIGHT
+        return dict(scores)
+
+    def categorize(self, vendor_name, full_text="", default="Uncategorized"):
+        scores = self.score(vendor_name, full_text)
+        if not scores:
+            return default
+        return max(scores.items(), key=lambda item: item[1])[0]
+
+
+_compiled = {}  # Source (e.g. a database path) -> (Categorizer, learned version it was compiled at)
+_lock = threading.Lock()
+
+
+def get_categorizer(learned_version=None, learned_loader=None, source=None):
+    """Categorizer for `source`, recompiled only when its `learned_version` changes.
+
+    `learned_loader()` should return the (vendor, category) rows the user has taught the app.
+    Each source keeps its own, since version numbers of different databases say nothing about
+    each other.
+    """
+    with _lock:
+        categorizer, version = _compiled.get(source, (None, None))
+        if categorizer is None or learned_version != version:
+            learned = learned_loader() if learned_loader is not None else ()
+            categorizer = Categorizer(learned=learned)
+            _compiled[source] = (categorizer, learned_version)
+        return categorizer
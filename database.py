@@ -1,218 +1,1202 @@
+import datetime
+import hashlib
+import os
+import re
 import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext as _nullcontext
 import pandas as pd
-from streamlit_gsheets import GSheetsConnection
-from sync_manager import push_to_cloud
-DB_NAME = "expenses.db"
+import perf
+from vendor_map import VendorIndex, normalize_vendor
+from dedup import ImageHashIndex, from_signed, to_signed
+from extractor import normalize_date
+DB_NAME = "expenses.db"  # Shared database, used until a thread picks an owner with use_owner()
+OWNER_DB_DIR = "owners"  # One database file per user: receipts, settings and vendor map
 
+# One connection per thread, kept open for the life of the thread instead of one per call
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()  # Database paths whose tables have been created in this process
+# Stored in each file's PRAGMA user_version once its schema is complete. Bump it whenever
+# _ensure_schema() gains a table, column, index or trigger, so existing files get migrated
+SCHEMA_VERSION = 9
 
-def init_db():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS receipts
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, vendor TEXT, total REAL, date TEXT, category TEXT, raw_text TEXT)''')
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",  # Readers no longer block the writer (and vice versa)
+    "PRAGMA synchronous = NORMAL",  # Safe with WAL, and avoids an fsync on every commit
+    "PRAGMA cache_size = -16000",  # ~16 MB page cache
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
 
-    # Create settings table with both columns immediately
-    c.execute('''CREATE TABLE IF NOT EXISTS settings
-                 (key TEXT PRIMARY KEY, value REAL, value_text TEXT)''')
-    conn.commit()
-    conn.close()
 
+def _ensure_schema(conn, db_name):
+    with _schema_lock:
+        if db_name in _schema_ready:
+            return
+        # A file already stamped with this version has every table, trigger and backfill below
+        stored = conn.execute("PRAGMA user_version").fetchone()[0]
+        if stored == SCHEMA_VERSION:
+            _schema_ready.add(db_name)
+            return
+        conn.execute(f"CREATE TABLE IF NOT EXISTS receipts {_RECEIPTS_COLUMNS}")
 
-def sync_from_cloud(owner_name):
-    try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        # Read the backup sheet
-        df = conn.read(ttl=0)  # ttl=0 forces a fresh pull from Google
-
-        # Filter for this specific user
-        user_data = df[df['owner'] == owner_name]
-
-        if not user_data.empty:
-            import sqlite3
-            db_conn = sqlite3.connect('expenses.db')
-            # Inject the cloud data into your local SQLite
-            # We drop 'owner' so it fits your existing SQLite table structure
-            user_data.drop(columns=['owner']).to_sql('receipts', db_conn, if_exists='replace', index=False)
-            db_conn.close()
-            return True
-    except Exception as e:
-        print(f"Cloud sync failed: {e}")
-    return False
+        # Create settings table with both columns immediately
+        conn.execute('''CREATE TABLE IF NOT EXISTS settings
+                     (key TEXT PRIMARY KEY, value REAL, value_text TEXT)''')
 
+        conn.execute("BEGIN")
+        _migrate_vendor_map(conn)
+        # vendor_key is the normalized name, so case-insensitive lookups hit the primary key index
+        conn.execute('''CREATE TABLE IF NOT EXISTS vendor_map
+                     (vendor_key TEXT PRIMARY KEY, vendor TEXT, category TEXT)''')
 
-def save_receipt(data, owner):
-    import sqlite3
-    # Save to your local computer first
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO receipts (vendor, total, date, category, raw_text) VALUES (?, ?, ?, ?, ?)",
-              (data['vendor'], data['total'], data['date'], data['category'], data['raw_text']))
-    conn.commit()
-    conn.close()
+        # Bumped by triggers on every vendor_map write so cached copies know when they are stale
+        conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('vendor_map_version', 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS vendor_map_{event.lower()}_version
+                             AFTER {event} ON vendor_map BEGIN
+                                 UPDATE settings SET value = value + 1 WHERE key = 'vendor_map_version';
+                             END''')
+        _ensure_receipts_key(conn)
+        _ensure_date_column(conn)
+        _ensure_summary(conn)
+        _ensure_search(conn)
+        _ensure_dedup(conn)
+        _ensure_versions(conn)
+        _ensure_archive_log(conn)
+        _ensure_outbox(conn)
+        _ensure_cloud_ids(conn)
+        _ensure_edited(conn)
+        _ensure_ocr_cache(conn)
+        if stored < 5:
+            _normalize_dates(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+        _schema_ready.add(db_name)
 
-    # TRIGGER THE CLOUD SYNC
-    try:
-        from sync_manager import push_to_cloud
-        push_to_cloud(owner, data)
-    except Exception as e:
-        print(f"Cloud trigger failed: {e}")
 
+def _iso_date_sql(date):
+    # Stored 'DD/MM/YY' (or 'DD/MM/YYYY', or already ISO) -> 'YYYY-MM-DD'; NULL when unreadable.
+    # extractor.format_date only writes two-digit years for 2000-2099, so '20' is always the century
+    return (f"CASE WHEN {date} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9]' "
+            f"THEN '20' || substr({date}, 7, 2) || '-' || substr({date}, 4, 2) || '-' || substr({date}, 1, 2) "
+            f"WHEN {date} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' "
+            f"THEN substr({date}, 7, 4) || '-' || substr({date}, 4, 2) || '-' || substr({date}, 1, 2) "
+            f"WHEN {date} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' THEN {date} END")
 
 
-def push_to_cloud(owner, vendor, total, date, category):
-    conn = st.connection("gsheets", type=GSheetsConnection)
-    df = conn.read(ttl=0)
+_SORT_KEY = "IFNULL(date_iso, '')"
 
-    new_entry = pd.DataFrame([{
-        "owner": owner,
-        "vendor": vendor,
-        "total": total,
-        "date": date,
-        "category": category
-    }])
 
-    updated_df = pd.concat([df, new_entry], ignore_index=True)
-    conn.update(data=updated_df)
+def _normalize_dates(conn):
+    """One-time rewrite of dates stored as typed ('1/2/2025', '3 Feb 25') into the DD/MM/YY form.
 
+    Rows pulled from the sheet used to skip normalize_date, and date_iso is NULL for anything
+    it can't read, which kept them out of date-window queries and the listing order.
+    """
+    rows = conn.execute("SELECT id, date FROM receipts WHERE date IS NOT NULL").fetchall()
+    changed = [(new, receipt_id) for receipt_id, date in rows for new in [normalize_date(date)] if new != date]
+    conn.executemany("UPDATE receipts SET date = ? WHERE id = ?", changed)
 
-def get_all_receipts():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT * FROM receipts ORDER BY id DESC", conn)
-    conn.close()
-    return df
 
+_RECEIPTS_COLUMNS = "(id INTEGER PRIMARY KEY AUTOINCREMENT, vendor TEXT, total REAL, date TEXT, category TEXT, raw_text TEXT)"
+# Columns added to receipts by later migrations; a rebuilt table keeps whichever of them it had
+_ADDED_COLUMNS = {"image_hash": "INTEGER", "cloud_id": "INTEGER", "edited": "TEXT NOT NULL DEFAULT ''"}
 
-def delete_receipt(receipt_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        # Convert to int just in case
-        tid = int(receipt_id)
-        c.execute("DELETE FROM receipts WHERE id = ?", (tid,))
 
-        # This tells us if SQLite actually found and deleted a row
-        if c.rowcount > 0:
-            print(f"✅ SQLite: Deleted row with ID {tid}")
-        else:
-            print(f"❓ SQLite: No row found with ID {tid}")
+def _ensure_receipts_key(conn):
+    """Rebuilds a receipts table whose id isn't its primary key.
 
-        conn.commit()
-    except Exception as e:
-        print(f"❌ SQLite Error: {e}")
+    The old sync_from_cloud replaced the table through pandas.to_sql, which leaves id a plain column,
+    so every receipt saved afterwards got a NULL id. Stored ids are kept (the first copy of a repeated
+    one), and rows without one are numbered after them. The indexes, triggers and tables derived from
+    receipts are then rebuilt by the rest of _ensure_schema.
+    """
+    info = conn.execute("PRAGMA table_info(receipts)").fetchall()  # (cid, name, type, notnull, default, pk)
+    if any(name == "id" and pk for _, name, _, _, _, pk in info):
+        return
+    present = {row[1] for row in info}
+    base = [c for c in ("vendor", "total", "date", "category", "raw_text") if c in present]
+    added = [c for c in _ADDED_COLUMNS if c in present]
+    conn.execute("ALTER TABLE receipts RENAME TO receipts_unkeyed")
+    conn.execute(f"CREATE TABLE receipts {_RECEIPTS_COLUMNS}")
+    for column in added:
+        conn.execute(f"ALTER TABLE receipts ADD COLUMN {column} {_ADDED_COLUMNS[column]}")
+    columns = ", ".join(base + added)
+    old_id = "CAST(id AS INTEGER)" if "id" in present else "NULL"
+    # The ids to_sql wrote came from the sheet, so a kept id is also the row's cloud id; renumbered rows have none
+    cloud_id = "" if "cloud_id" in added else ", cloud_id"
+    if cloud_id:
+        conn.execute(f"ALTER TABLE receipts ADD COLUMN cloud_id {_ADDED_COLUMNS['cloud_id']}")
+    # NULL ids go in last, so AUTOINCREMENT numbers them after the highest kept id
+    conn.execute(f"""INSERT INTO receipts (id, {columns}{cloud_id})
+                     SELECT new_id, {columns}{cloud_id and ', new_id'} FROM (
+                         SELECT CASE WHEN ROW_NUMBER() OVER (PARTITION BY key ORDER BY seq) = 1 THEN key END AS new_id,
+                                seq, {columns}
+                         FROM (SELECT {old_id} AS key, rowid AS seq, {columns} FROM receipts_unkeyed))
+                     ORDER BY new_id IS NULL, new_id, seq""")
+    conn.execute("DROP TABLE receipts_unkeyed")  # Takes the old triggers and indexes with it
+
+    # Everything kept in step by triggers missed the copy: have it rebuilt from the new table
+    conn.execute("DELETE FROM settings WHERE key = 'summary_version'")
+    conn.execute("DROP TABLE IF EXISTS receipts_fts")
+    conn.execute("DROP TABLE IF EXISTS archive_dirty")
+    conn.execute("UPDATE settings SET value = value + 1 WHERE key IN ('receipts_version', 'image_hash_version')")
+
+
+def _ensure_date_column(conn):
+    """Adds receipts.date_iso, a sortable copy of the DD/MM/YY date that SQLite keeps in step itself.
+
+    It is a virtual generated column, so existing rows need no rewrite; building the index is the
+    whole migration.
+    """
+    cols = [row[1] for row in conn.execute("PRAGMA table_xinfo(receipts)")]
+    if "date_iso" not in cols:
+        conn.execute(f"ALTER TABLE receipts ADD COLUMN date_iso TEXT GENERATED ALWAYS AS ({_iso_date_sql('date')}) VIRTUAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_date ON receipts (date_iso, id)")
+    # Listing order (undated receipts sort last), overall and within a category, plus vendor prefix filters
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_receipts_listing ON receipts ({_SORT_KEY}, id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_receipts_category_listing ON receipts (category, {_SORT_KEY}, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_vendor ON receipts (vendor COLLATE NOCASE)")
+
+
+def _month_sql(row=""):
+    # 'YYYY-MM' from date_iso; receipts with no readable date land in the '' bucket
+    return f"COALESCE(substr({row}date_iso, 1, 7), '')"
+
+
+SUMMARY_VERSION = 2  # Bump when the summary triggers change; they are then recreated and the table rebuilt
+
+
+def _ensure_summary(conn):
+    """Per category x month totals, kept current by triggers on receipts so the dashboard never scans it."""
+    version = conn.execute("SELECT value FROM settings WHERE key = 'summary_version'").fetchone()
+    stale = not version or version[0] != SUMMARY_VERSION
+    if stale:
+        for name in ("receipts_summary_insert", "receipts_summary_delete", "receipts_summary_update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute("DROP INDEX IF EXISTS idx_receipts_bucket")
+    conn.execute('''CREATE TABLE IF NOT EXISTS receipt_summary
+                    (category TEXT, month TEXT, total REAL, count INTEGER, max_total REAL, max_id INTEGER,
+                     PRIMARY KEY (category, month))''')
+    # Finds the next-largest receipt of a bucket when its biggest one goes away
+    conn.execute(f'''CREATE INDEX IF NOT EXISTS idx_receipts_bucket
+                     ON receipts (COALESCE(category, ''), {_month_sql()}, total)''')
+
+    def add(row):
+        return f'''INSERT INTO receipt_summary (category, month, total, count, max_total, max_id)
+                   VALUES (COALESCE({row}.category, ''), {_month_sql(f'{row}.')}, COALESCE({row}.total, 0), 1,
+                           COALESCE({row}.total, 0), {row}.id)
+                   ON CONFLICT (category, month) DO UPDATE SET
+                       total = total + excluded.total, count = count + 1,
+                       max_id = CASE WHEN excluded.max_total > max_total THEN excluded.max_id ELSE max_id END,
+                       max_total = MAX(max_total, excluded.max_total);'''
+
+    def remove(row):
+        bucket = f"category = COALESCE({row}.category, '') AND month = {_month_sql(f'{row}.')}"
+        return f'''UPDATE receipt_summary SET total = total - COALESCE({row}.total, 0), count = count - 1
+                   WHERE {bucket};
+                   DELETE FROM receipt_summary WHERE {bucket} AND count <= 0;
+                   UPDATE receipt_summary SET (max_total, max_id) = (
+                       SELECT COALESCE(total, 0), id FROM receipts
+                       WHERE COALESCE(category, '') = COALESCE({row}.category, '')
+                         AND {_month_sql()} = {_month_sql(f'{row}.')}
+                       ORDER BY total DESC LIMIT 1)
+                   WHERE {bucket} AND max_id = {row}.id;'''
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS receipts_summary_insert AFTER INSERT ON receipts BEGIN {add('NEW')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS receipts_summary_delete AFTER DELETE ON receipts BEGIN {remove('OLD')} END")
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS receipts_summary_update
+                     AFTER UPDATE OF id, total, date, category ON receipts BEGIN {remove('OLD')} {add('NEW')} END''')
+    if stale:
+        rebuild_summary(conn)
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('summary_version', ?)", (SUMMARY_VERSION,))
+
+
+def rebuild_summary(conn=None):
+    """Recomputes receipt_summary from scratch, e.g. after rows were written with triggers bypassed."""
+    with db_session() if conn is None else _nullcontext(conn) as conn:
+        conn.execute("DELETE FROM receipt_summary")
+        conn.execute(f'''INSERT INTO receipt_summary (category, month, total, count, max_total, max_id)
+                         SELECT COALESCE(category, ''), {_month_sql()}, SUM(COALESCE(total, 0)), COUNT(*),
+                                MAX(COALESCE(total, 0)), id
+                         FROM receipts GROUP BY 1, 2''')
+
+
+def _ensure_search(conn):
+    """FTS5 index over vendor, category and OCR text, kept in step with receipts by triggers.
+
+    It is an external-content table: the text lives only in receipts, the index just points at it.
+    A database that predates the index gets it backfilled once.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'receipts_fts'").fetchone()
+    # Prefix indexes make the "cab*" queries search_receipts issues as cheap as whole-word ones
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS receipts_fts USING fts5(
+                        vendor, category, raw_text, content='receipts', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+
+    def add(row):
+        return f'''INSERT INTO receipts_fts (rowid, vendor, category, raw_text)
+                   VALUES ({row}.id, {row}.vendor, {row}.category, {row}.raw_text);'''
+
+    def remove(row):
+        return f'''INSERT INTO receipts_fts (receipts_fts, rowid, vendor, category, raw_text)
+                   VALUES ('delete', {row}.id, {row}.vendor, {row}.category, {row}.raw_text);'''
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS receipts_fts_insert AFTER INSERT ON receipts BEGIN {add('NEW')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS receipts_fts_delete AFTER DELETE ON receipts BEGIN {remove('OLD')} END")
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS receipts_fts_update
+                     AFTER UPDATE OF id, vendor, category, raw_text ON receipts BEGIN {remove('OLD')} {add('NEW')} END''')
+    if not exists:
+        conn.execute("INSERT INTO receipts_fts (receipts_fts) VALUES ('rebuild')")
+
+
+# Two receipts are the same purchase when these match: vendor ignoring case and padding, day, total to the cent
+_DEDUP_KEY = "lower(trim(vendor)), IFNULL(date_iso, date), round(total, 2)"
+
+
+def _ensure_dedup(conn):
+    """Duplicate detection: an index on the exact (vendor, date, total) key, and per-image perceptual hashes.
+
+    image_hash is only known for receipts uploaded on this machine; rows pulled from the cloud
+    have none. Triggers bump image_hash_version whenever a stored hash appears, moves or goes.
+    """
+    cols = [row[1] for row in conn.execute("PRAGMA table_xinfo(receipts)")]
+    if "image_hash" not in cols:
+        conn.execute("ALTER TABLE receipts ADD COLUMN image_hash INTEGER")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_receipts_dedup ON receipts ({_DEDUP_KEY})")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_receipts_image_hash ON receipts (image_hash) WHERE image_hash IS NOT NULL")
+    conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('image_hash_version', 0)")
+    bump = "UPDATE settings SET value = value + 1 WHERE key = 'image_hash_version';"
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS receipts_image_hash_insert AFTER INSERT ON receipts
+                     WHEN NEW.image_hash IS NOT NULL BEGIN {bump} END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS receipts_image_hash_delete AFTER DELETE ON receipts
+                     WHEN OLD.image_hash IS NOT NULL BEGIN {bump} END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS receipts_image_hash_update AFTER UPDATE OF id, image_hash ON receipts
+                     WHEN OLD.image_hash IS NOT NULL OR NEW.image_hash IS NOT NULL BEGIN {bump} END''')
+
+
+# Tables whose every write bumps a `<table>_version` counter in settings, so cached reads know when
+# they are stale (vendor_map has had its own counter all along)
+VERSIONED_TABLES = ("receipts", "settings")
+
+
+def _ensure_versions(conn):
+    for table in VERSIONED_TABLES:
+        key = f"{table}_version"
+        conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, 0)", (key,))
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            # The counters live in settings themselves; bumping one must not count as a settings change
+            when = f"WHEN {row}.key NOT LIKE '%version'" if table == "settings" else ""
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} {when}
+                             BEGIN UPDATE settings SET value = value + 1 WHERE key = '{key}'; END''')
+
+
+def _ensure_archive_log(conn):
+    """Months whose receipts changed since archive.py last wrote them to Parquet.
+
+    `changes` counts writes, so an export only clears a month nobody touched while it ran.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'archive_dirty'").fetchone()
+    conn.execute("CREATE TABLE IF NOT EXISTS archive_dirty (month TEXT PRIMARY KEY, changes INTEGER)")
+
+    def touch(row):
+        return f'''INSERT INTO archive_dirty (month, changes) VALUES ({_month_sql(f'{row}.')}, 1)
+                   ON CONFLICT (month) DO UPDATE SET changes = changes + 1;'''
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS receipts_archive_insert AFTER INSERT ON receipts BEGIN {touch('NEW')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS receipts_archive_delete AFTER DELETE ON receipts BEGIN {touch('OLD')} END")
+    # Only the archived columns: setting cloud_id or edited must not mark a month for rewriting.
+    # Recreated on every migration, since older files have it firing on any update
+    conn.execute("DROP TRIGGER IF EXISTS receipts_archive_update")
+    conn.execute(f"CREATE TRIGGER receipts_archive_update AFTER UPDATE OF id, vendor, total, date, category, raw_text "
+                 f"ON receipts BEGIN {touch('OLD')} {touch('NEW')} END")
+    if not exists:
+        # Everything stored before the log existed still has to reach the archive once
+        conn.execute("INSERT INTO archive_dirty (month, changes) SELECT DISTINCT month, 1 FROM receipt_summary")
+
+
+def _ensure_outbox(conn):
+    """Cloud writes waiting for the outbox flusher (outbox.py), committed with the receipts they copy."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS cloud_outbox
+                    (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT, owner TEXT, receipt_id INTEGER,
+                     cloud_id INTEGER, payload TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0,
+                     last_error TEXT, created REAL)''')
+    # Edits look up a pending append for the same receipt before queueing
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cloud_outbox_receipt ON cloud_outbox (receipt_id)')
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(cloud_outbox)")]
+    if "sending" not in cols:
+        # Set while an append is in flight, so nothing is folded into a row that is already on its way
+        conn.execute("ALTER TABLE cloud_outbox ADD COLUMN sending INTEGER DEFAULT 0")
+        # Queued edits and deletes used to name the sheet row by receipt_id, and often no owner
+        conn.execute("""UPDATE cloud_outbox SET cloud_id = receipt_id,
+                            owner = CASE WHEN IFNULL(owner, '') = '' THEN IFNULL(
+                                (SELECT owner FROM cloud_outbox WHERE op = 'append' AND owner != '' LIMIT 1), '')
+                                ELSE owner END
+                        WHERE op != 'append' AND cloud_id IS NULL""")
+
+
+def _ensure_ocr_cache(conn):
+    """OCR text by image hash (ocr_cache.py). Part of the schema so every owner's file has it from the start."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS ocr_cache
+                    (key TEXT PRIMARY KEY, text TEXT, size INTEGER, created REAL, last_used REAL)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used)')
+
+
+def _ensure_cloud_ids(conn):
+    """receipts.cloud_id: the sheet id of a receipt's row, NULL until its append has gone out.
+
+    Sheet ids are shared by every owner, while local ids only count one file's rows, so the
+    two are kept apart. Rows stored before the column existed carried their sheet id as id.
+    """
+    cols = [row[1] for row in conn.execute("PRAGMA table_xinfo(receipts)")]
+    if "cloud_id" not in cols:
+        conn.execute("ALTER TABLE receipts ADD COLUMN cloud_id INTEGER")
+        conn.execute("""UPDATE receipts SET cloud_id = id WHERE id NOT IN (
+                            SELECT receipt_id FROM cloud_outbox WHERE op = 'append' AND receipt_id IS NOT NULL)""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_receipts_cloud_id ON receipts (cloud_id)")
+
+
+def _ensure_edited(conn):
+    """receipts.edited: the fields (comma-separated) the user set by hand, which reprocess.py leaves alone.
+
+    Rows saved before the column existed start empty; there's no telling their edits from extraction.
+    """
+    cols = [row[1] for row in conn.execute("PRAGMA table_xinfo(receipts)")]
+    if "edited" not in cols:
+        conn.execute("ALTER TABLE receipts ADD COLUMN edited TEXT NOT NULL DEFAULT ''")
+
+
+def _mark_edited(conn, edits):
+    # edits are (receipt id, field names) pairs; adds the names to what each row already has
+    edits = [(int(rid), set(fields)) for rid, fields in edits if fields]
+    if not edits:
+        return
+    ids = [rid for rid, _ in edits]
+    marks = {}
+    for i in range(0, len(ids), 900):
+        part = ids[i:i + 900]
+        marks.update(conn.execute(f"SELECT id, edited FROM receipts WHERE id IN ({','.join('?' * len(part))})",
+                                  part).fetchall())
+    conn.executemany("UPDATE receipts SET edited = ? WHERE id = ?",
+                     [(",".join(f for f in EDITABLE_COLUMNS if f in fields or f in marks[rid].split(",")), rid)
+                      for rid, fields in edits if rid in marks])
+
+
+def _migrate_vendor_map(conn):
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(vendor_map)")]
+    if not cols or "vendor_key" in cols:
+        return
+    # Older databases keyed the table on the raw name, in a column called either `vendor` or `vendor_name`
+    name_col = "vendor" if "vendor" in cols else "vendor_name"
+    rows = conn.execute(f"SELECT {name_col}, category FROM vendor_map").fetchall()
+    conn.execute("DROP TABLE vendor_map")
+    conn.execute('''CREATE TABLE vendor_map
+                 (vendor_key TEXT PRIMARY KEY, vendor TEXT, category TEXT)''')
+    conn.executemany("INSERT OR REPLACE INTO vendor_map (vendor_key, vendor, category) VALUES (?, ?, ?)",
+                     [(normalize_vendor(v), v, c) for v, c in rows if v and normalize_vendor(v)])
+
+
+def owner_slug(owner):
+    """`owner` as a name safe for files and directories, e.g. for owners/<slug>.db."""
+    owner = str(owner).strip().lower()
+    name = re.sub(r"[^a-z0-9_.-]", "_", owner).strip(".") or "_"
+    if name != owner:
+        # Keep owners whose names only differ in the replaced characters apart
+        name += "-" + hashlib.sha1(owner.encode()).hexdigest()[:8]
+    return name
+
+
+def owner_db_path(owner):
+    """The database file holding `owner`'s data, e.g. owners/alice.db."""
+    return os.path.join(OWNER_DB_DIR, f"{owner_slug(owner)}.db")
+
+
+def current_db():
+    """Path of the database this thread's calls go to."""
+    return getattr(_local, "db_override", None) or DB_NAME
+
+
+def current_owner():
+    """The owner picked with use_owner() on this thread, or None."""
+    return getattr(_local, "owner", None)
+
+
+def use_database(path):
+    """Points this thread's database calls at `path` (None: back to DB_NAME)."""
+    if getattr(_local, "depth", 0):
+        raise RuntimeError("Can't switch databases inside a db_session")
+    _local.db_override = path
+    _local.owner = None
+
+
+def use_owner(owner):
+    """Points this thread's database calls at `owner`'s own file (None: back to the shared DB_NAME).
+
+    Opening it is all a login costs. A user's first file is seeded with the budget, currency and
+    learned vendors of the shared database; their receipts come from the first cloud pull.
+    """
+    path = owner_db_path(owner) if owner else None
+    fresh = path is not None and not os.path.exists(path)
+    use_database(path)
+    _local.owner = str(owner).strip().lower() if owner else None
+    if fresh:
+        _seed_from_shared(get_connection())
+
+
+def _seed_from_shared(conn):
+    if not os.path.exists(DB_NAME) or os.path.abspath(DB_NAME) == os.path.abspath(current_db()):
+        return
+    conn.execute("ATTACH DATABASE ? AS shared", (DB_NAME,))
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM shared.sqlite_master WHERE type = 'table'")}
+        with db_session():
+            if "settings" in tables:
+                conn.execute("""INSERT OR IGNORE INTO settings (key, value, value_text)
+                                SELECT key, value, value_text FROM shared.settings WHERE key IN ('budget', 'currency')""")
+            if "vendor_map" in tables:
+                conn.execute("""INSERT OR IGNORE INTO vendor_map (vendor_key, vendor, category)
+                                SELECT vendor_key, vendor, category FROM shared.vendor_map""")
+    except sqlite3.Error as e:
+        # Older layouts are skipped; the user just starts with default settings
+        print(f"Could not seed {current_db()} from {DB_NAME}: {e}")
     finally:
+        conn.execute("DETACH DATABASE shared")
+
+
+POOL_SIZE = 4  # Idle connections kept per database for the next thread that needs one
+
+_pools = {}  # Database path -> idle connections, warm page cache included
+_pool_lock = threading.Lock()
+
+
+class _Lease:
+    """A thread's hold on a pooled connection.
+
+    It lives in the thread-local, so when the thread finishes (Streamlit runs each rerun in a
+    fresh thread) it is dropped and the connection goes back to the pool instead of being lost.
+    """
+
+    def __init__(self, db_name, conn):
+        self.db_name = db_name
+        self.conn = conn
+
+    def release(self):
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            return
+        with _pool_lock:
+            idle = _pools.setdefault(self.db_name, [])
+            if len(idle) < POOL_SIZE:
+                idle.append(conn)
+                return
         conn.close()
 
-    # Trigger cloud delete
-    from sync_manager import delete_from_cloud
-    delete_from_cloud(receipt_id)
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass  # Interpreter shutdown
 
-def update_receipt(receipt_id, vendor, total, date, category):
-    """Updates an existing record in the local SQLite database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+
+_inherited = []  # Handles a forked child got from its parent; kept referenced so they are never closed
+
+
+def _forget_connections():
+    """Runs in a forked child: drops the parent's connections without using them, which SQLite
+    documents as unsafe across fork(), so the child opens its own on first use."""
+    global _local, _pool_lock
+    lease = getattr(_local, "lease", None)
+    if lease is not None:
+        _inherited.append(lease.conn)
+        lease.conn = None
+    for idle in _pools.values():
+        _inherited.extend(idle)
+    _pools.clear()
+    _local = threading.local()
+    _pool_lock = threading.Lock()  # Another parent thread may have held it at the fork
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_connections)
+
+
+@perf.timed("db.connect")
+def _checkout(db_name):
+    with _pool_lock:
+        idle = _pools.get(db_name)
+        if idle:
+            return idle.pop()
+    if os.path.dirname(db_name):
+        os.makedirs(os.path.dirname(db_name), exist_ok=True)
+    # Autocommit mode: transactions are opened explicitly by db_session(). A pooled connection
+    # moves between threads, but only ever belongs to one at a time
+    conn = sqlite3.connect(db_name, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _ensure_schema(conn, db_name)
+    return conn
+
+
+def get_connection():
+    """Returns this thread's open connection to current_db(), taking one from the pool on first use."""
+    db_name = current_db()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "db_name", None) != db_name:
+        lease = getattr(_local, "lease", None)
+        if lease is not None:
+            lease.release()  # The thread moved to another database
+        conn = _checkout(db_name)
+        _local.lease = _Lease(db_name, conn)
+        _local.conn = conn
+        _local.db_name = db_name
+        _local.depth = 0
+    return conn
+
+
+@contextmanager
+def db_session(immediate=False):
+    """Runs a block on the shared connection inside a single transaction.
+
+    Sessions nest: only the outermost one commits, so a function that calls others inside its
+    session writes everything in one transaction. Errors roll back; st.rerun()/st.stop() are
+    control flow rather than errors, so they commit. Keep sessions short: a long one that
+    reads pins its snapshot, and one that writes holds the lock every other connection waits on.
+
+    Pass immediate=True for a block that reads before it writes. It then takes the write lock
+    up front, waiting out other writers, instead of failing with "database is locked" when
+    another connection (e.g. the outbox flusher) commits between the read and the write.
+    """
+    conn = get_connection()
+    outermost = _local.depth == 0
+    if outermost and not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _local.depth += 1
+    failed = False
     try:
-        c.execute("""UPDATE receipts 
-                     SET vendor = ?, total = ?, date = ?, category = ? 
-                     WHERE id = ?""",
-                  (vendor, total, date, category, receipt_id))
-        conn.commit()
+        yield conn
+    except Exception:
+        failed = True
+        raise
     finally:
+        _local.depth -= 1
+        if outermost:
+            callbacks, _local.on_commit = getattr(_local, "on_commit", []), []
+            # pandas.to_sql commits on its own, so the transaction may already be closed here
+            if conn.in_transaction:
+                with perf.stage("db.commit"):
+                    conn.execute("ROLLBACK" if failed else "COMMIT")
+            if not failed:
+                for fn in callbacks:
+                    fn()
+
+
+def on_commit(fn):
+    """Calls fn() once this thread's session commits, or straight away outside one. Dropped on rollback.
+
+    Registering the same callable twice in one transaction calls it once.
+    """
+    if getattr(_local, "depth", 0) == 0:
+        fn()
+        return
+    callbacks = _local.__dict__.setdefault("on_commit", [])
+    if fn not in callbacks:
+        callbacks.append(fn)
+
+
+def close_connection():
+    """Closes this thread's connection for good rather than returning it to the pool."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.lease.conn = None
+        # Refreshes planner statistics where they are missing or stale, e.g. for the listing filters
+        conn.execute("PRAGMA optimize")
         conn.close()
+        _local.conn = None
 
-    from sync_manager import delete_from_cloud
-    delete_from_cloud(receipt_id)
 
-def get_category_from_db(vendor_name):
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    # We use a case-insensitive search to be safe
-    c.execute("SELECT category FROM vendor_map WHERE LOWER(vendor_name) = LOWER(?)", (vendor_name,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
+def init_db():
+    # Schema is created once per process by get_connection()
+    get_connection()
 
-def create_vendor_map_table():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS vendor_map
-                 (vendor_name TEXT PRIMARY KEY, category TEXT)''')
-    conn.commit()
-    conn.close()
-
-def update_vendor_map(vendor_name, category):
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    # "INSERT OR REPLACE" handles updating the category if the vendor already exists
-    c.execute("INSERT OR REPLACE INTO vendor_map (vendor_name, category) VALUES (?, ?)",
-              (vendor_name, category))
-    conn.commit()
-    conn.close()
 
+@perf.timed("db.set_cloud_id")
+def set_cloud_id(local_id, cloud_id):
+    """Records the sheet id a receipt's append went out under, so pulls and edits find its row."""
+    with db_session(immediate=True) as conn:
+        # A pull that ran while the append was in flight brought the same row down as a copy
+        conn.execute("DELETE FROM receipts WHERE cloud_id = ? AND id != ?", (cloud_id, local_id))
+        return conn.execute("UPDATE receipts SET cloud_id = ? WHERE id = ?", (cloud_id, local_id)).rowcount > 0
+
+
+def _find_duplicate(conn, vendor, date, total):
+    row = conn.execute(f"""SELECT id FROM receipts
+                           WHERE ({_DEDUP_KEY}) = (lower(trim(:vendor)), IFNULL({_iso_date_sql(':date')}, :date),
+                                                   round(:total, 2))
+                           LIMIT 1""", {"vendor": vendor, "date": date, "total": total}).fetchone()
+    return row[0] if row else None
+
+
+@perf.timed("db.find_duplicate")
+def find_duplicate(vendor, date, total):
+    """Id of a stored receipt with the same vendor (ignoring case), date and total, or None."""
+    with db_session() as conn:
+        return _find_duplicate(conn, vendor, normalize_date(date), total)
+
+
+def _insert_receipts(conn, rows, allow_duplicates):
+    # Returns the (id, row) pairs inserted; rows matching a stored receipt are skipped unless allowed
+    before = _image_hash_version(conn)
+    saved, hashed = [], []
+    for data in rows:
+        date = normalize_date(data['date'])
+        if not allow_duplicates:
+            dup = _find_duplicate(conn, data['vendor'], date, data['total'])
+            if dup is not None:
+                print(f"⏭️ Skipped duplicate of receipt {dup}: {data['vendor']} | {date} | {data['total']}")
+                continue
+        image_hash = data.get('image_hash')
+        local_id = conn.execute("""INSERT INTO receipts (vendor, total, date, category, raw_text, image_hash, edited)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                (data['vendor'], data['total'], date, data['category'], data['raw_text'],
+                                 None if image_hash is None else to_signed(image_hash),
+                                 ",".join(f for f in EDITABLE_COLUMNS if f in data.get('edited', ())))).lastrowid
+        saved.append((local_id, data))
+        if image_hash is not None:
+            hashed.append((None, local_id, image_hash))
+    _patch_image_index(conn, before, hashed)
+    return saved
+
+
+@perf.timed("db.save_receipt")
+def save_receipt(data, owner, allow_duplicate=False):
+    """Saves one receipt and queues it for the cloud. Returns its id, or None if it duplicates a stored one.
+
+    `data` may carry the upload's `image_hash` (dedup.dhash) so later uploads of the same photo are caught,
+    and `edited`, the fields the user corrected before saving, so reprocess.py keeps their values.
+    """
+    import outbox
+
+    # Save to your local computer first; the cloud copy is queued in the same transaction
+    with db_session(immediate=True) as conn:
+        saved = _insert_receipts(conn, [data], allow_duplicate)
+        if not saved:
+            return None
+        local_id = saved[0][0]
+        # The flusher is woken once this commits
+        outbox.enqueue("append", owner, local_id, data)
+    return local_id
+
+
+@perf.timed("db.save_receipts_batch")
+def save_receipts_batch(rows, owner, push=True, allow_duplicates=False):
+    """Inserts many extracted receipts in a single transaction. Used by the batch ingester.
+
+    Receipts already stored (or repeated within `rows`) are skipped. Returns how many were saved.
+    """
+    if not rows:
+        return 0
+    import outbox
+
+    with db_session(immediate=True) as conn:
+        saved = _insert_receipts(conn, rows, allow_duplicates)
+        if push and saved:
+            outbox.enqueue_many("append", owner, saved)
+    return len(saved)
+
+
+@perf.timed("db.get_all_receipts")
+def get_all_receipts(with_raw_text=True, limit=None):
+    columns = "*" if with_raw_text else "id, vendor, total, date, category"
+    query = f"SELECT {columns} FROM receipts ORDER BY id DESC"
+    with db_session() as conn:
+        if limit is not None:
+            return pd.read_sql_query(query + " LIMIT ?", conn, params=(int(limit),))
+        return pd.read_sql_query(query, conn)
+
+
+@perf.timed("db.get_raw_text")
+def get_raw_text(receipt_id):
+    # Loaded on demand: raw_text dwarfs every other column
+    with db_session() as conn:
+        row = conn.execute("SELECT raw_text FROM receipts WHERE id = ?", (int(receipt_id),)).fetchone()
+    return row[0] if row else None
+
+
+def current_month(today=None):
+    """[first day of this month, first day of next month) as ISO dates, for date_iso range queries."""
+    today = today or datetime.date.today()
+    start = today.replace(day=1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start.isoformat(), end.isoformat()
+
+
+def last_n_days(n, today=None):
+    """[n - 1 days ago, tomorrow): the last n days including today."""
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=n - 1)).isoformat(), (today + datetime.timedelta(days=1)).isoformat()
+
+
+@perf.timed("db.get_spend")
+def get_spend(start, end):
+    """Sum of totals dated in [start, end), an index range scan on date_iso."""
+    with db_session() as conn:
+        return conn.execute("SELECT COALESCE(SUM(total), 0) FROM receipts WHERE date_iso >= ? AND date_iso < ?",
+                            (start, end)).fetchone()[0]
+
+
+def _full_months(start, end):
+    # [first, last) of the whole months inside [start, end]; first >= last when there are none
+    first = start if start.day == 1 else (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+    after_end = end + datetime.timedelta(days=1)
+    last = after_end if after_end.day == 1 else end.replace(day=1)
+    return first, last
+
+
+@perf.timed("db.get_monthly_totals")
+def get_monthly_totals(start, end, categories=()):
+    """Spend and receipt count per month and category for receipts dated in [start, end], both dates included.
+
+    Whole months come straight from receipt_summary; only the part months at either end of the
+    range are summed from receipts, over the date_iso index.
+    """
+    first, last = _full_months(start, end)
+    in_categories = f"AND category IN ({', '.join('?' * len(categories))})" if categories else ""
+    after_end = end + datetime.timedelta(days=1)
+    edges = [(start, first), (last, after_end)] if first < last else [(start, after_end)]
+    parts, params = [], []
+    if first < last:
+        parts.append(f"""SELECT month, category, total, count FROM receipt_summary
+                         WHERE month >= ? AND month < ? {in_categories}""")
+        params += [first.isoformat()[:7], last.isoformat()[:7], *categories]
+    for lo, hi in edges:
+        if lo < hi:
+            parts.append(f"""SELECT {_month_sql()} AS month, COALESCE(category, '') AS category,
+                                    SUM(COALESCE(total, 0)) AS total, COUNT(*) AS count
+                             FROM receipts WHERE date_iso >= ? AND date_iso < ? {in_categories} GROUP BY 1, 2""")
+            params += [lo.isoformat(), hi.isoformat(), *categories]
+    if not parts:
+        return pd.DataFrame(columns=['month', 'category', 'total', 'count'])
+    with db_session() as conn:
+        return pd.read_sql_query(f"""SELECT month, category, SUM(total) AS total, SUM(count) AS count
+                                     FROM ({' UNION ALL '.join(parts)}) GROUP BY 1, 2 ORDER BY 1, 2""",
+                                 conn, params=params)
+
+
+@perf.timed("db.get_top_vendors")
+def get_top_vendors(start, end, categories=(), limit=10):
+    """The vendors with the highest spend dated in [start, end], both dates included."""
+    in_categories = f"AND category IN ({', '.join('?' * len(categories))})" if categories else ""
+    with db_session() as conn:
+        return pd.read_sql_query(f"""SELECT vendor, SUM(COALESCE(total, 0)) AS total, COUNT(*) AS count FROM receipts
+                                     WHERE date_iso >= ? AND date_iso < ? {in_categories}
+                                     GROUP BY vendor ORDER BY total DESC LIMIT ?""", conn,
+                                 params=(start.isoformat(), (end + datetime.timedelta(days=1)).isoformat(),
+                                         *categories, int(limit)))
+
+
+@perf.timed("db.get_receipts_between")
+def get_receipts_between(start, end, with_raw_text=False):
+    columns = "*" if with_raw_text else "id, vendor, total, date, category"
+    with db_session() as conn:
+        return pd.read_sql_query(f"""SELECT {columns} FROM receipts WHERE date_iso >= ? AND date_iso < ?
+                                     ORDER BY date_iso DESC, id DESC""", conn, params=(start, end))
+
+
+PAGE_SIZE = 50
+
+
+@perf.timed("db.get_receipts_page")
+def get_receipts_page(cursor=None, limit=PAGE_SIZE, category=None, vendor=None):
+    """One page of receipts, newest date first, and the cursor for the page after it (None on the last).
+
+    Keyset pagination on (date_iso, id): each page is an index seek from `cursor`, so page 500
+    costs the same as page 1. `category` is an exact match; `vendor` a case-insensitive prefix.
+    """
+    where, params = [], []
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if vendor:
+        where.append("vendor >= ? COLLATE NOCASE AND vendor < ? COLLATE NOCASE")
+        params += [vendor, vendor + chr(0x10FFFF)]
+    if cursor:
+        key, last_id = cursor
+        # The first term bounds the index range; the second breaks ties on the same date
+        where.append(f"{_SORT_KEY} <= ? AND ({_SORT_KEY} < ? OR id < ?)")
+        params += [key, key, last_id]
+
+    query = f"""SELECT id, vendor, total, date, category, {_SORT_KEY} AS sort_key FROM receipts
+                {'WHERE ' + ' AND '.join(where) if where else ''}
+                ORDER BY {_SORT_KEY} DESC, id DESC LIMIT ?"""
+    with db_session() as conn:
+        page = pd.read_sql_query(query, conn, params=params + [limit + 1])
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page.iloc[:limit]
+        next_cursor = (page['sort_key'].iloc[-1], int(page['id'].iloc[-1]))
+    return page.drop(columns='sort_key'), next_cursor
+
+
+SEARCH_WEIGHTS = (5.0, 2.0, 1.0)  # bm25 weight of a hit in vendor, category, raw_text
+
+
+def _fts_query(text):
+    # Each word becomes a quoted prefix term, so typed punctuation can't break the FTS5 syntax
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text or ""))
+
+
+@perf.timed("db.search_receipts")
+def search_receipts(text, limit=20, highlight=("**", "**")):
+    """Receipts matching every word of `text` (as a prefix) in vendor, category or OCR text, best first.
+
+    Each row carries a `snippet` of the OCR text around the hits, wrapped in `highlight` markers.
+    Every match is ranked by bm25 with SEARCH_WEIGHTS, so an old receipt whose vendor matches
+    beats a recent one that only mentions the word. A word on nearly every receipt costs a full
+    sort of its matches, about 60 ms per 100k (an FTS5 'rank' configured with the same weights
+    measured slower than calling bm25 here).
+    """
+    query = _fts_query(text)
+    if not query:
+        return pd.DataFrame(columns=['id', 'vendor', 'total', 'date', 'category', 'snippet'])
+    weights = ", ".join(map(str, SEARCH_WEIGHTS))
+    with db_session() as conn:
+        return pd.read_sql_query(f"""SELECT r.id, r.vendor, r.total, r.date, r.category,
+                                            snippet(receipts_fts, 2, ?2, ?3, '…', 12) AS snippet
+                                     FROM receipts_fts JOIN receipts r ON r.id = receipts_fts.rowid
+                                     WHERE receipts_fts MATCH ?1
+                                     ORDER BY bm25(receipts_fts, {weights}) LIMIT ?4""",
+                                 conn, params=(query, *highlight, int(limit)))
+
+
+@perf.timed("db.get_summary")
+def get_summary():
+    """Category x month aggregates (total, count, max_total, max_id), one row per bucket."""
+    with db_session() as conn:
+        return pd.read_sql_query("SELECT * FROM receipt_summary ORDER BY month, category", conn)
+
+
+@perf.timed("db.get_dashboard_stats")
+def get_dashboard_stats():
+    """Headline numbers for the dashboard, read from receipt_summary plus one primary-key lookup."""
+    with db_session() as conn:
+        total, count = conn.execute("SELECT COALESCE(SUM(total), 0), COALESCE(SUM(count), 0) "
+                                    "FROM receipt_summary").fetchone()
+        biggest = conn.execute("""SELECT r.vendor, s.max_total FROM receipt_summary s
+                                  JOIN receipts r ON r.id = s.max_id
+                                  ORDER BY s.max_total DESC LIMIT 1""").fetchone()
+        top = conn.execute("""SELECT category FROM receipt_summary GROUP BY category
+                              ORDER BY SUM(count) DESC LIMIT 1""").fetchone()
+    return {"total": total, "count": count, "biggest_vendor": biggest[0] if biggest else None,
+            "biggest_total": biggest[1] if biggest else 0.0, "top_category": top[0] if top else None}
+
+
+@perf.timed("db.clear_receipts")
+def clear_receipts():
+    """Empties the local receipts table, e.g. before re-downloading a user's data on login."""
+    with db_session() as conn:
+        conn.execute("DELETE FROM receipts")
+        # Nothing is mirrored any more, so the next pull has to start from the beginning
+        conn.execute("DELETE FROM settings WHERE key LIKE 'sync_mark:%'")
+
+
+def get_sync_mark(owner):
+    """Highest cloud row id already pulled for this owner (0 if none)."""
+    with db_session() as conn:
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (f"sync_mark:{owner}",)).fetchone()
+    return int(row[0]) if row and row[0] is not None else 0
+
+
+@perf.timed("db.merge_cloud_rows")
+def merge_cloud_rows(owner, rows):
+    """Upserts cloud rows by cloud_id in one transaction and advances the owner's sync mark.
+
+    Rows are (cloud id, vendor, total, date, category, raw_text). The sheet only keeps the first 500
+    characters of raw_text, so a longer local copy that it is a prefix of is left alone.
+    """
+    if not rows:
+        return 0
+    # Dates in the sheet are as typed; store them in the form date_iso reads
+    rows = [(cloud_id, vendor, total, normalize_date(date), category, raw_text)
+            for cloud_id, vendor, total, date, category, raw_text in rows]
+    with db_session() as conn:
+        conn.executemany("""INSERT INTO receipts (cloud_id, vendor, total, date, category, raw_text)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(cloud_id) DO UPDATE SET
+                                vendor = excluded.vendor, total = excluded.total, date = excluded.date,
+                                category = excluded.category,
+                                raw_text = CASE
+                                    WHEN substr(receipts.raw_text, 1, length(excluded.raw_text)) = excluded.raw_text
+                                    THEN receipts.raw_text ELSE excluded.raw_text END""", rows)
+        high = max(row[0] for row in rows)
+        conn.execute("""INSERT INTO settings (key, value) VALUES (?, ?)
+                        ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)""",
+                     (f"sync_mark:{owner}", high))
+    return len(rows)
+
+
+@perf.timed("db.delete_receipt")
+def delete_receipt(receipt_id):
+    import outbox
+
+    try:
+        with db_session(immediate=True) as conn:
+            # Convert to int just in case
+            tid = int(receipt_id)
+            # Queued first, while the row can still tell the outbox its cloud id
+            outbox.enqueue("delete", "", tid)
+            before = _image_hash_version(conn)
+            c = conn.execute("DELETE FROM receipts WHERE id = ?", (tid,))
+            _patch_image_index(conn, before, [(tid, None, None)] if _image_hash_version(conn) != before else [])
+
+            # This tells us if SQLite actually found and deleted a row
+            if c.rowcount > 0:
+                print(f"✅ SQLite: Deleted row with ID {tid}")
+            else:
+                print(f"❓ SQLite: No row found with ID {tid}")
+    except Exception as e:
+        print(f"❌ SQLite Error: {e}")
+
+@perf.timed("db.update_receipt")
+def update_receipt(receipt_id, vendor, total, date, category):
+    """Updates an existing record in the local SQLite database and queues the same edit for the cloud."""
+    import outbox
+
+    date = normalize_date(date)
+    with db_session() as conn:
+        conn.execute("""UPDATE receipts 
+                        SET vendor = ?, total = ?, date = ?, category = ? 
+                        WHERE id = ?""",
+                     (vendor, total, date, category, receipt_id))
+        _mark_edited(conn, [(receipt_id, EDITABLE_COLUMNS)])
+        outbox.enqueue("update", "", int(receipt_id),
+                       {"vendor": vendor, "total": total, "date": date, "category": category})
+
+EDITABLE_COLUMNS = ['vendor', 'total', 'date', 'category']
+
+
+def _changed_cells(original, edited):
+    """Boolean frame (rows = ids in both frames, columns = EDITABLE_COLUMNS) of the cells that differ."""
+    before = original.dropna(subset=['id']).set_index(original['id'].dropna().astype(int))
+    after = edited.dropna(subset=['id']).set_index(edited['id'].dropna().astype(int))
+    ids = before.index.intersection(after.index)
+    before, after = before.loc[ids, EDITABLE_COLUMNS], after.loc[ids, EDITABLE_COLUMNS]
+
+    changed = pd.DataFrame(index=ids)
+    old_total = pd.to_numeric(before['total'], errors='coerce')
+    new_total = pd.to_numeric(after['total'], errors='coerce')
+    changed['total'] = ((old_total - new_total).abs() > 0.005) | (old_total.isna() != new_total.isna())
+    for col in ('vendor', 'date', 'category'):
+        changed[col] = before[col].fillna('').astype(str) != after[col].fillna('').astype(str)
+    return changed[EDITABLE_COLUMNS], after
+
+
+@perf.timed("db.update_receipts_bulk")
+def update_receipts_bulk(original, edited, learn=True):
+    """Saves the rows a user changed in the data editor.
+
+    `original` and `edited` are the frames before and after editing, matched on `id`. Only rows
+    with a changed cell are written (one executemany, one transaction), only their vendors are
+    re-learned, and only their changed fields are queued for the cloud. Returns the changed ids.
+    """
+    import outbox
+
+    changed, after = _changed_cells(original, edited)
+    rows = changed.any(axis=1)
+    if not rows.any():
+        return []
+    changed, after = changed[rows], after[rows]
+
+    params = [(r.vendor, None if pd.isna(r.total) else float(r.total), normalize_date(r.date), r.category, int(rid))
+              for rid, r in zip(after.index, after.itertuples(index=False))]
+    with db_session() as conn:
+        conn.executemany("""UPDATE receipts
+                            SET vendor = ?, total = ?, date = ?, category = ?
+                            WHERE id = ?""", params)
+        _mark_edited(conn, [(rid, [col for col, diff in zip(EDITABLE_COLUMNS, mask) if diff])
+                            for rid, mask in zip(after.index, changed.itertuples(index=False))])
+        if learn:
+            relearn = changed['vendor'] | changed['category']
+            update_vendor_map_many(zip(after.loc[relearn, 'vendor'], after.loc[relearn, 'category']))
+        for (vendor, total, date, category, rid), mask in zip(params, changed.itertuples(index=False)):
+            fields = dict(zip(EDITABLE_COLUMNS, (vendor, total, date, category)))
+            outbox.enqueue("update", "", rid, {col: fields[col] for col, diff in zip(EDITABLE_COLUMNS, mask) if diff})
+    return [p[-1] for p in params]
+
+
+@perf.timed("db.get_category_from_db")
+def get_category_from_db(vendor_name):
+    # Used during extraction, where OCR noise makes fuzzy matching worthwhile
+    return get_category_for_vendor(vendor_name)
+
+@perf.timed("db.save_budget")
 def save_budget(amount):
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    # Create a simple settings table if it doesn't exist
-    c.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value REAL)')
-    c.execute('INSERT OR REPLACE INTO settings (key, value) VALUES ("budget", ?)', (amount,))
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('budget', ?)", (amount,))
 
+@perf.timed("db.load_budget")
 def load_budget():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value REAL)')
-    c.execute('SELECT value FROM settings WHERE key = "budget"')
-    result = c.fetchone()
-    conn.close()
+    with db_session() as conn:
+        result = conn.execute("SELECT value FROM settings WHERE key = 'budget'").fetchone()
     return result[0] if result else 500.0  # Default to 500 if not set
 
+@perf.timed("db.save_currency")
 def save_currency(currency_code):
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    c.execute('INSERT OR REPLACE INTO settings (key, value_text) VALUES ("currency", ?)', (currency_code,))
-    conn.commit()
-    conn.close()
+    with db_session() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value_text) VALUES ('currency', ?)", (currency_code,))
 
+@perf.timed("db.load_currency")
 def load_currency():
-    conn = sqlite3.connect('expenses.db')
-    c = conn.cursor()
-    # (Note: SQLite ignores the above if the column already exists in some versions,
-    # but for safety, a try/except or manual DB check is better)
-    c.execute('SELECT value_text FROM settings WHERE key = "currency"')
-    result = c.fetchone()
-    conn.close()
+    with db_session() as conn:
+        result = conn.execute("SELECT value_text FROM settings WHERE key = 'currency'").fetchone()
     return result[0] if result and result[0] else "USD"
 
 def create_vendor_map_table():
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vendor_map (
-            vendor TEXT PRIMARY KEY,
-            category TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    # Kept for callers; the table is created with the rest of the schema in get_connection()
+    get_connection()
+
+_vendor_indexes = {}  # Database path -> (VendorIndex, vendor_map version it was loaded at)
+_vendor_index_lock = threading.Lock()
+
+
+def _vendor_map_version(conn):
+    return conn.execute("SELECT value FROM settings WHERE key = 'vendor_map_version'").fetchone()[0]
 
+
+def _get_vendor_index(conn):
+    """Returns the in-memory vendor index, reloading it only if vendor_map changed elsewhere."""
+    version = _vendor_map_version(conn)
+    index, loaded = _vendor_indexes.get(current_db(), (None, None))
+    if index is None or version != loaded:
+        with _vendor_index_lock:
+            rows = conn.execute("SELECT vendor, category FROM vendor_map").fetchall()
+            index = VendorIndex(rows)
+            _vendor_indexes[current_db()] = (index, version)
+    return index
+
+
+_image_indexes = {}  # Database path -> (ImageHashIndex, image_hash_version it was loaded at)
+_image_index_lock = threading.Lock()
+
+
+def _image_hash_version(conn):
+    return conn.execute("SELECT value FROM settings WHERE key = 'image_hash_version'").fetchone()[0]
+
+
+def _get_image_index(conn):
+    version = _image_hash_version(conn)
+    index, loaded = _image_indexes.get(current_db(), (None, None))
+    if index is None or version != loaded:
+        with _image_index_lock:
+            rows = conn.execute("SELECT id, image_hash FROM receipts WHERE image_hash IS NOT NULL").fetchall()
+            index = ImageHashIndex((receipt_id, from_signed(h)) for receipt_id, h in rows)
+            _image_indexes[current_db()] = (index, version)
+    return index
+
+
+def _patch_image_index(conn, before, changes):
+    """Applies this transaction's hash changes, (old id, new id, hash) each, to the cached index.
+
+    If anything else changed a hash since the cache was loaded, it is dropped and reloaded on next use.
+    """
+    after = _image_hash_version(conn)
+    index, loaded = _image_indexes.get(current_db(), (None, None))
+    if index is None:
+        return
+    if loaded == before and after == before + len(changes):
+        for old_id, new_id, h in changes:
+            if old_id is not None:
+                index.remove(old_id)
+            if new_id is not None:
+                index.add(new_id, h)
+        _image_indexes[current_db()] = (index, after)
+    else:
+        _image_indexes.pop(current_db(), None)
+
+
+@perf.timed("db.find_similar_image")
+def find_similar_image(image_hash):
+    """(receipt id, differing bits) of a stored receipt whose photo looks the same as `image_hash`, or None."""
+    with db_session() as conn:
+        return _get_image_index(conn).nearest(image_hash)
+
+
+@perf.timed("db.get_receipt")
+def get_receipt(receipt_id):
+    """One receipt's vendor, total, date and category as a dict, or None."""
+    with db_session() as conn:
+        row = conn.execute("SELECT id, vendor, total, date, category FROM receipts WHERE id = ?",
+                           (int(receipt_id),)).fetchone()
+    return dict(zip(("id", "vendor", "total", "date", "category"), row)) if row else None
+
+
+@perf.timed("db.update_vendor_map")
 def update_vendor_map(vendor, category):
-    if not vendor or vendor == "Unknown":
+    update_vendor_map_many([(vendor, category)])
+
+
+@perf.timed("db.update_vendor_map_many")
+def update_vendor_map_many(pairs):
+    """Learns many (vendor, category) pairs with one executemany; the last pair for a vendor wins."""
+    learned = {}
+    for vendor, category in pairs:
+        if not vendor or vendor == "Unknown":
+            continue
+        key = normalize_vendor(vendor)
+        if key:
+            learned[key] = (vendor, category)
+    if not learned:
         return
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO vendor_map (vendor, category)
-        VALUES (?, ?)
-    ''', (vendor, category))
-    conn.commit()
-    conn.close()
-
-def get_category_for_vendor(vendor):
+    with db_session(immediate=True) as conn:
+        before = _vendor_map_version(conn)
+        conn.executemany('''
+            INSERT OR REPLACE INTO vendor_map (vendor_key, vendor, category)
+            VALUES (?, ?, ?)
+        ''', [(key, vendor, category) for key, (vendor, category) in learned.items()])
+        after = _vendor_map_version(conn)
+
+        # Patch the cache in place if ours were the only writes since it was loaded, otherwise drop it
+        index, loaded = _vendor_indexes.get(current_db(), (None, None))
+        if index is not None and loaded == before and after == before + len(learned):
+            for vendor, category in learned.values():
+                index.set(vendor, category)
+            _vendor_indexes[current_db()] = (index, after)
+        else:
+            _vendor_indexes.pop(current_db(), None)
+
+@perf.timed("db.get_data_versions")
+def get_data_versions():
+    """Write counters for receipts, settings and vendor_map, e.g. {'receipts': 12, 'settings': 3, 'vendor_map': 7}.
+
+    Every write to a table bumps its counter, whoever makes it, so a cache keyed on them is
+    invalidated exactly when its table changes.
+    """
+    keys = [f"{table}_version" for table in VERSIONED_TABLES + ("vendor_map",)]
+    with db_session() as conn:
+        rows = conn.execute(f"SELECT key, value FROM settings WHERE key IN ({', '.join('?' * len(keys))})",
+                            keys).fetchall()
+    return {key[:-len("_version")]: int(value) for key, value in rows}
+
+
+def get_vendor_map_version():
+    with db_session() as conn:
+        return _vendor_map_version(conn)
+
+def get_learned_vendors():
+    with db_session() as conn:
+        return conn.execute("SELECT vendor, category FROM vendor_map").fetchall()
+
+@perf.timed("db.get_category_for_vendor")
+def get_category_for_vendor(vendor, fuzzy=True):
+    """Learned category for a vendor: exact (case-insensitive) match first, then trigram similarity."""
     if not vendor:
         return None
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT category FROM vendor_map WHERE vendor = ?', (vendor,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
\ No newline at end of file
+    with db_session() as conn:
+        return _get_vendor_index(conn).get(vendor, fuzzy)
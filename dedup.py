@@ -0,0 +1,121 @@
+import io
+import itertools
+import threading
+from PIL import Image, ImageOps
+
+HASH_SIZE = 8  # dHash compares neighbours in a 9x8 thumbnail -> 64 bits
+NEAR_DUPLICATE_DISTANCE = 6  # Photos whose hashes differ in at most this many bits count as the same receipt
+CHUNK_BITS = 16  # The index files each hash under its four 16-bit chunks
+_CHUNKS = 64 // CHUNK_BITS
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(image_bytes):
+    """64-bit difference hash of an image: one bit per horizontally adjacent pixel pair that gets brighter.
+
+    It survives re-encoding, resizing and small exposure changes, so the same photo uploaded
+    twice (or a screenshot of it) lands within a few bits of the original.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == "JPEG":
+        # Only a thumbnail is needed, so let the decoder skip most of the work
+        img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    img = ImageOps.exif_transpose(img).convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = list(img.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            i = row * (HASH_SIZE + 1) + col
+            bits = (bits << 1) | (pixels[i + 1] > pixels[i])
+    return bits
+
+
+def to_signed(h):
+    # SQLite integers are signed 64-bit
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def from_signed(h):
+    return h + (1 << 64) if h < 0 else h
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunks(h):
+    return [(h >> (CHUNK_BITS * i)) & _CHUNK_MASK for i in range(_CHUNKS)]
+
+
+_flip_masks = {}
+
+
+def _flips(radius):
+    # XOR masks reaching every chunk value within `radius` flipped bits, starting with 0 (the chunk itself)
+    if radius not in _flip_masks:
+        _flip_masks[radius] = [sum(1 << bit for bit in bits)
+                               for r in range(radius + 1) for bits in itertools.combinations(range(CHUNK_BITS), r)]
+    return _flip_masks[radius]
+
+
+class ImageHashIndex:
+    """Receipt id <-> dHash map with near-duplicate lookup by multi-index hashing.
+
+    Each hash is filed under its four 16-bit chunks. Two hashes at most `distance` bits apart
+    differ in at most distance // 4 bits on one of the chunks (pigeonhole), so a query only
+    probes the buckets of its chunks' close variants and checks those few candidates in full,
+    instead of comparing against every stored hash.
+    """
+
+    def __init__(self, rows=(), distance=NEAR_DUPLICATE_DISTANCE):
+        self.distance = distance
+        self._lock = threading.Lock()
+        self._hashes = {}  # receipt id -> hash
+        self._tables = [{} for _ in range(_CHUNKS)]  # per chunk: chunk value -> set of receipt ids
+        for receipt_id, h in rows:
+            self.add(receipt_id, h)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, receipt_id, h):
+        with self._lock:
+            self._discard(receipt_id)
+            self._hashes[receipt_id] = h
+            for table, chunk in zip(self._tables, _chunks(h)):
+                table.setdefault(chunk, set()).add(receipt_id)
+
+    def remove(self, receipt_id):
+        with self._lock:
+            self._discard(receipt_id)
+
+    def _discard(self, receipt_id):
+        h = self._hashes.pop(receipt_id, None)
+        if h is None:
+            return
+        for table, chunk in zip(self._tables, _chunks(h)):
+            ids = table.get(chunk)
+            if ids:
+                ids.discard(receipt_id)
+                if not ids:
+                    del table[chunk]
+
+    def nearest(self, h):
+        """Returns (receipt id, distance) of the closest stored hash within `distance` bits, or None."""
+        flips = _flips(self.distance // _CHUNKS)
+        hashes = self._hashes
+        best = None
+        seen = set()
+        for table, chunk in zip(self._tables, _chunks(h)):
+            for mask in flips:
+                ids = table.get(chunk ^ mask)
+                if not ids:
+                    continue
+                for receipt_id in ids - seen:
+                    d = (h ^ hashes[receipt_id]).bit_count()
+                    if d <= self.distance and (best is None or d < best[1]):
+                        best = (receipt_id, d)
+                        if d == 0:
+                            return best
+                seen |= ids
+        return best
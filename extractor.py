@@ -0,0 +1,223 @@
+import re
+from datetime import datetime, date
+from dateutil import parser
+
+import perf
+
+VENDOR_BLACKLIST = ("RECEIPT", "TAX INVOICE", "INVOICE", "WELCOME")
+
+_AMOUNT = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d{2})?|\d+[.,]\d{2}\b|\d+")
+_CENTS_AMOUNT = re.compile(r"\d{1,3}(?:,\d{3})+\.\d{2}|\d+[.,]\d{2}\b")
+_TAX_LABEL = re.compile(r"\b(?:tax|vat|gst|hst)\b")
+_SUBTOTAL_LABEL = re.compile(r"sub[ \t-]?total")
+_PAID_LABEL = re.compile(r"total[ \t]+paid")
+_DATE_LABEL = re.compile(r"\bdate\b")
+_ISO_DATE = re.compile(r"\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b")
+_NUMERIC_DATE = re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b")
+_CURRENCY = re.compile(r"[£€$]|\b(?:usd|eur|gbp|ron|cad|lei)\b")
+
+_MONTHS = {m: i for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+_MONTH_NAME = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_DAY_MONTH_YEAR = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?[ \t]+" + _MONTH_NAME + r",?[ \t]+(\d{2,4})\b", re.I)
+_MONTH_DAY_YEAR = re.compile(r"\b" + _MONTH_NAME + r"[ \t]+(\d{1,2})(?:st|nd|rd|th)?[,/ \t]+(\d{2,4})\b", re.I)
+_DATE_KEYWORD_VALUE = re.compile(r"date[:\s]+([A-Za-z0-9/\s,.-]+)", re.I)
+
+_CURRENCY_CODES = {"£": "GBP", "€": "EUR", "$": "USD", "lei": "RON"}
+_DECIMAL_COMMA = re.compile(r"\d+,\d{2}")
+_DATE_SEPARATOR = re.compile(r"[/.-]")
+
+
+def _full_year(year):
+    """Two-digit years land within 50 years of today, the same rule dateutil uses."""
+    if year >= 100:
+        return year
+    this_year = datetime.now().year
+    year += this_year // 100 * 100
+    if year > this_year + 49:
+        year -= 100
+    elif year <= this_year - 50:
+        year += 100
+    return year
+
+
+def _make_date(year, month, day):
+    try:
+        return date(_full_year(year), month, day)
+    except ValueError:
+        return None
+
+
+def parse_numeric_date(token):
+    """DD/MM/YYYY-style token, read day-first like normalize_date and everything the app displays.
+
+    Only a token that can't be day-first (04/25/2025) falls back to month-first.
+    """
+    a, b, year = (int(part) for part in _DATE_SEPARATOR.split(token))
+    if b > 12 >= a:
+        return _make_date(year, a, b)
+    return _make_date(year, b, a)
+
+
+def parse_iso_date(token):
+    year, month, day = (int(part) for part in _DATE_SEPARATOR.split(token))
+    return _make_date(year, month, day)
+
+
+def parse_text_date(text):
+    """Dates with a month name: '9 April 2025', 'April 9/2025', 'Apr 9th, 25'."""
+    m = _DAY_MONTH_YEAR.search(text)
+    if m:
+        return _make_date(int(m.group(3)), _MONTHS[m.group(2)[:3].lower()], int(m.group(1)))
+    m = _MONTH_DAY_YEAR.search(text)
+    if m:
+        return _make_date(int(m.group(3)), _MONTHS[m.group(1)[:3].lower()], int(m.group(2)))
+    return None
+
+
+_DAY_FIRST_DATE = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})")
+
+
+def format_date(value):
+    """DD/MM/YY, the stored form. Years outside 2000-2099 keep all four digits, so the database's
+    date_iso column (which reads YY as 20YY) never has to guess the century."""
+    return value.strftime("%d/%m/%y" if 2000 <= value.year <= 2099 else "%d/%m/%Y")
+
+
+def normalize_date(text):
+    """A typed or stored date as DD/MM/YY, read day-first like everything the app displays.
+
+    Text that isn't a recognizable date is returned unchanged.
+    """
+    token = str(text or "").strip()
+    if _DAY_FIRST_DATE.fullmatch(token):
+        parsed = parse_numeric_date(token)
+    elif _ISO_DATE.fullmatch(token):
+        parsed = parse_iso_date(token)
+    else:
+        parsed = parse_text_date(token)
+    return format_date(parsed) if parsed else text
+
+
+def parse_amount(token):
+    """'3,442.77' -> 3442.77 and European '12,50' -> 12.5."""
+    if _DECIMAL_COMMA.fullmatch(token):
+        return float(token.replace(',', '.'))
+    try:
+        return float(token.replace(',', ''))
+    except ValueError:
+        return None
+
+
+def _first_amount(line, start=0):
+    """First amount on a line after `start`, preferring one with decimals over a bare integer."""
+    m = _CENTS_AMOUNT.search(line, start) or _AMOUNT.search(line, start)
+    return parse_amount(m.group()) if m else None
+
+
+def _numeric_date(line):
+    m = _ISO_DATE.search(line)
+    if m:
+        parsed = parse_iso_date(m.group())
+        if parsed:
+            return parsed
+    for m in _NUMERIC_DATE.finditer(line):
+        parsed = parse_numeric_date(m.group())
+        if parsed:
+            return parsed
+    return None
+
+
+@perf.timed("extract.vendor")
+def extract_vendor(lines):
+    for line in lines:
+        clean_line = line.strip()
+        # Skip empty lines or generic titles
+        if clean_line and not any(word in clean_line.upper() for word in VENDOR_BLACKLIST):
+            return clean_line
+    return "Unknown Vendor"
+
+
+def _date_from_label(text, lines, i):
+    """Date on the line labelled "Date" or the one below it, dateutil only as a last resort."""
+    for j in (i, i + 1):
+        if j < len(lines):
+            parsed = _numeric_date(lines[j]) or parse_text_date(lines[j])
+            if parsed:
+                return parsed
+    m = _DATE_KEYWORD_VALUE.search(text)
+    if m:
+        try:
+            return parser.parse(m.group(1).split('\n')[0].strip(), fuzzy=True).date()
+        except (ValueError, OverflowError):
+            pass
+    return None
+
+
+@perf.timed("extract.fields")
+def extract_fields(text, date_fallback=True):
+    """Collects vendor, date, total, subtotal, tax and currency from OCR text in one sweep.
+
+    Each line is visited once with cheap substring checks; the precompiled patterns only run
+    on lines that carry a label. The date is formatted DD/MM/YY (today if none is found, or
+    None with date_fallback=False) and amounts are floats.
+    """
+    lines = text.split('\n')
+    low_lines = text.lower().split('\n')
+    paid = total = subtotal = tax = currency = None
+    labelled_date = numeric_date = None
+    date_line = None
+
+    for i, (line, low) in enumerate(zip(lines, low_lines)):
+
+        if "total" in low:
+            m = _PAID_LABEL.search(low)
+            if m and paid is None:
+                paid = _first_amount(line, m.end())
+                if paid is None and i + 1 < len(lines):
+                    paid = _first_amount(lines[i + 1])
+            elif _SUBTOTAL_LABEL.search(low):
+                if subtotal is None:
+                    subtotal = _first_amount(line, _SUBTOTAL_LABEL.search(low).end())
+            elif total is None:
+                total = _first_amount(line, low.index("total") + 5)
+                if total is None and i + 1 < len(lines):
+                    total = _first_amount(lines[i + 1])
+
+        if tax is None and ("tax" in low or "vat" in low or "gst" in low or "hst" in low):
+            m = _TAX_LABEL.search(low)
+            if m:
+                tax = _first_amount(line, m.end())
+
+        if date_line is None and "date" in low and _DATE_LABEL.search(low):
+            date_line = i
+
+        if currency is None:
+            m = _CURRENCY.search(low)
+            if m:
+                currency = _CURRENCY_CODES.get(m.group(), m.group().upper())
+
+    with perf.stage("extract.date"):
+        if date_line is not None:
+            labelled_date = _date_from_label(text, lines, date_line)
+        if labelled_date is None:
+            numeric_date = next(filter(None, map(_numeric_date, lines)), None)
+
+    # Ranking: "Total Paid" beats a plain "Total", which beats the largest amount on the page
+    final_total = paid if paid is not None else total
+    if final_total is None:
+        amounts = [parse_amount(a) for a in _CENTS_AMOUNT.findall(text)]
+        final_total = max(amounts) if amounts else 0.0
+
+    receipt_date = labelled_date or numeric_date
+    if receipt_date is None and date_fallback:
+        receipt_date = datetime.now().date()
+
+    return {
+        "vendor": extract_vendor(lines),
+        "date": format_date(receipt_date) if receipt_date else None,
+        "total": final_total,
+        "subtotal": subtotal,
+        "tax": tax,
+        "currency": currency,
+    }
@@ -0,0 +1,103 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from database import current_db, db_session
+
+# Bump this whenever the OCR engine or its config changes so old text is not reused
+OCR_CACHE_VERSION = "tesseract-default-v1"
+
+MAX_CACHE_BYTES = 50 * 1024 * 1024  # Total raw text kept on disk
+MAX_CACHE_AGE = 90 * 24 * 3600  # Entries unused for 90 days are dropped
+MEMORY_CACHE_SIZE = 64  # Entries kept in the in-process LRU
+TOUCH_BATCH = 32  # Memory hits whose last_used is held back before it's written to disk
+
+_memory_cache = OrderedDict()  # key -> (text, last_used)
+_touched = {}  # db path -> {key: last_used} not written yet
+
+
+def make_key(image_bytes, version=OCR_CACHE_VERSION):
+    """Content address for an image: hash of its bytes plus the OCR engine/config version."""
+    h = hashlib.sha256(image_bytes)
+    h.update(version.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _remember(key, text, now):
+    _memory_cache[key] = (text, now)
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def _flush_touches(conn):
+    touched = _touched.pop(current_db(), None)
+    if touched:
+        conn.executemany("UPDATE ocr_cache SET last_used = MAX(last_used, ?) WHERE key = ?",
+                         [(ts, key) for key, ts in touched.items()])
+
+
+def get_cached_text(key):
+    """Returns the cached OCR text for a key, or None on a miss."""
+    now = time.time()
+    entry = _memory_cache.get(key)
+    if entry is not None:
+        if now - entry[1] <= MAX_CACHE_AGE:
+            _memory_cache[key] = (entry[0], now)
+            _memory_cache.move_to_end(key)
+            touched = _touched.setdefault(current_db(), {})
+            touched[key] = now
+            if len(touched) >= TOUCH_BATCH:
+                with db_session() as conn:
+                    _flush_touches(conn)
+            return entry[0]
+        del _memory_cache[key]  # Expired; the disk copy gets the same check below
+
+    with db_session() as conn:
+        _flush_touches(conn)
+        row = conn.execute("SELECT text, last_used FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > MAX_CACHE_AGE:
+            conn.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (now, key))
+
+    _remember(key, row[0], now)
+    return row[0]
+
+
+def put_cached_text(key, text):
+    now = time.time()
+    _remember(key, text, now)
+
+    with db_session() as conn:
+        _flush_touches(conn)
+        conn.execute("INSERT OR REPLACE INTO ocr_cache (key, text, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                     (key, text, len(text.encode("utf-8")), now, now))
+        _evict(conn, now)
+
+
+def _evict(conn, now):
+    # Age first, then trim the least recently used rows until we fit the size budget
+    conn.execute("DELETE FROM ocr_cache WHERE last_used < ?", (now - MAX_CACHE_AGE,))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+    if total <= MAX_CACHE_BYTES:
+        return
+    rows = conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_used").fetchall()
+    stale = []
+    for key, size in rows:
+        if total <= MAX_CACHE_BYTES:
+            break
+        stale.append((key,))
+        total -= size
+    conn.executemany("DELETE FROM ocr_cache WHERE key = ?", stale)
+    for (key,) in stale:
+        _memory_cache.pop(key, None)
+
+
+def clear_cache():
+    _memory_cache.clear()
+    _touched.pop(current_db(), None)
+    with db_session() as conn:
+        conn.execute("DELETE FROM ocr_cache")
@@ -0,0 +1,241 @@
+import itertools
+import json
+import random
+import threading
+import time
+
+import database
+import perf
+from database import db_session
+
+FLUSH_BATCH = 200  # Queued rows sent per API call
+POLL_INTERVAL = 1.0  # First wait when nothing wakes the flusher; doubles while the queue stays empty
+IDLE_MAX = 60.0  # Longest wait between checks of an empty queue (catches rows other processes queue)
+IDLE_EXIT = 300.0  # An empty, unwoken flusher's thread ends after this long; the next notify() restarts it
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0  # Never wait more than 5 minutes between retries
+
+def enqueue(op, owner, receipt_id, payload=None):
+    """Adds a cloud write ("append", "update" or "delete") to the outbox.
+
+    Inside a db_session it commits with the caller's own writes. An edit or delete of a receipt
+    whose append hasn't been sent yet is folded into that append instead of queued. Otherwise the
+    entry names the sheet row by the receipt's cloud id; if its append is still in flight, that id
+    is filled in when the append lands. `owner` defaults to the thread's (database.use_owner).
+    The flusher is woken once the entry is committed.
+    """
+    owner = str(owner or database.current_owner() or "").strip().lower()
+    cloud_id = None
+    with db_session() as conn:
+        if op in ("update", "delete") and receipt_id is not None:
+            pending = conn.execute("""SELECT seq, payload FROM cloud_outbox
+                                      WHERE op = 'append' AND receipt_id = ? AND cloud_id IS NULL AND sending = 0""",
+                                   (receipt_id,)).fetchone()
+            if pending:
+                if op == "delete":
+                    conn.execute("DELETE FROM cloud_outbox WHERE receipt_id = ?", (receipt_id,))
+                else:
+                    merged = {**json.loads(pending[1] or "{}"), **(payload or {})}
+                    conn.execute("UPDATE cloud_outbox SET payload = ? WHERE seq = ?", (json.dumps(merged, default=str), pending[0]))
+                return
+            row = conn.execute("SELECT cloud_id FROM receipts WHERE id = ?", (receipt_id,)).fetchone()
+            cloud_id = row[0] if row else None
+        conn.execute("""INSERT INTO cloud_outbox (op, owner, receipt_id, cloud_id, payload, created)
+                        VALUES (?, ?, ?, ?, ?, ?)""",
+                     (op, owner, receipt_id, cloud_id, json.dumps(payload or {}, default=str), time.time()))
+        database.on_commit(get_flusher().notify)
+
+
+def enqueue_many(op, owner, items):
+    """items are (receipt_id, payload) pairs, written with one executemany."""
+    now = time.time()
+    owner = str(owner).strip().lower()
+    with db_session() as conn:
+        conn.executemany("""INSERT INTO cloud_outbox (op, owner, receipt_id, payload, created)
+                            VALUES (?, ?, ?, ?, ?)""",
+                         [(op, owner, receipt_id, json.dumps(payload or {}, default=str), now) for receipt_id, payload in items])
+        database.on_commit(get_flusher().notify)
+
+
+def head(limit=FLUSH_BATCH, now=None):
+    """The oldest queued entries, or [] while the queue is backing off.
+
+    Entries go out strictly in order, so a failing batch holds back everything behind it.
+    """
+    now = time.time() if now is None else now
+    with db_session() as conn:
+        rows = conn.execute("""SELECT seq, op, owner, receipt_id, cloud_id, payload, attempts, next_attempt
+                               FROM cloud_outbox ORDER BY seq LIMIT ?""", (limit,)).fetchall()
+    if not rows or rows[0][7] > now:
+        return []
+    return [{"seq": seq, "op": op, "owner": owner, "receipt_id": receipt_id, "cloud_id": cloud_id,
+             "payload": json.loads(payload or "{}"), "attempts": attempts}
+            for seq, op, owner, receipt_id, cloud_id, payload, attempts, _ in rows]
+
+
+def seconds_until_due(now=None):
+    """How long until the oldest entry may be sent (0 if it may now), or None when the queue is empty."""
+    now = time.time() if now is None else now
+    with db_session() as conn:
+        row = conn.execute("SELECT next_attempt FROM cloud_outbox ORDER BY seq LIMIT 1").fetchone()
+    return None if row is None else max(0.0, row[0] - now)
+
+
+@perf.timed("db.pending_count")
+def pending_count():
+    with db_session() as conn:
+        return conn.execute("SELECT COUNT(*) FROM cloud_outbox").fetchone()[0]
+
+
+def backoff_delay(attempts):
+    # Exponential with jitter, so a quota error doesn't get hammered in lockstep
+    return min(BACKOFF_MAX, BACKOFF_BASE ** attempts) * random.uniform(0.5, 1.0)
+
+
+def _record_ids(conn, ids):
+    conn.executemany("UPDATE cloud_outbox SET cloud_id = ? WHERE seq = ?",
+                     [(cloud_id, seq) for seq, cloud_id in ids.items()])
+
+
+def _done(conn, entries, ids=None):
+    conn.executemany("DELETE FROM cloud_outbox WHERE seq = ?", [(e["seq"],) for e in entries])
+    for e in entries:
+        if ids and e["receipt_id"] is not None:
+            database.set_cloud_id(e["receipt_id"], ids[e["seq"]])
+            # Edits and deletes queued while the append was in flight now know which row to change
+            conn.execute("UPDATE cloud_outbox SET cloud_id = ? WHERE receipt_id = ? AND op != 'append' AND cloud_id IS NULL",
+                         (ids[e["seq"]], e["receipt_id"]))
+
+
+def _failed(conn, entries, error):
+    attempts = max(e["attempts"] for e in entries) + 1
+    conn.executemany("UPDATE cloud_outbox SET attempts = ?, next_attempt = ?, last_error = ?, sending = 0 WHERE seq = ?",
+                     [(attempts, time.time() + backoff_delay(attempts), str(error)[:500], e["seq"])
+                      for e in entries])
+
+
+class OutboxFlusher:
+    """Background thread that drains one database's cloud_outbox into the sheet in batches."""
+
+    def __init__(self, worksheet=None, batch_size=FLUSH_BATCH, poll_interval=POLL_INTERVAL, db_name=None):
+        self.db_name = db_name or database.current_db()
+        self._worksheet = worksheet
+        self._writer = None
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()  # Guards starting the thread against it deciding to exit
+        self._thread = None
+
+    def _get_writer(self):
+        if self._writer is None:
+            from sync_manager import CloudWriter, get_worksheet
+            self._writer = CloudWriter(self._worksheet or get_worksheet())
+        return self._writer
+
+    def flush_once(self):
+        """Sends one batch. Returns how many entries were written, 0 if there was nothing due."""
+        with self._lock:
+            with db_session(immediate=True) as conn:
+                entries = head(self.batch_size)
+                if not entries:
+                    return 0
+                # Consecutive appends go out together, as do consecutive edits and deletes
+                appending = entries[0]["op"] == "append"
+                entries = list(itertools.takewhile(lambda e: (e["op"] == "append") == appending, entries))
+                # Claimed before anything touches the network: later edits queue behind them instead of folding in
+                conn.executemany("UPDATE cloud_outbox SET sending = 1 WHERE seq = ?", [(e["seq"],) for e in entries])
+            ids = None
+            try:
+                writer = self._get_writer()
+                if appending:
+                    ids = writer.assign_ids(entries)
+                    with db_session() as conn:
+                        _record_ids(conn, ids)
+                    writer.append(entries, ids)
+                else:
+                    writer.mutate(entries)
+            except Exception as e:
+                with db_session() as conn:
+                    _failed(conn, entries, e)
+                print(f"❌ Cloud sync failed, {len(entries)} rows will be retried: {e}")
+                if self._worksheet is None and "auth" in str(e).lower():
+                    from sync_manager import reset_worksheet
+                    reset_worksheet()
+                    self._writer = None
+                return 0
+            with db_session() as conn:
+                _done(conn, entries, ids)
+            return len(entries)
+
+    def drain(self, timeout=30.0):
+        """Flushes until the queue is empty, it starts backing off, or `timeout` runs out."""
+        deadline = time.monotonic() + timeout
+        sent = 0
+        while time.monotonic() < deadline:
+            n = self.flush_once()
+            if not n:
+                break
+            sent += n
+        return sent
+
+    def notify(self):
+        self._wake.set()
+        self.start()
+
+    def start(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="cloud-outbox", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Ends the thread, e.g. when its owner logs out. Queued entries stay queued for the next start()."""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        database.use_database(self.db_name)
+        idle = self.poll_interval
+        idle_since = time.monotonic()
+        while not self._stop.is_set():
+            due = None
+            try:
+                while self.flush_once():
+                    idle_since = time.monotonic()
+                due = seconds_until_due()
+            except Exception as e:
+                print(f"❌ Outbox flusher error: {e}")
+            if due is None and time.monotonic() - idle_since >= IDLE_EXIT:
+                with self._thread_lock:
+                    if not self._wake.is_set():
+                        self._thread = None
+                        break
+            # A queued entry waits out its retry backoff; an empty queue is checked less and less often,
+            # since enqueue() wakes the thread itself
+            woken = self._wake.wait(idle if due is None else max(due, 0.05))
+            self._wake.clear()
+            if woken or due is not None:
+                idle, idle_since = self.poll_interval, time.monotonic()
+            else:
+                idle = min(idle * 2, IDLE_MAX)
+        database.close_connection()
+
+
+_flushers = {}  # Database path -> its flusher
+_flusher_lock = threading.Lock()
+
+
+def get_flusher():
+    """The flusher for this thread's database (see database.use_owner); its thread starts on the first notify()."""
+    db_name = database.current_db()
+    with _flusher_lock:
+        if db_name not in _flushers:
+            _flushers[db_name] = OutboxFlusher(db_name=db_name)
+        return _flushers[db_name]
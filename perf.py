@@ -0,0 +1,151 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# Off unless RECEIPT_PERF=1: a disabled stage() is a shared no-op context and a disabled
+# @timed function costs one flag check, so the hooks can stay in the hot paths
+ENABLED = os.environ.get("RECEIPT_PERF", "0") != "0"
+LOG_PATH = os.environ.get("RECEIPT_PERF_LOG", "perf.jsonl")  # JSON lines, one per timed call; "" for none
+MAX_SAMPLES = 2048  # Durations kept per stage for the percentiles; counts and totals cover every call
+
+_NULL_STAGE = nullcontext()
+_local = threading.local()
+_log_lock = threading.Lock()
+_log_file = None
+
+
+class Recorder:
+    """Call count, total time and the most recent durations of each stage."""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> [count, total seconds, deque of recent durations]
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = [0, 0.0, deque(maxlen=self.max_samples)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def summary(self):
+        """One row per stage, slowest p95 first: count, p50/p95/max and total in milliseconds."""
+        with self._lock:
+            stages = {stage: (count, total, sorted(samples)) for stage, (count, total, samples) in self._stages.items()}
+        rows = [{"stage": stage, "count": count, "p50_ms": _percentile(samples, 50) * 1000,
+                 "p95_ms": _percentile(samples, 95) * 1000, "max_ms": samples[-1] * 1000, "total_ms": total * 1000}
+                for stage, (count, total, samples) in stages.items()]
+        return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
+
+
+def _percentile(ordered, pct):
+    # Nearest rank
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+process_recorder = Recorder()  # Everything timed in this process, whichever thread or session
+
+
+def enable(flag=True, log_path=None):
+    global ENABLED, LOG_PATH, _log_file
+    ENABLED = flag
+    if log_path is not None and log_path != LOG_PATH:
+        with _log_lock:
+            if _log_file is not None:
+                _log_file.close()
+                _log_file = None
+            LOG_PATH = log_path
+
+
+def use_recorder(recorder):
+    """Also sends this thread's timings to `recorder`, e.g. one kept in a Streamlit session."""
+    _local.recorder = recorder
+
+
+def _log(stage, start, seconds):
+    global _log_file
+    line = json.dumps({"ts": round(start, 6), "stage": stage, "ms": round(seconds * 1000, 3),
+                       "pid": os.getpid(), "thread": threading.current_thread().name})
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(LOG_PATH, "a", buffering=1, encoding="utf-8")
+        _log_file.write(line + "\n")
+
+
+def record(stage, seconds, start=None):
+    """Adds one measured duration, e.g. a step timed elsewhere, to the recorders and the log."""
+    if not ENABLED:
+        return
+    process_recorder.add(stage, seconds)
+    session = getattr(_local, "recorder", None)
+    if session is not None:
+        session.add(stage, seconds)
+    if LOG_PATH:
+        _log(stage, time.time() - seconds if start is None else start, seconds)
+
+
+@contextmanager
+def _timed_block(stage):
+    wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, wall)
+
+
+def stage(name):
+    """`with perf.stage("ocr"):` times the block when enabled."""
+    return _timed_block(name) if ENABLED else _NULL_STAGE
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _timed_block(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_log(path=None):
+    """A Recorder filled from a JSON-lines log, e.g. one written by batch_ingest's worker processes."""
+    recorder = Recorder(max_samples=None)
+    with open(path or LOG_PATH, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recorder.add(entry["stage"], entry["ms"] / 1000)
+    return recorder
+
+
+def main(argv=None):
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Per-stage p50/p95 from a timing log.")
+    arg_parser.add_argument("log", nargs="?", default=LOG_PATH)
+    args = arg_parser.parse_args(argv)
+
+    print(f"{'stage':<28}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total s':>10}")
+    for row in load_log(args.log).summary():
+        print(f"{row['stage']:<28}{row['count']:>8}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+              f"{row['max_ms']:>10.2f}{row['total_ms'] / 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
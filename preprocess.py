@@ -0,0 +1,198 @@
+import io
+import time
+
+from PIL import Image, ImageOps
+
+# 80mm receipt paper scanned at ~300 DPI is roughly 1000px wide, which is where Tesseract reads best
+TARGET_WIDTH = 1000
+MIN_SCALE = 0.75  # Images within [0.75x, 1.6x] of the target width are left alone
+MAX_SCALE = 1.6
+DESKEW_MAX_ANGLE = 5
+DESKEW_STEP = 1
+CROP_PADDING = 10
+
+# Every step can be switched off individually, e.g. preprocess_image(data, {"binarize": False})
+DEFAULT_STEPS = {
+    "draft": True,
+    "grayscale": True,
+    "normalize": True,
+    "deskew": True,
+    "binarize": True,
+    "crop": True,
+}
+STEP_ALIASES = {"otsu": "binarize", "gray": "grayscale"}
+
+
+def parse_steps(spec):
+    """Reads a RECEIPT_PREPROCESS value: "1" for every step, "0" for none, or a list like "deskew,otsu".
+
+    A list switches on only the steps named (deskew and binarize bring grayscale with them,
+    since they work on gray images); everything else is off.
+    """
+    spec = (spec or "").strip().lower()
+    if spec in ("", "1", "on", "all"):
+        return dict(DEFAULT_STEPS)
+    if spec in ("0", "off", "none"):
+        return dict.fromkeys(DEFAULT_STEPS, False)
+    names = {STEP_ALIASES.get(name.strip(), name.strip()) for name in spec.split(",") if name.strip()}
+    unknown = names - DEFAULT_STEPS.keys()
+    if unknown:
+        raise ValueError(f"Unknown preprocessing step(s) {', '.join(sorted(unknown))}; "
+                         f"pick from {', '.join(DEFAULT_STEPS)} (or otsu)")
+    if names & {"deskew", "binarize"}:
+        names.add("grayscale")
+    return {name: name in names for name in DEFAULT_STEPS}
+
+
+def steps_signature(steps=None):
+    """Short string describing the active steps, used in the OCR cache key."""
+    steps = {**DEFAULT_STEPS, **(steps or {})}
+    active = ",".join(name for name, enabled in steps.items() if enabled)
+    return f"pre:{TARGET_WIDTH}:{active}"
+
+
+def otsu_threshold(gray):
+    """Classic Otsu threshold computed from the histogram of an 'L' image."""
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = 0
+    weight_bg = 0
+    best_var = 0
+    threshold = 127
+    for i, h in enumerate(hist):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best_var:
+            best_var = between
+            threshold = i
+    return threshold
+
+
+def _binary(gray, threshold):
+    return gray.point(lambda p: 255 if p > threshold else 0)
+
+
+def decode(image_bytes, use_draft=True):
+    """Opens an image, letting the JPEG decoder downscale huge photos while decoding."""
+    img = Image.open(io.BytesIO(image_bytes))
+    if use_draft and img.format == "JPEG" and img.width > TARGET_WIDTH * 2:
+        # Draft picks the smallest DCT scale (1/2, 1/4, 1/8) that is still >= the requested size
+        img.draft("RGB", (TARGET_WIDTH, int(img.height * TARGET_WIDTH / img.width)))
+    img.load()
+    img = ImageOps.exif_transpose(img)
+    if img.width > TARGET_WIDTH * 4:
+        # Non-JPEG giants: integer box reduce is much cheaper than a full resample
+        img = img.reduce(img.width // (TARGET_WIDTH * 2))
+    return img
+
+
+def normalize_resolution(img):
+    scale = TARGET_WIDTH / img.width
+    if MIN_SCALE <= scale <= MAX_SCALE:
+        return img
+    size = (TARGET_WIDTH, max(1, int(img.height * scale)))
+    return img.resize(size, Image.LANCZOS if scale < 1 else Image.BICUBIC)
+
+
+def estimate_skew(gray):
+    """Finds the rotation that makes text rows line up, using a row projection profile.
+
+    Works on a small thumbnail so the search over angles stays in the low milliseconds.
+    """
+    thumb = gray.copy()
+    thumb.thumbnail((400, 400))
+    ink = ImageOps.invert(_binary(thumb, otsu_threshold(thumb)))
+
+    best_angle = 0
+    best_score = -1.0
+    angle = -DESKEW_MAX_ANGLE
+    while angle <= DESKEW_MAX_ANGLE:
+        rotated = ink.rotate(angle, resample=Image.NEAREST, fillcolor=0)
+        # Collapsing to one column gives the mean ink per row; sharp peaks mean aligned text
+        rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+        mean = sum(rows) / len(rows)
+        score = sum((r - mean) ** 2 for r in rows)
+        if score > best_score:
+            best_score = score
+            best_angle = angle
+        angle += DESKEW_STEP
+    return best_angle
+
+
+def deskew(gray):
+    angle = estimate_skew(gray)
+    if angle == 0:
+        return gray
+    return gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+def crop_margins(img, threshold=None):
+    """Crops to the paper, then to the printed area, leaving a little padding."""
+    gray = img if img.mode == "L" else img.convert("L")
+    if threshold is None:
+        threshold = otsu_threshold(gray)
+    paper = _binary(gray, threshold)
+
+    # Find the receipt on a block-averaged mask so stray bright pixels in the background are ignored
+    factor = 8
+    blocks = paper.resize((max(1, paper.width // factor), max(1, paper.height // factor)), Image.BOX)
+    box = blocks.point(lambda p: 255 if p > 160 else 0).getbbox()
+    if not box:
+        return img
+    box = (box[0] * factor, box[1] * factor, min(img.width, box[2] * factor), min(img.height, box[3] * factor))
+
+    ink = ImageOps.invert(paper.crop(box)).getbbox()  # Dark pixels: the printed text
+    if ink:
+        box = (max(0, box[0] + ink[0] - CROP_PADDING), max(0, box[1] + ink[1] - CROP_PADDING),
+               min(img.width, box[0] + ink[2] + CROP_PADDING), min(img.height, box[1] + ink[3] + CROP_PADDING))
+    return img.crop(box)
+
+
+def preprocess_image(image_bytes, steps=None):
+    """Decodes and cleans up a receipt image for OCR.
+
+    Returns the processed PIL image and a dict of per-step timings in seconds.
+    """
+    steps = {**DEFAULT_STEPS, **(steps or {})}
+    timings = {}
+
+    start = time.perf_counter()
+    img = decode(image_bytes, steps["draft"])
+    timings["decode"] = time.perf_counter() - start
+
+    if steps["grayscale"]:
+        start = time.perf_counter()
+        img = img.convert("L")
+        timings["grayscale"] = time.perf_counter() - start
+
+    if steps["crop"]:
+        # Crop before scaling so the receipt itself, not the table around it, is normalized
+        start = time.perf_counter()
+        img = crop_margins(img)
+        timings["crop"] = time.perf_counter() - start
+
+    if steps["normalize"]:
+        start = time.perf_counter()
+        img = normalize_resolution(img)
+        timings["normalize"] = time.perf_counter() - start
+
+    if steps["deskew"] and img.mode == "L":
+        start = time.perf_counter()
+        img = deskew(img)
+        timings["deskew"] = time.perf_counter() - start
+
+    if steps["binarize"] and img.mode == "L":
+        start = time.perf_counter()
+        img = _binary(img, otsu_threshold(img))
+        timings["binarize"] = time.perf_counter() - start
+
+    return img, timings
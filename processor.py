@@ -1,121 +1,314 @@
+import io
+import json
 import re
 import shutil
 import os
-from datetime import datetime
-from dateutil import parser
-import pytesseract
+import threading
+import extractor
+import perf
 from PIL import Image
-from database import get_category_from_db
+from database import current_db, get_category_from_db, get_vendor_map_version, get_learned_vendors
+from categorizer import get_categorizer
+from preprocess import parse_steps, preprocess_image, steps_signature
+from ocr_cache import OCR_CACHE_VERSION, make_key, get_cached_text, put_cached_text
 
-tesseract_path = shutil.which("tesseract")
+_pytesseract_module = None
 
-if tesseract_path:
-    # If the system finds 'tesseract' in the PATH (like on Linux Cloud)
-    pytesseract.pytesseract.tesseract_cmd = tesseract_path
-else:
-    # Fallback for your local Windows path - update this to your actual path
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
+def _pytesseract():
+    # Loaded on the first OCR call, so a rerun that reads no image never imports it
+    global _pytesseract_module
+    if _pytesseract_module is None:
+        import pytesseract
 
+        tesseract_path = shutil.which("tesseract")
+        if tesseract_path:
+            # If the system finds 'tesseract' in the PATH (like on Linux Cloud)
+            pytesseract.pytesseract.tesseract_cmd = tesseract_path
+        else:
+            # Fallback for your local Windows path - update this to your actual path
+            pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+        _pytesseract_module = pytesseract
+    return _pytesseract_module
+
+# Which OCR backend to use: "pytesseract" (default) or "tesserocr" (warm in-process API)
+OCR_BACKEND = os.environ.get("RECEIPT_OCR_BACKEND", "pytesseract")
+# Set RECEIPT_PREPROCESS=0 to hand Tesseract the untouched image, or name the steps to run,
+# e.g. RECEIPT_PREPROCESS=draft,crop,otsu (see preprocess.DEFAULT_STEPS)
+PREPROCESS_STEPS = parse_steps(os.environ.get("RECEIPT_PREPROCESS", "1"))
+PREPROCESS_ENABLED = any(PREPROCESS_STEPS.values())
+# "full" OCRs the whole page once; "fast" does a low-res pass and re-scans only weak key regions
+OCR_MODE = os.environ.get("RECEIPT_OCR_MODE", "full")
+
+FAST_SCALE = 0.5  # Resolution of the cheap first pass
+RESCAN_CONFIDENCE = 80  # Regions scoring below this (0-100) are re-read at full resolution
+REVIEW_CONFIDENCE = 60  # Fields below this are flagged for review in the app
+HEADER_LINES = 3  # Lines at the top of the receipt treated as the vendor block
+ROI_PADDING = 6
+
+_DATA_KEYS = ("block_num", "par_num", "line_num", "left", "top", "width", "height", "conf", "text")
+
+
+class PytesseractBackend:
+    """Default backend. Spawns a tesseract process and writes a temp file for every image."""
+    name = "pytesseract"
+
+    def image_to_string(self, img):
+        return _pytesseract().image_to_string(img)
+
+    def image_to_data(self, img):
+        pytesseract = _pytesseract()
+        return pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+
+
+class TesserocrBackend:
+    """Keeps a Tesseract API instance alive per thread and hands it images in memory.
+
+    Needs the optional `tesserocr` package. Each thread (and each batch worker process)
+    pays the model load once, after which an image costs only the recognition itself.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang="eng"):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self._local = threading.local()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = self._tesserocr.PyTessBaseAPI(lang=self.lang)
+            self._local.api = api
+        return api
+
+    def image_to_string(self, img):
+        api = self._api()
+        api.SetImage(img)
+        return api.GetUTF8Text()
+
+    def image_to_data(self, img):
+        """Word boxes and confidences in the same dict layout pytesseract.image_to_data uses."""
+        RIL = self._tesserocr.RIL
+        api = self._api()
+        api.SetImage(img)
+        api.Recognize()
+
+        data = {key: [] for key in _DATA_KEYS}
+        block = par = line = 0
+        for word in self._tesserocr.iterate_level(api.GetIterator(), RIL.WORD):
+            if word.IsAtBeginningOf(RIL.BLOCK):
+                block += 1
+            if word.IsAtBeginningOf(RIL.PARA):
+                par += 1
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+            box = word.BoundingBox(RIL.WORD)
+            if box is None:
+                continue
+            left, top, right, bottom = box
+            for key, value in zip(_DATA_KEYS, (block, par, line, left, top, right - left, bottom - top,
+                                               word.Confidence(RIL.WORD), word.GetUTF8Text(RIL.WORD))):
+                data[key].append(value)
+        return data
+
+
+OCR_BACKENDS = {
+    "pytesseract": PytesseractBackend,
+    "tesserocr": TesserocrBackend,
+}
+
+_backend_instances = {}
+
+
+def get_ocr_backend(name=None):
+    """Returns a shared instance of the named (or configured) OCR backend."""
+    name = name or OCR_BACKEND
+    if name not in _backend_instances:
+        if name not in OCR_BACKENDS:
+            raise ValueError(f"Unknown OCR backend '{name}'. Choose one of: {', '.join(OCR_BACKENDS)}")
+        _backend_instances[name] = OCR_BACKENDS[name]()
+    return _backend_instances[name]
+
+
+@perf.timed("categorize")
 def categorize_vendor(vendor_name, full_text=""):
     # Check the database first
     saved_category = get_category_from_db(vendor_name)
     if saved_category:
         return saved_category
 
-    # Fallback to General Keywords
-    general_keywords = {
-        'Groceries': ['supermarket', 'mart', 'food', 'grocery', 'store'],
-        'Dining': ['cafe', 'restaurant', 'kitchen', 'grill', 'pub', 'coffee', 'pizza'],
-        'Transport': ['fuel', 'gas', 'station', 'taxi', 'transit']
-    }
-
-    for category, tags in general_keywords.items():
-        if any(tag in vendor_name.lower() for tag in tags):
-            return category
-
-    return "Uncategorized"
+    # Fallback to the compiled keyword rules, scanned over the vendor and the whole receipt at once
+    with perf.stage("categorize.rules"):
+        categorizer = get_categorizer(get_vendor_map_version(), get_learned_vendors, current_db())
+        return categorizer.categorize(vendor_name, full_text)
 
 
 def extract_vendor(lines):
-    blacklist = ["RECEIPT", "TAX INVOICE", "INVOICE", "WELCOME"]
-    for line in lines:
-        clean_line = line.strip()
-        # Skip empty lines or generic titles
-        if clean_line and not any(word in clean_line.upper() for word in blacklist):
-            return clean_line
-    return "Unknown Vendor"
+    return extractor.extract_vendor(lines)
 
 
 def extract_date(text):
     """Finds a date and converts it to DD/MM/YY format."""
-    # Look for the word 'Date' followed by characters and then something that looks like a date
-    date_keyword_match = re.search(r"Date[:\s]+([A-Za-z0-9/\s,.-]+)", text, re.IGNORECASE)
-
-    if date_keyword_match:
-        raw_date = date_keyword_match.group(1).split('\n')[0].strip()
-        try:
-            # dateutil.parser is smart: it handles "April 9/2025" or "09-04-2025"
-            parsed_date = parser.parse(raw_date, fuzzy=True)
-            return parsed_date.strftime("%d/%m/%y")
-        except (ValueError, OverflowError):
-            pass
-
-    # Fallback to standard numeric DD/MM/YYYY search if keyword search fails
-    numeric_match = re.search(r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})', text)
-    if numeric_match:
-        try:
-            parsed_date = parser.parse(numeric_match.group(0))
-            return parsed_date.strftime("%d/%m/%y")
-        except:
-            pass
-
-    return datetime.now().strftime("%d/%m/%y")
+    return extractor.extract_fields(text)["date"]
 
 
 def extract_total(text):
     """Target the absolute final total, ignoring subtotals."""
-    # Search for 'Total Paid' specifically first (strongest signal)
-    # This regex looks for 'Total Paid', skips non-digits, and grabs the number
-    final_match = re.search(r"Total Paid\s*[^\d]*([\d,.]+)", text, re.IGNORECASE)
+    return extractor.extract_fields(text)["total"]
+
+
+def read_image_bytes(image_file):
+    """Accepts a path, a Streamlit UploadedFile or any file-like object and returns its raw bytes."""
+    if isinstance(image_file, (str, os.PathLike)):
+        with open(image_file, 'rb') as f:
+            return f.read()
+    if hasattr(image_file, 'getvalue'):
+        return image_file.getvalue()
+    image_file.seek(0)
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+
+def group_lines(data, scale=1.0):
+    """Collapses image_to_data word rows into text lines with a box and mean confidence.
+
+    Boxes are divided by `scale` so a low-res pass maps back onto the full-size image.
+    """
+    lines = {}
+    for i, word in enumerate(data['text']):
+        word = str(word).strip()
+        conf = float(data['conf'][i])
+        if not word or conf < 0:
+            continue
+        left, top = data['left'][i] / scale, data['top'][i] / scale
+        right, bottom = left + data['width'][i] / scale, top + data['height'][i] / scale
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        line = lines.get(key)
+        if line is None:
+            lines[key] = {"words": [word], "confs": [conf], "box": [left, top, right, bottom]}
+        else:
+            line["words"].append(word)
+            line["confs"].append(conf)
+            box = line["box"]
+            line["box"] = [min(box[0], left), min(box[1], top), max(box[2], right), max(box[3], bottom)]
+
+    return [{"text": " ".join(line["words"]), "conf": sum(line["confs"]) / len(line["confs"]), "box": line["box"]}
+            for line in lines.values()]
+
+
+def find_field_lines(lines):
+    """Picks the line indices each field is read from: header block, total line and date line."""
+    texts = [line["text"] for line in lines]
+    total_idx = next((i for i, t in enumerate(texts) if re.search(r"total paid", t, re.IGNORECASE)), None)
+    if total_idx is None:
+        total_idx = next((i for i, t in enumerate(texts) if re.search(r"(?<!sub)total", t, re.IGNORECASE)), None)
+    date_idx = next((i for i, t in enumerate(texts) if re.search(r"date", t, re.IGNORECASE)), None)
+    if date_idx is None:
+        date_idx = next((i for i, t in enumerate(texts) if re.search(r"\d{1,2}[/-]\d{1,2}[/-]\d{2,4}", t)), None)
+
+    return {
+        "vendor": list(range(min(HEADER_LINES, len(lines)))),
+        "total": [total_idx] if total_idx is not None else [],
+        "date": [date_idx] if date_idx is not None else [],
+    }
+
+
+def ocr_two_pass(img, backend):
+    """Fast mode: a low-res pass over the page, then full-res re-scans of weak field regions only.
+
+    Returns the assembled text and a 0-100 confidence per field.
+    """
+    small = img
+    if FAST_SCALE < 1:
+        small = img.resize((max(1, int(img.width * FAST_SCALE)), max(1, int(img.height * FAST_SCALE))), Image.BILINEAR)
+    lines = group_lines(backend.image_to_data(small), FAST_SCALE)
+
+    confidence = {}
+    merged_into = {}  # Line index -> index of the re-scanned line that now holds its text
+    for field, idxs in find_field_lines(lines).items():
+        if not idxs:
+            confidence[field] = 0.0
+            continue
+        already_merged = any(i in merged_into for i in idxs)
+        current = [lines[merged_into.get(i, i)] for i in idxs]
+        conf = min(line["conf"] for line in current)
+
+        if conf < RESCAN_CONFIDENCE and not already_merged:
+            # Re-read the full width of the region: the value is often right-aligned away from its label
+            top = max(0, int(min(line["box"][1] for line in current)) - ROI_PADDING)
+            bottom = min(img.height, int(max(line["box"][3] for line in current)) + ROI_PADDING)
+            rescanned = group_lines(backend.image_to_data(img.crop((0, top, img.width, bottom))))
+            if rescanned:
+                new_conf = min(line["conf"] for line in rescanned)
+                lines[idxs[0]] = {"text": "\n".join(line["text"] for line in rescanned), "conf": new_conf,
+                                  "box": [0, top, img.width, bottom]}
+                for i in idxs[1:]:
+                    lines[i] = None
+                for i in idxs:
+                    merged_into[i] = idxs[0]
+                conf = new_conf
+        confidence[field] = round(conf, 1)
+
+    text = "\n".join(line["text"] for line in lines if line is not None)
+    return text, confidence
 
-    # If not found, look for 'Total' but NOT 'Subtotal'
-    if not final_match:
-        # Finds 'Total' as long as 'Sub' isn't right before it
-        final_match = re.search(r"(?<!Sub)Total\s*[^\d]*([\d,.]+)", text, re.IGNORECASE)
 
-    if final_match:
-        raw_val = final_match.group(1).replace(',', '')  # Remove thousands separator
-        try:
-            return float(raw_val)
-        except:
-            return 0.0
+def ocr_image(image_bytes, mode=None):
+    """Runs OCR on raw image bytes, reusing cached text for images we have already seen.
 
-    # Max number logic
-    amounts = re.findall(r"(\d+[.,]\d{2})", text)
-    return max([float(x.replace(',', '.')) for x in amounts]) if amounts else 0.0
+    Returns (text, confidence). Confidence is a per-field dict in fast mode and None in full mode.
+    """
+    mode = mode or OCR_MODE
+    backend = get_ocr_backend()
+    pre = steps_signature(PREPROCESS_STEPS) if PREPROCESS_ENABLED else "raw"
+    key = make_key(image_bytes, f"{OCR_CACHE_VERSION}:{backend.name}:{pre}:{mode}")
+    with perf.stage("ocr.cache_lookup"):
+        cached = get_cached_text(key)
+    if cached is not None:
+        if mode == "fast":
+            payload = json.loads(cached)
+            return payload["text"], payload["confidence"]
+        return cached, None
 
+    if PREPROCESS_ENABLED:
+        img, timings = preprocess_image(image_bytes, PREPROCESS_STEPS)
+        for step, seconds in timings.items():
+            perf.record("image.decode" if step == "decode" else f"image.{step}", seconds)
+    else:
+        with perf.stage("image.decode"):
+            img = Image.open(io.BytesIO(image_bytes))
+            img.load()
 
-def extract_receipt_data(image_file):
-    img = Image.open(image_file)
-    text = pytesseract.image_to_string(img)
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if mode == "fast":
+        with perf.stage("ocr.fast"):
+            text, confidence = ocr_two_pass(img, backend)
+        put_cached_text(key, json.dumps({"text": text, "confidence": confidence}))
+        return text, confidence
 
-    # Improved Vendor Logic from previous step
-    vendor = extract_vendor(lines)
+    with perf.stage("ocr.full"):
+        text = backend.image_to_string(img)
+    put_cached_text(key, text)
+    return text, None
 
-    # New Improved Total Logic
-    total = extract_total(text)
 
-    # New Standardized Date Logic
-    receipt_date = extract_date(text)
+@perf.timed("extract_receipt_data")
+def extract_receipt_data(image_file, mode=None):
+    text, confidence = ocr_image(read_image_bytes(image_file), mode)
 
-    category = categorize_vendor(vendor, text)
+    # Vendor, date, total, subtotal, tax and currency all come from one pass over the text
+    fields = extractor.extract_fields(text)
+    category = categorize_vendor(fields["vendor"], text)
 
     return {
-        "vendor": vendor,
-        "total": total,
-        "date": receipt_date,
+        "vendor": fields["vendor"],
+        "total": fields["total"],
+        "date": fields["date"],
         "category": category,
-        "raw_text": text
+        "subtotal": fields["subtotal"],
+        "tax": fields["tax"],
+        "currency": fields["currency"],
+        "raw_text": text,
+        "confidence": confidence
     }
@@ -0,0 +1,160 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import outbox
+from database import db_session, get_connection, use_owner
+from extractor import extract_fields
+from processor import categorize_vendor
+
+FIELDS = ("vendor", "date", "total", "category")
+
+
+PARSE_BATCH = 64  # Texts handed to a worker per task
+
+
+def _extract_chunk(texts):
+    # Pure text parsing, safe to run in worker processes. No date fallback: a receipt whose
+    # date can't be read keeps the one it was saved with instead of becoming "today" again
+    return [extract_fields(t, date_fallback=False) for t in texts]
+
+
+def iter_chunks(chunk_size=1000):
+    """Streams (id, vendor, total, date, category, raw_text, edited) rows in id order, one chunk at a time.
+
+    Keyset pagination on id keeps every query an index range scan and memory bounded by chunk_size.
+    """
+    last_id = 0
+    conn = get_connection()
+    while True:
+        rows = conn.execute("""SELECT id, vendor, total, date, category, raw_text, edited FROM receipts
+                               WHERE id > ? AND raw_text IS NOT NULL AND raw_text != ''
+                               ORDER BY id LIMIT ?""", (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield pd.DataFrame(rows, columns=["id", "vendor", "total", "date", "category", "raw_text", "edited"])
+        last_id = rows[-1][0]
+
+
+def reextract_chunk(chunk, fields=FIELDS, pool=None):
+    """Re-runs extraction on a chunk and returns a frame of the rows whose fields changed.
+
+    Fields listed in a row's `edited` column were set by the user and are never replaced.
+    """
+    texts = chunk["raw_text"].tolist()
+    if pool is not None:
+        parts = [texts[i:i + PARSE_BATCH] for i in range(0, len(texts), PARSE_BATCH)]
+        results = [r for part in pool.map(_extract_chunk, parts) for r in part]
+    else:
+        results = _extract_chunk(texts)
+
+    new = pd.DataFrame(results, index=chunk.index)
+    new["date"] = new["date"].fillna(chunk["date"])
+    if "category" in fields:
+        new["category"] = [categorize_vendor(v, t) for v, t in zip(new["vendor"], texts)]
+
+    # Column-wise comparison: strings compared after trimming, totals to the cent
+    changed = pd.DataFrame(index=chunk.index)
+    for field in fields:
+        if field == "total":
+            changed[field] = (pd.to_numeric(chunk[field], errors="coerce").round(2) != new[field].round(2))
+        else:
+            changed[field] = chunk[field].fillna("").astype(str).str.strip() != new[field].fillna("").astype(str)
+        if "edited" in chunk:
+            changed[field] &= ~chunk["edited"].fillna("").str.split(",").apply(lambda marks: field in marks)
+
+    mask = changed.any(axis=1)
+    out = chunk.loc[mask, ["id"] + list(fields)].copy()
+    for field in fields:
+        # A field that didn't change (or is the user's) is written back as it was
+        out[f"new_{field}"] = new.loc[mask, field].where(changed.loc[mask, field], chunk.loc[mask, field])
+    out.attrs["changed"] = changed[mask]
+    out.attrs["changed_counts"] = changed[mask].sum().to_dict()
+    return out
+
+
+def run(chunk_size=1000, fields=FIELDS, workers=1, dry_run=False, show=5, verbose=True, push=True):
+    """Re-extracts every stored receipt chunk by chunk, writing back only the rows that changed.
+
+    Each chunk is its own transaction, so memory stays flat and an interrupted run keeps
+    the chunks it already finished. Unless push is off, every rewritten row queues a cloud update
+    of just the fields that changed, in the same transaction. Fields the user edited are left alone.
+    """
+    fields = tuple(fields)
+    scanned = updated = changed_rows = 0
+    per_field = {field: 0 for field in fields}
+    samples = []
+    start = time.perf_counter()
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for chunk in iter_chunks(chunk_size):
+            scanned += len(chunk)
+            diff = reextract_chunk(chunk, fields, pool)
+            changed_rows += len(diff)
+            for field, count in diff.attrs["changed_counts"].items():
+                per_field[field] += int(count)
+            if len(samples) < show:
+                samples.extend(diff.head(show - len(samples)).to_dict("records"))
+            if diff.empty or dry_run:
+                continue
+
+            set_clause = ", ".join(f"{field} = ?" for field in fields)
+            params = diff[[f"new_{field}" for field in fields] + ["id"]].itertuples(index=False, name=None)
+            with db_session(immediate=True) as conn:
+                conn.executemany(f"UPDATE receipts SET {set_clause} WHERE id = ?", list(params))
+                if push:
+                    for row, mask in zip(diff.to_dict("records"), diff.attrs["changed"].itertuples(index=False)):
+                        outbox.enqueue("update", "", int(row["id"]),
+                                       {field: row[f"new_{field}"] for field, hit in zip(fields, mask) if hit})
+            updated += len(diff)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if push and updated:
+        outbox.get_flusher().drain()  # Whatever doesn't make it now goes out when the app next starts
+
+    elapsed = time.perf_counter() - start
+    if verbose:
+        for row in samples:
+            print(f"#{row['id']}: " + ", ".join(
+                f"{field} {row[field]!r} -> {row[f'new_{field}']!r}" for field in fields
+                if row[field] != row[f"new_{field}"]))
+        changes = ", ".join(f"{field} {count}" for field, count in per_field.items())
+        action = "would update" if dry_run else "updated"
+        print(f"\nScanned {scanned} receipts in {elapsed:.2f}s, {action} "
+              f"{changed_rows if dry_run else updated} ({changes})")
+    return {"scanned": scanned, "updated": updated, "changed": changed_rows, "per_field": per_field,
+            "seconds": elapsed}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Re-run field extraction over the OCR text already stored locally")
+    arg_parser.add_argument("--fields", default=",".join(FIELDS),
+                            help=f"Comma-separated fields to refresh (default: {','.join(FIELDS)})")
+    arg_parser.add_argument("--chunk-size", type=int, default=1000, help="Rows read and written per transaction")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="Processes for the text parsing, 0 for all cores (default: 1)")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    arg_parser.add_argument("--show", type=int, default=5, help="Example changes to print")
+    arg_parser.add_argument("--local-only", action="store_true", help="Don't queue the changes for the cloud sheet")
+    arg_parser.add_argument("--owner", help="Whose database to reprocess (default: the shared expenses.db)")
+    args = arg_parser.parse_args(argv)
+
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        arg_parser.error(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    if args.owner:
+        use_owner(args.owner)
+    run(args.chunk_size, fields, args.workers or os.cpu_count() or 1, args.dry_run, args.show, push=not args.local_only)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
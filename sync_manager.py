@@ -1,110 +1,375 @@
+import os
+import re
+import threading
+import time
+
 import pandas as pd
-from streamlit_gsheets import GSheetsConnection
-import sqlite3
-import streamlit as st
-import requests
-import gspread
-from google.oauth2.service_account import Credentials
-
-def pull_from_cloud(owner_name):
+from urllib.parse import quote
+import perf
+from database import get_sync_mark, merge_cloud_rows
+
+SHEET_ID = "1jlQXj8mvRc8Q-RBmBCqQTkMXxqvIWfXChuOQtXOd1BQ"
+SHEET_EXPORT_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=csv&gid=0"
+# The visualization endpoint runs a query server side, so only the owner's new rows are downloaded
+SHEET_QUERY_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/gviz/tq?tqx=out:csv&headers=1&sheet=receipts"
+
+SHEET_COLUMNS = ['id', 'owner', 'vendor', 'total', 'date', 'category', 'raw_text']  # Sheet columns A..G
+LOCAL_COLUMNS = ['id', 'vendor', 'total', 'date', 'category', 'raw_text']
+
+
+def _normalize_sheet(df):
+    df.columns = df.columns.str.strip().str.lower()
+    df['id'] = pd.to_numeric(df['id'], errors='coerce')
+    df = df[df['id'].notna()].copy()
+    df['id'] = df['id'].astype(int)
+    return df
+
+
+@perf.timed("cloud.fetch")
+def fetch_cloud_rows(owner_name, after_id=0, export_url=SHEET_EXPORT_URL, query_url=SHEET_QUERY_URL):
+    """Sheet rows for one owner with an id above `after_id`.
+
+    Asks the query endpoint to filter server side first and falls back to downloading the
+    whole export and filtering it here. Either URL may point at a local CSV stand-in.
+    """
     clean_owner_name = str(owner_name).strip().lower()
-    csv_url = "https://docs.google.com/spreadsheets/d/1jlQXj8mvRc8Q-RBmBCqQTkMXxqvIWfXChuOQtXOd1BQ/export?format=csv&gid=0"
+    cloud_df = None
 
-    try:
-        # Silent read
-        cloud_df = pd.read_csv(csv_url)
+    if query_url and '"' not in clean_owner_name:
+        query = f'select * where A > {int(after_id)} and lower(B) = "{clean_owner_name}"'
+        try:
+            cloud_df = pd.read_csv(f"{query_url}&tq={quote(query)}")
+            missing = set(SHEET_COLUMNS[:2]) - set(cloud_df.columns.str.strip().str.lower())
+            if missing:
+                cloud_df = None
+        except Exception:
+            cloud_df = None
 
-        if cloud_df is not None and not cloud_df.empty:
-            cloud_df.columns = cloud_df.columns.str.strip().str.lower()
+    if cloud_df is None:
+        cloud_df = pd.read_csv(export_url)
 
-            # Filter for user
-            mask = cloud_df['owner'].astype(str).str.strip().str.lower() == clean_owner_name
-            user_data = cloud_df[mask]
+    if cloud_df.empty:
+        return cloud_df
+    cloud_df = _normalize_sheet(cloud_df)
+    # Re-applied after a server-side query too; it is cheap and guards against a sheet that ignores tq
+    mask = (cloud_df['owner'].astype(str).str.strip().str.lower() == clean_owner_name) & (cloud_df['id'] > after_id)
+    return cloud_df[mask]
 
-            if not user_data.empty:
-                db_conn = sqlite3.connect('expenses.db')
 
-                # Use the ID you already added
-                needed_cols = ['id', 'vendor', 'total', 'date', 'category', 'raw_text']
-                existing_cols = [col for col in needed_cols if col in user_data.columns]
+@perf.timed("cloud.pull")
+def pull_from_cloud(owner_name, export_url=SHEET_EXPORT_URL, query_url=SHEET_QUERY_URL):
+    """Pulls rows added to the sheet since the last pull and upserts them into `receipts` by id.
 
-                local_df = user_data[existing_cols]
-                local_df.to_sql('receipts', db_conn, if_exists='replace', index=False)
-                db_conn.close()
-                return True
-        return False
+    The per-owner high-water mark lives in `settings`; clear_receipts() resets it, which makes
+    the next pull a full one. Rows edited or deleted directly in the sheet are not picked up.
+    """
+    clean_owner_name = str(owner_name).strip().lower()
+
+    try:
+        user_data = fetch_cloud_rows(clean_owner_name, get_sync_mark(clean_owner_name), export_url, query_url)
+        if user_data.empty:
+            return False
+
+        local_df = user_data.reindex(columns=LOCAL_COLUMNS)
+        local_df = local_df.astype(object).where(local_df.notna(), None)
+        merge_cloud_rows(clean_owner_name, list(local_df.itertuples(index=False, name=None)))
+        return True
     except Exception:
         # Stay silent unless there is a major crash
         return False
 
 
-def push_to_cloud(owner_name, data):
+def _clean_total(value):
+    raw_total = str(value if value is not None else '0').replace('$', '').replace(',', '').strip()
+    try:
+        return float(raw_total)
+    except ValueError:
+        return 0.0
+
+
+EDIT_COLUMNS = {'vendor': 'C', 'total': 'D', 'date': 'E', 'category': 'F'}
+
+
+def _sheet_value(field, value):
+    return _clean_total(value) if field == 'total' else str(value if value is not None else '').strip()
+
+
+def sheet_row(cloud_id, owner_name, data):
+    return [
+        cloud_id,
+        str(owner_name).lower().strip(),
+        str(data.get('vendor', 'Unknown')).strip(),
+        _clean_total(data.get('total', '0')),
+        str(data.get('date', '')).strip(),
+        str(data.get('category', 'Misc')).strip(),
+        str(data.get('raw_text', ''))[:500]  # Limit text length to avoid overflow
+    ]
+
+
+class FakeWorksheet:
+    """In-memory stand-in for the gspread worksheet, for offline runs and benchmarks.
+
+    `latency` is added to every API call and `fail_next` makes that many calls raise.
+    """
+
+    def __init__(self, latency=0.0, fail_next=0):
+        self.rows = [list(SHEET_COLUMNS)]
+        self.latency = latency
+        self.fail_next = fail_next
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise ConnectionError("fake worksheet: injected failure")
+
+    def get_all_values(self):
+        self._call()
+        return [[str(v) for v in row] for row in self.rows]
+
+    def col_values(self, col):
+        self._call()
+        return [str(row[col - 1]) if len(row) >= col else '' for row in self.rows]
+
+    def append_row(self, values, value_input_option=None):
+        return self.append_rows([values], value_input_option)
+
+    def append_rows(self, values, value_input_option=None):
+        self._call()
+        start = len(self.rows) + 1
+        self.rows.extend(list(v) for v in values)
+        return {"updates": {"updatedRange": f"receipts!A{start}:G{len(self.rows)}"}}
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call()
+        del self.rows[start_index - 1:(end_index or start_index)]
+
+    def _cells(self, a1):
+        first_col, first_row, last_col, last_row = _A1_RANGE.fullmatch(a1.split("!")[-1]).groups()
+        cols = range(_column_index(first_col), _column_index(last_col or first_col) + 1)
+        return cols, range(int(first_row), int(last_row or first_row) + 1)
+
+    def batch_get(self, ranges):
+        self._call()
+        result = []
+        for a1 in ranges:
+            cols, rows = self._cells(a1)
+            result.append([[str(self.rows[r - 1][c]) for c in cols if c < len(self.rows[r - 1])]
+                           for r in rows if r <= len(self.rows)])
+        return result
+
+    def batch_update(self, data, value_input_option=None):
+        self._call()
+        for item in data:
+            cols, rows = self._cells(item["range"])
+            for r, values in zip(rows, item["values"]):
+                for c, value in zip(cols, values):
+                    self.rows[r - 1][c] = value
+
+    id = 0
+
+    @property
+    def spreadsheet(self):
+        return _FakeSpreadsheet(self)
+
+
+class _FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def batch_update(self, body):
+        # Only the deleteDimension requests CloudWriter sends
+        self.worksheet._call()
+        for request in body["requests"]:
+            span = request["deleteDimension"]["range"]
+            del self.worksheet.rows[span["startIndex"]:span["endIndex"]]
+
+
+def _column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - ord("A") + 1
+    return index - 1
+
+
+_A1_RANGE = re.compile(r"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?")
+
+
+@perf.timed("cloud.connect")
+def _open_gsheets_worksheet():
+    # The Google client stack is only loaded once something actually talks to the sheet
+    import gspread
+    import streamlit as st
+    from google.oauth2.service_account import Credentials
+
     scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+    creds_dict = st.secrets["connections"]["gsheets"]
+    credentials = Credentials.from_service_account_info(creds_dict, scopes=scope)
+    client = gspread.authorize(credentials)
+    return client.open_by_key(SHEET_ID).worksheet("receipts")
 
-    try:
-        creds_dict = st.secrets["connections"]["gsheets"]
-        credentials = Credentials.from_service_account_info(creds_dict, scopes=scope)
-        client = gspread.authorize(credentials)
-        sheet_id = "1jlQXj8mvRc8Q-RBmBCqQTkMXxqvIWfXChuOQtXOd1BQ"
-        spreadsheet = client.open_by_key(sheet_id)
-        worksheet = spreadsheet.worksheet("receipts")
-        raw_total = str(data.get('total', '0')).replace('$', '').replace(',', '').strip()
+
+CLOUD_BACKENDS = {
+    "gsheets": _open_gsheets_worksheet,
+    "fake": FakeWorksheet,
+}
+CLOUD_BACKEND = os.environ.get("RECEIPT_CLOUD_BACKEND", "gsheets")
+
+_worksheets = {}
+_worksheet_lock = threading.Lock()
+
+
+def get_worksheet(name=None):
+    """The process-wide worksheet handle, authorized once instead of on every call."""
+    name = name or CLOUD_BACKEND
+    with _worksheet_lock:
+        if name not in _worksheets:
+            try:
+                _worksheets[name] = CLOUD_BACKENDS[name]()
+            except KeyError:
+                raise ValueError(f"Unknown cloud backend {name!r}, expected one of {sorted(CLOUD_BACKENDS)}")
+        return _worksheets[name]
+
+
+def reset_worksheet(name=None):
+    # Drops the cached handle, e.g. after an auth error, so the next call re-authorizes
+    with _worksheet_lock:
+        _worksheets.pop(name or CLOUD_BACKEND, None)
+
+
+class CloudWriter:
+    """Applies queued receipts to the sheet in batches.
+
+    Column A (the ids) is read once and then tracked locally as an id -> sheet row index, so
+    picking the next id or finding a row to edit never downloads the sheet. The index is
+    re-read when an append lands somewhere unexpected, a spot check of the target rows finds
+    different ids (someone else changed the sheet), or a call fails.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self._ids = None  # Column A below the header, in sheet order
+
+    @perf.timed("cloud.read_ids")
+    def _load(self):
+        if self._ids is None:
+            self._ids = self.worksheet.col_values(1)[1:]
+            self._reindex()
+            numeric = [int(v) for v in self._ids if str(v).strip().isdigit()]
+            self._next_id = max(numeric, default=0) + 1
+
+    def _reindex(self):
+        self._rows = {str(v).strip(): i + 2 for i, v in enumerate(self._ids)}  # Row 1 is the header
+
+    def invalidate(self):
+        self._ids = None
+
+    def row_of(self, cloud_id):
+        self._load()
+        return self._rows.get(str(cloud_id).strip())
+
+    def assign_ids(self, entries):
+        """Cloud id for each outbox entry, keeping ids assigned on an earlier attempt."""
+        self._load()
+        ids = {}
+        for entry in entries:
+            cloud_id = entry["cloud_id"]
+            if cloud_id is None:
+                cloud_id = self._next_id
+            self._next_id = max(self._next_id, cloud_id + 1)
+            ids[entry["seq"]] = cloud_id
+        return ids
+
+    @perf.timed("cloud.append")
+    def append(self, entries, ids):
+        """Writes the entries in one append_rows call, skipping any an earlier attempt already wrote."""
+        self._load()
+        fresh = [e for e in entries if str(ids[e["seq"]]) not in self._rows]
+        if not fresh:
+            return
+        rows = [sheet_row(ids[e["seq"]], e["owner"], e["payload"]) for e in fresh]
+        expected_start = len(self._ids) + 2
         try:
-            clean_total = float(raw_total)
-        except:
-            clean_total = 0.0
-        new_id = len(worksheet.get_all_values())
-
-        row_to_send = [
-            new_id,
-            str(owner_name).lower().strip(),
-            str(data.get('vendor', 'Unknown')).strip(),
-            clean_total,
-            str(data.get('date', '')).strip(),
-            str(data.get('category', 'Misc')).strip(),
-            str(data.get('raw_text', ''))[:500]  # Limit text length to avoid overflow
-        ]
-
-        worksheet.append_row(row_to_send, value_input_option='USER_ENTERED')
-
-        st.toast("✅ SUCCESS: Data is in the Cloud!")
-        return True
+            result = self.worksheet.append_rows(rows, value_input_option='USER_ENTERED')
+        except Exception:
+            # The rows may or may not have landed; re-read the ids before the retry
+            self.invalidate()
+            raise
 
-    except Exception as e:
-        st.error(f"❌ CLOUD ERROR: {e}")
-        # This will show us if the error is "API Not Enabled" or "Permission Denied"
-        if "API" in str(e):
-            st.info("ACTION REQUIRED: Enable 'Google Sheets API' AND 'Google Drive API' in Google Cloud Console.")
-        st.stop()
-        return False
+        updated = str((result or {}).get("updates", {}).get("updatedRange", ""))
+        start_row = re.search(r"![A-Z]+(\d+)", updated)
+        if start_row and int(start_row.group(1)) != expected_start:
+            self.invalidate()
+        else:
+            for i, row in enumerate(rows):
+                self._ids.append(str(row[0]))
+                self._rows[str(row[0])] = expected_start + i
 
+    def _locate(self, owners):
+        """Sheet rows for the cloud ids in `owners` (id -> owner), checked with one batch_get.
 
-def delete_from_cloud(receipt_id):
-    scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    try:
-        creds_dict = st.secrets["connections"]["gsheets"]
-        credentials = Credentials.from_service_account_info(creds_dict, scopes=scope)
-        client = gspread.authorize(credentials)
-
-        spreadsheet = client.open_by_key("1jlQXj8mvRc8Q-RBmBCqQTkMXxqvIWfXChuOQtXOd1BQ")
-        worksheet = spreadsheet.worksheet("receipts")
-
-        # Find the row
-        all_rows = worksheet.get_all_values()
-        target_str = str(receipt_id).strip()
-
-        row_idx = -1
-        for i, row in enumerate(all_rows):
-            # Column A is index 0
-            if str(row[0]).strip() == target_str:
-                row_idx = i + 1
-                break
-
-        if row_idx != -1:
-            worksheet.delete_rows(row_idx)
-            print(f"✅ Cloud: Deleted row {row_idx}")
-            return True
-        return False
-    except Exception as e:
-        print(f"❌ Cloud Error: {e}")
-        return False
\ No newline at end of file
+        A row only counts if column A still holds the id and column B the owner, so a stale id
+        never touches another user's row. Re-reads column A once on drift.
+        """
+        for attempt in range(2):
+            self._load()
+            rows = {cid: self._rows[cid] for cid in owners if cid in self._rows}
+            if not rows:
+                return rows
+            cells = self.worksheet.batch_get([f"A{row}:B{row}" for row in rows.values()])
+            found = [[str(v).strip() for v in c[0]] if c and c[0] else [] for c in cells]
+            if [f[0] if f else None for f in found] == list(rows) or attempt:
+                return {cid: row for (cid, row), seen in zip(rows.items(), found)
+                        if seen[:1] == [cid] and [v.lower() for v in seen[1:2]] == [owners[cid]]}
+            self.invalidate()
+
+    @perf.timed("cloud.mutate")
+    def mutate(self, entries):
+        """Applies queued updates and deletes: one read to check the rows, one write for all the
+        edits and one for all the deletes, however many receipts changed.
+        """
+        latest = {}  # cloud id -> merged fields, or None once deleted
+        owners = {}
+        unsent = 0
+        for e in entries:
+            if e["cloud_id"] is None:
+                unsent += 1  # The receipt never reached the sheet, e.g. it was saved with the cloud off
+                continue
+            cid = str(e["cloud_id"]).strip()
+            owners[cid] = str(e["owner"] or "").strip().lower()
+            if e["op"] == "delete":
+                latest[cid] = None
+            elif latest.get(cid, {}) is not None:
+                latest[cid] = {**latest.get(cid, {}), **e["payload"]}
+
+        try:
+            rows = self._locate(owners)
+            # Only the fields that changed, so a partial edit never blanks the others
+            edits = [{"range": f"{EDIT_COLUMNS[field]}{row}", "values": [[_sheet_value(field, value)]]}
+                     for cid, row in rows.items() if latest[cid] is not None
+                     for field, value in latest[cid].items() if field in EDIT_COLUMNS]
+            if edits:
+                self.worksheet.batch_update(edits, value_input_option='USER_ENTERED')
+
+            # Bottom-up, so removing one row never shifts the ones still to be removed
+            doomed = sorted((row for cid, row in rows.items() if latest[cid] is None), reverse=True)
+            if doomed:
+                self.worksheet.spreadsheet.batch_update({"requests": [
+                    {"deleteDimension": {"range": {"sheetId": self.worksheet.id, "dimension": "ROWS",
+                                                   "startIndex": row - 1, "endIndex": row}}}
+                    for row in doomed]})
+                for row in doomed:
+                    del self._ids[row - 2]
+                self._reindex()
+        except Exception:
+            self.invalidate()
+            raise
+
+        missing = [cid for cid in latest if cid not in rows]
+        if missing:
+            print(f"❓ Cloud: no row of this owner for cloud ids {', '.join(missing)}")
+        if unsent:
+            print(f"❓ Cloud: {unsent} change(s) to receipts that were never uploaded")
@@ -0,0 +1,124 @@
+import math
+import re
+import threading
+
+# Characters Tesseract commonly swaps for letters in shop names
+OCR_CONFUSIONS = str.maketrans({"0": "o", "1": "l", "5": "s", "8": "b", "|": "l", "$": "s", "@": "a"})
+FUZZY_THRESHOLD = 0.75  # Dice similarity over character trigrams
+
+
+def normalize_vendor(name):
+    """Exact-match key: case-folded with whitespace collapsed."""
+    return " ".join(str(name).casefold().split())
+
+
+def fuzzy_normalize(name):
+    text = normalize_vendor(name).translate(OCR_CONFUSIONS)
+    return " ".join(re.sub(r"[^a-z0-9 ]+", " ", text).split())
+
+
+def trigrams(name):
+    padded = f"  {fuzzy_normalize(name)} "
+    if len(padded) <= 3:
+        return set()
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class VendorIndex:
+    """In-memory vendor -> category map with exact and trigram (fuzzy) lookup.
+
+    Exact hits (including pure OCR character swaps) are dict lookups. Fuzzy lookups use prefix
+    filtering: a name can only reach the similarity threshold if it shares one of the query's
+    rarest trigrams, so only those posting lists are scanned, rarest first, stopping as soon as
+    no remaining vendor could beat the best match.
+    """
+
+    def __init__(self, rows=(), threshold=FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._exact = {}  # normalized key -> (vendor, category)
+        self._folded = {}  # fuzzy-normalized name -> normalized key, catches pure OCR character swaps
+        self._grams = {}  # normalized key -> trigram set
+        self._postings = {}  # trigram -> set of normalized keys
+        for vendor, category in rows:
+            self.set(vendor, category)
+
+    def __len__(self):
+        return len(self._exact)
+
+    def set(self, vendor, category):
+        key = normalize_vendor(vendor)
+        if not key:
+            return
+        with self._lock:
+            self._exact[key] = (vendor, category)
+            self._folded[fuzzy_normalize(vendor)] = key
+            if key not in self._grams:
+                grams = trigrams(vendor)
+                self._grams[key] = grams
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, vendor):
+        key = normalize_vendor(vendor)
+        with self._lock:
+            self._exact.pop(key, None)
+            folded = fuzzy_normalize(vendor)
+            if self._folded.get(folded) == key:
+                del self._folded[folded]
+            for gram in self._grams.pop(key, ()):
+                keys = self._postings.get(gram)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self._postings[gram]
+
+    def get(self, vendor, fuzzy=True):
+        """Returns the learned category for a vendor name, or None."""
+        key = normalize_vendor(vendor)
+        # Reads hold the lock too: set() and remove() patch the posting sets in place, and
+        # iterating a set while another thread adds to it raises
+        with self._lock:
+            hit = self._exact.get(key)
+            if hit is not None:
+                return hit[1]
+            if not fuzzy:
+                return None
+            folded = self._folded.get(fuzzy_normalize(vendor))
+            if folded is not None:
+                return self._exact[folded][1]
+            match = self._best_match(vendor)
+            return self._exact[match[0]][1] if match else None
+
+    def best_match(self, vendor):
+        """Returns (normalized key, similarity) of the closest learned vendor above the threshold."""
+        with self._lock:
+            return self._best_match(vendor)
+
+    def _best_match(self, vendor):
+        query = trigrams(vendor)
+        if not query:
+            return None
+
+        # Dice >= t needs an overlap of at least t*|q|/(2-t) trigrams, so any match must
+        # contain one of the |q| - min_overlap + 1 rarest ones
+        size = len(query)
+        min_overlap = max(1, math.ceil(self.threshold * size / (2 - self.threshold)))
+        ordered = sorted(query, key=lambda g: len(self._postings.get(g, ())))
+
+        best = None
+        seen = set()
+        for k, gram in enumerate(ordered[:size - min_overlap + 1], start=1):
+            for key in self._postings.get(gram, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                grams = self._grams[key]
+                score = 2 * len(query & grams) / (size + len(grams))
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (key, score)
+            # A vendor missing all k rarest trigrams can share at most size - k, which caps its score;
+            # once the best match beats that cap, the longer posting lists cannot do better
+            if best is not None and best[1] >= 2 * (size - k) / (2 * size - k):
+                break
+        return best